@@ -0,0 +1,263 @@
+"""
+Benchmarks of the controller pipeline, without RabbitMQ or real instruments.
+
+A `Controller` runs against the in-process broker of `memory_broker.py` and the simulated
+instruments of `sim_instruments.py`, and is driven by a `LabClient` from the user terminal with at
+most `window` commands in flight. With `--transport local` or `unix`, the controller and client
+talk over the in-process or Unix-socket transport instead of the broker stand-in. Every run is
+seeded, so the workload and the instrument jitter are the same from run to run. Scenarios:
+    mixed           : ask/write/sleep mix over a few stations of power supplies and VNAs
+    many_stations   : queries spread over 64 single-instrument stations
+    large_traces    : streamed (`trace`) and recorded (`s11`) VNA traces of 20001 points
+    overload        : far more commands in flight than the stations accept (rejections are counted)
+
+Prints (or writes to --output) one JSON document:
+    {'environment': {...}, 'scenarios': {name: {'throughput', 'latency': {'p50', 'p99', ...},
+                                                'memory': {...}, 'errors', 'rejected', ...}}}
+Each scenario runs in its own process, so its peak RSS is its own. Latencies are client side,
+from publishing a command to receiving its (last) response, in s.
+
+    python benchmarks/bench.py [--scenario mixed] [--commands 5000] [--output results.json]
+"""
+from typing import Optional
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(ROOT, 'lab_interface'), os.path.join(ROOT, 'user_terminal')]
+
+from amqp_pool import ConnectionPool
+from controller import Controller
+from transport import AMQPTransport, LocalTransport, UnixSocketTransport
+from user_terminal import LabClient, connect_client
+
+from memory_broker import MemoryBroker
+from sim_instruments import SimResourceManager, SimSpec
+
+
+# workload: {command: weight}; commands are (cmd, args) for a power supply ('psu') or a VNA ('vna')
+COMMANDS = {
+    'ask': {'psu': ('ask', ['MEAS:CURR?']), 'vna': ('ask', ['SENSE:AVERAGE:COUNT?'])},
+    'write': {'psu': ('write', ['VOLT 1.00']), 'vna': ('write', ['SENSE:AVERAGE:COUNT 1'])},
+    'sleep': {'psu': ('sleep', [0.001]), 'vna': ('sleep', [0.001])},
+    'trace': {'vna': ('trace', ['S11', 1024])},
+    's11': {'vna': ('s11', [])},
+}
+
+SCENARIOS = {
+    'mixed': dict(stations=4, psus=2, vnas=1, mix={'ask': 6, 'write': 3, 'sleep': 1},
+                  commands=5000, window=64, latency=0.0005, jitter=0.0005, reply_size=16),
+    'many_stations': dict(stations=64, psus=1, vnas=0, mix={'ask': 1},
+                          commands=10000, window=256, latency=0.0005, jitter=0.0005, reply_size=16),
+    'large_traces': dict(stations=2, psus=0, vnas=2, mix={'trace': 1, 's11': 1},
+                         commands=200, window=8, latency=0.001, jitter=0.001, trace_points=20001),
+    'overload': dict(stations=2, psus=2, vnas=0, mix={'ask': 1}, station_capacity=16,
+                     commands=5000, window=2000, latency=0.002, jitter=0.002, reply_size=16),
+}
+DEFAULTS = dict(psus=0, vnas=0, latency=0.0005, jitter=0., reply_size=16, trace_points=201,
+                station_capacity=256, warmup=100)
+
+
+def make_instruments(cfg: dict) -> dict:
+    """{station: {resource name: (kind, SimSpec)}} for the scenario `cfg`."""
+    stations = {}
+    n = 0
+    for s in range(cfg['stations']):
+        station = stations[f"station_{s}"] = {}
+        for kind, inst_type, count in (('psu', 'PowerSupply', cfg['psus']), ('vna', 'VNA', cfg['vnas'])):
+            for _ in range(count):
+                spec = SimSpec(inst_type, f"{kind}{n}", latency=cfg['latency'], jitter=cfg['jitter'],
+                               reply_size=cfg['reply_size'], trace_points=cfg['trace_points'])
+                station[f"SIM{n}::INSTR"] = (kind, spec)
+                n += 1
+    return stations
+
+
+def make_workload(cfg: dict, instruments: list, n: int, rng: random.Random) -> list:
+    """`n` commands (iid, station, cmd, args) drawn from the scenario's mix."""
+    names, weights = zip(*cfg['mix'].items())
+    workload = []
+    while len(workload) < n:
+        station, kind, spec = rng.choice(instruments)
+        name = rng.choices(names, weights)[0]
+        if kind in COMMANDS[name]:
+            cmd, args = COMMANDS[name][kind]
+            workload.append((spec.inst_id, station, cmd, args))
+    return workload
+
+
+def percentile(ordered: list, q: float) -> float:
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.
+
+
+async def drive(client: LabClient, workload: list, window: int, timeout: float) -> dict:
+    """Send `workload` with at most `window` commands in flight; returns the client-side statistics."""
+    slots = asyncio.Semaphore(window)
+    latencies, errors, rejected = [], [0], [0]
+
+    def done(future: asyncio.Future) -> None:
+        slots.release()
+        if future.cancelled() or future.exception() is not None:
+            errors[0] += 1
+            return
+        reply = future.result()
+        if reply.retry_after is not None:
+            rejected[0] += 1
+        elif reply.error:
+            errors[0] += 1
+        else:
+            latencies.append(reply.latency)
+
+    start = time.perf_counter()
+    futures = []
+    for iid, station, cmd, args in workload:
+        await slots.acquire()
+        future = await client.submit(iid, cmd, args, station=station)
+        future.add_done_callback(done)
+        futures.append(future)
+    finished, unfinished = await asyncio.wait(futures, timeout=timeout) if futures else ((), ())
+    duration = time.perf_counter() - start
+    for future in unfinished:
+        future.cancel()
+    latencies.sort()
+    return {'commands': len(workload), 'completed': len(latencies), 'errors': errors[0],
+            'rejected': rejected[0], 'lost': len(unfinished), 'duration': duration,
+            'throughput': len(latencies) / duration if duration else 0.,
+            'latency': {'mean': sum(latencies) / len(latencies) if latencies else 0.,
+                        'p50': percentile(latencies, .5), 'p90': percentile(latencies, .9),
+                        'p99': percentile(latencies, .99), 'max': latencies[-1] if latencies else 0.}}
+
+
+async def run_scenario(name: str, cfg: dict, seed: int=0, stages: bool=False, transport: str='amqp') -> dict:
+    """
+    Run scenario `name` (settings `cfg`, see `SCENARIOS`) on a fresh controller, over the broker
+    stand-in (`transport` 'amqp') or the 'local' or 'unix' transport."""
+    rng = random.Random(seed)
+    broker = MemoryBroker()
+    stations = make_instruments(cfg)
+    rm = SimResourceManager({rn: spec for station in stations.values() for rn, (_, spec) in station.items()}, seed)
+    with tempfile.TemporaryDirectory() as store_path:
+        if transport == 'amqp':
+            server = client_side = AMQPTransport(ConnectionPool('memory://bench', connect=broker.connect))
+        elif transport == 'local':
+            server = client_side = LocalTransport()
+        else:
+            path = os.path.join(store_path, 'bench.sock')
+            server, client_side = UnixSocketTransport(path), UnixSocketTransport(path)
+        controller = Controller(rm=rm, transport=server, cntrl_id='bench', store_path=store_path,
+                                station_capacity=cfg['station_capacity'])
+        controller.start()
+        try:
+            if transport == 'amqp':
+                await broker.wait_consumer(f"q_{controller.id}")
+            else:
+                await asyncio.sleep(0.01)   # let the controller start consuming (and listening)
+            client = await connect_client(client_side, cfg.get('codec'), echo=False)
+            for station, instruments in stations.items():
+                summary = await controller.create_interfaces_async(list(instruments), station)
+                if summary['failed']:
+                    raise RuntimeError(f"cannot connect simulated instruments: {summary['failed']}")
+
+            instruments = [(station, kind, spec) for station, d in stations.items() for kind, spec in d.values()]
+            timeout = max(60., 10 * cfg['commands'] * cfg['latency'])
+            await drive(client, make_workload(cfg, instruments, cfg['warmup'], rng), cfg['window'], timeout)
+            workload = make_workload(cfg, instruments, cfg['commands'], rng)
+            result = await drive(client, workload, cfg['window'], timeout)
+            result['memory'] = {'max_rss_kib': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}
+            if tracemalloc.is_tracing():
+                result['memory']['traced_peak_bytes'] = tracemalloc.get_traced_memory()[1]
+            result['broker'] = {'published': broker.published, 'delivered': broker.delivered}
+            if stages:
+                snapshot = controller.metrics.snapshot()
+                result['stages'] = snapshot['histograms']
+                result['counters'] = snapshot['counters']
+            result['settings'] = {**cfg, 'seed': seed, 'transport': transport}
+            return result
+        finally:
+            await controller.shutdown_async()
+            if client_side is not server:
+                await client_side.close()
+            await broker.close()
+            rm.close()
+
+
+def environment() -> dict:
+    return {'python': platform.python_version(), 'implementation': platform.python_implementation(),
+            'platform': platform.platform(), 'cpus': os.cpu_count(), 'time': time.time()}
+
+
+def scenario_settings(name: str, args: argparse.Namespace) -> dict:
+    cfg = {**DEFAULTS, **SCENARIOS[name]}
+    for key in ('commands', 'window', 'latency', 'jitter', 'reply_size', 'trace_points', 'warmup', 'codec'):
+        value = getattr(args, key)
+        if value is not None:
+            cfg[key] = value
+    return cfg
+
+
+def child_args(args: argparse.Namespace, name: str) -> list:
+    """Command line running scenario `name` alone, with the same options."""
+    argv = [sys.executable, os.path.abspath(__file__), '--scenario', name, '--seed', str(args.seed),
+            '--transport', args.transport]
+    for key in ('commands', 'window', 'latency', 'jitter', 'reply_size', 'trace_points', 'warmup', 'codec'):
+        value = getattr(args, key)
+        if value is not None:
+            argv += [f"--{key.replace('_', '-')}", str(value)]
+    if args.tracemalloc:
+        argv.append('--tracemalloc')
+    if args.stages:
+        argv.append('--stages')
+    return argv
+
+
+def main(argv: Optional[list]=None) -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the controller with an in-memory broker and simulated instruments")
+    parser.add_argument('--scenario', choices=list(SCENARIOS) + ['all'], default='all')
+    parser.add_argument('--commands', type=int, help="commands sent (after the warm-up)")
+    parser.add_argument('--window', type=int, help="most commands in flight at once")
+    parser.add_argument('--latency', type=float, help="instrument reply latency (s)")
+    parser.add_argument('--jitter', type=float, help="random extra latency, up to this many s")
+    parser.add_argument('--reply-size', type=int, help="bytes in replies to generic queries")
+    parser.add_argument('--trace-points', type=int, help="points per VNA trace")
+    parser.add_argument('--warmup', type=int, help="commands sent (and not measured) before the run")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--transport', choices=['amqp', 'local', 'unix'], default='amqp',
+                        help="broker stand-in (amqp), in-process or Unix-socket transport")
+    parser.add_argument('--codec', help="client codec ('json', 'binary'; 'object' over the local transport, its default)")
+    parser.add_argument('--tracemalloc', action='store_true', help="also report the traced Python heap peak (slower)")
+    parser.add_argument('--stages', action='store_true', help="include the controller's per-stage latency histograms")
+    parser.add_argument('--output', help="write the results to this file instead of stdout")
+    args = parser.parse_args(argv)
+
+    results = {'environment': environment(), 'scenarios': {}}
+    if args.scenario == 'all':
+        for name in SCENARIOS:
+            out = subprocess.run(child_args(args, name), check=True, stdout=subprocess.PIPE).stdout
+            results['scenarios'].update(json.loads(out)['scenarios'])
+    else:
+        if args.tracemalloc:
+            tracemalloc.start()
+        cfg = scenario_settings(args.scenario, args)
+        results['scenarios'][args.scenario] = asyncio.run(run_scenario(args.scenario, cfg, args.seed, args.stages,
+                                                                             args.transport))
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
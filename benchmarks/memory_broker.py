@@ -0,0 +1,215 @@
+"""
+In-process stand-in for the parts of RabbitMQ/aio_pika the controller and terminal use.
+
+`MemoryBroker.connect` can be passed as the `connect` function of an `amqp_pool.ConnectionPool`, so
+`aio_queues.bind_receive_queue`, `aio_queues.bind_send_queue` and `user_terminal.bind_reply_queue`
+run unchanged: fanout, topic and default-exchange routing, alternate exchanges, server-named queues,
+per-channel prefetch windows and (multiple) acks are modelled; persistence, publisher confirms and
+returned messages are not. Messages are delivered by reference, so the cost measured is that of the
+controller and client code (including encoding), not of a network.
+"""
+from typing import Optional, Callable, Awaitable
+import asyncio
+import itertools
+import re
+
+import aio_pika
+
+
+class MemoryBroker:
+    def __init__(self) -> None:
+        self.exchanges = {'': MemoryExchange(self, '', aio_pika.ExchangeType.DIRECT)}
+        self.queues = {}
+        self.published = 0
+        self.delivered = 0
+        self._names = itertools.count()
+
+    async def connect(self, uri: str=None) -> 'MemoryConnection':
+        return MemoryConnection(self)
+
+    def queue_name(self) -> str:
+        return f"amq.gen-{next(self._names)}"
+
+    async def wait_consumer(self, name: str, timeout: float=5.) -> None:
+        """Wait until queue `name` exists and has a consumer (e.g. a controller finished starting up)."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while not ((name in self.queues) and self.queues[name]._consumers):
+            if loop.time() > deadline:
+                raise asyncio.TimeoutError(f"no consumer on {name} after {timeout} s")
+            await asyncio.sleep(0.001)
+
+    async def close(self) -> None:
+        """Stop delivering to all consumers."""
+        for queue in self.queues.values():
+            for tag in list(queue._consumers):
+                await queue.cancel(tag)
+
+
+class MemoryConnection:
+    def __init__(self, broker: MemoryBroker) -> None:
+        self.broker = broker
+        self.is_closed = False
+
+    async def channel(self, publisher_confirms: bool=False) -> 'MemoryChannel':
+        return MemoryChannel(self.broker)
+
+    async def close(self) -> None:
+        self.is_closed = True
+
+
+class MemoryChannel:
+    def __init__(self, broker: MemoryBroker) -> None:
+        self.broker = broker
+        self.is_closed = False
+        self.prefetch_count = 0             # 0 = unlimited, like AMQP
+        self._tags = itertools.count(1)
+        self._unacked = {}                  # delivery tag -> MemoryMessage
+        self._window = None                 # asyncio.Event, set when the prefetch window has room
+
+    @property
+    def default_exchange(self) -> 'MemoryExchange':
+        return self.broker.exchanges['']
+
+    async def set_qos(self, prefetch_count: int=0, **kwargs) -> None:
+        self.prefetch_count = prefetch_count
+
+    async def declare_exchange(self, name: str, type=aio_pika.ExchangeType.DIRECT, arguments: Optional[dict]=None,
+                               **kwargs) -> 'MemoryExchange':
+        exchange = self.broker.exchanges.get(name)
+        if exchange is None:
+            exchange = self.broker.exchanges[name] = MemoryExchange(self.broker, name, type, arguments)
+        return exchange
+
+    async def declare_queue(self, name: Optional[str]=None, exclusive: bool=False, auto_delete: bool=False,
+                            **kwargs) -> 'MemoryQueue':
+        name = name or self.broker.queue_name()
+        queue = self.broker.queues.get(name)
+        if queue is None:
+            queue = self.broker.queues[name] = MemoryQueue(self, name)
+        return queue
+
+    async def close(self) -> None:
+        self.is_closed = True
+
+    async def _wait_window(self) -> None:
+        while self.prefetch_count and len(self._unacked) >= self.prefetch_count:
+            if self._window is None:
+                self._window = asyncio.Event()
+            self._window.clear()
+            await self._window.wait()
+
+    def _deliver(self, message: aio_pika.Message) -> 'MemoryMessage':
+        tag = next(self._tags)
+        incoming = self._unacked[tag] = MemoryMessage(self, tag, message)
+        self.broker.delivered += 1
+        return incoming
+
+    def _ack(self, tag: int, multiple: bool=False) -> None:
+        if multiple:
+            for t in [t for t in self._unacked if t <= tag]:
+                del self._unacked[t]
+        else:
+            self._unacked.pop(tag, None)
+        if self._window is not None:
+            self._window.set()
+
+
+class MemoryExchange:
+    def __init__(self, broker: MemoryBroker, name: str, type, arguments: Optional[dict]=None) -> None:
+        self.broker = broker
+        self.name = name
+        self.type = aio_pika.ExchangeType(type)
+        self.alternate = (arguments or {}).get('alternate-exchange')
+        self.bindings = {}                  # routing key pattern -> {queue name: queue}
+        self._patterns = {}                 # pattern -> compiled regex (topic exchanges)
+
+    def _matches(self, pattern: str, key: str) -> bool:
+        if self.type == aio_pika.ExchangeType.FANOUT:
+            return True
+        if self.type != aio_pika.ExchangeType.TOPIC:
+            return pattern == key
+        try:
+            rx = self._patterns[pattern]
+        except KeyError:
+            words = [r'[^.]+' if w == '*' else r'.*' if w == '#' else re.escape(w) for w in pattern.split('.')]
+            rx = self._patterns[pattern] = re.compile(r'\.'.join(words).replace(r'\..*', r'(\..*)?') + '$')
+        return rx.match(key) is not None
+
+    def _route(self, routing_key: str) -> list:
+        if self.name == '':
+            queue = self.broker.queues.get(routing_key)
+            return [queue] if queue is not None else []
+        queues = {}
+        for pattern, bound in self.bindings.items():
+            if self._matches(pattern, routing_key):
+                queues.update(bound)
+        if not queues and self.alternate in self.broker.exchanges:
+            return self.broker.exchanges[self.alternate]._route(routing_key)
+        return list(queues.values())
+
+    async def publish(self, message: aio_pika.Message, routing_key: str='', mandatory: bool=True, **kwargs) -> None:
+        self.broker.published += 1
+        for queue in self._route(routing_key):
+            queue._put(message)
+
+
+class MemoryQueue:
+    def __init__(self, channel: MemoryChannel, name: str) -> None:
+        self.channel = channel
+        self.name = name
+        self._items = asyncio.Queue()
+        self._consumers = {}                # consumer tag -> task
+
+    async def bind(self, exchange: MemoryExchange, routing_key: str='', **kwargs) -> None:
+        exchange.bindings.setdefault(routing_key, {})[self.name] = self
+
+    async def unbind(self, exchange: MemoryExchange, routing_key: str='', **kwargs) -> None:
+        exchange.bindings.get(routing_key, {}).pop(self.name, None)
+
+    def _put(self, message: aio_pika.Message) -> None:
+        self._items.put_nowait(message)
+
+    async def consume(self, callback: Callable[['MemoryMessage'], Awaitable[None]], **kwargs) -> str:
+        tag = f"ctag-{self.name}-{len(self._consumers)}"
+        self._consumers[tag] = asyncio.ensure_future(self._consume(callback))
+        return tag
+
+    async def _consume(self, callback) -> None:
+        # deliveries of one queue are handed to the consumer in order, within the channel's prefetch window
+        while True:
+            message = await self._items.get()
+            await self.channel._wait_window()
+            await callback(self.channel._deliver(message))
+
+    async def cancel(self, consumer_tag: str) -> None:
+        task = self._consumers.pop(consumer_tag, None)
+        if task is not None:
+            task.cancel()
+
+
+class MemoryMessage:
+    """A delivered message, with the attributes and acknowledgement methods the consumers use."""
+    def __init__(self, channel: MemoryChannel, delivery_tag: int, message: aio_pika.Message) -> None:
+        self.channel = channel
+        self.delivery_tag = delivery_tag
+        self.body = message.body
+        self.headers = message.headers
+        self.content_type = message.content_type
+        self.correlation_id = message.correlation_id
+        self.reply_to = message.reply_to
+
+    async def ack(self, multiple: bool=False) -> None:
+        self.channel._ack(self.delivery_tag, multiple)
+
+    async def reject(self, requeue: bool=False) -> None:
+        self.channel._ack(self.delivery_tag)
+
+    def process(self) -> 'MemoryMessage':
+        return self
+
+    async def __aenter__(self) -> 'MemoryMessage':
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        await self.ack()
@@ -0,0 +1,182 @@
+"""
+Simulated VISA instruments with a latency model, in place of the `pyvisa-sim` backend.
+
+`SimResourceManager` hands out `SimInstrument`s that implement the subset of `pyvisa` resources the
+interfaces use (`write`, `query`, `bytes_in_buffer`, `visalib.read`, `clear`, `close`, ...). Each
+instrument answers a query `latency` s after it was written (plus a uniformly distributed `jitter`,
+from a seeded generator so runs are reproducible), and writes block for `write_latency` s, like the
+blocking VISA calls they stand in for. Replies:
+    *IDN?                   '<type>-<id>' (so the controller picks the interface class)
+    *OPC?, *ESR?, OUTPUT?   '1'
+    VOLT?                   '1.00'
+    SENSE:FREQUENCY:*?      start, stop (GHz) and number of points of the sweep
+    CALCULATE:DATA? ...     `trace_points` comma-separated values
+    anything else ending '?' `reply_size` bytes
+Compound ';'-separated messages are answered like a SCPI instrument would (replies joined by ';').
+"""
+from typing import Optional
+import random
+import threading
+import time
+
+from pyvisa.constants import StatusCode
+from pyvisa.errors import VisaIOError, InvalidSession
+
+
+class SimSpec:
+    """Behaviour of a simulated instrument."""
+    def __init__(self, inst_type: str, inst_id: str, latency: float=0.001, jitter: float=0.,
+                 write_latency: float=0., reply_size: int=16, trace_points: int=201) -> None:
+        self.inst_type = inst_type          # 'VNA' or 'PowerSupply'
+        self.inst_id = inst_id
+        self.latency = latency              # s from writing a query to its reply being readable
+        self.jitter = jitter                # up to this many s added to every latency
+        self.write_latency = write_latency  # s every write blocks for
+        self.reply_size = reply_size        # bytes in replies to generic queries
+        self.trace_points = trace_points    # points in CALCULATE:DATA? replies
+
+
+class _VisaLib:
+    """The `resource.visalib` the interfaces read raw chunks through."""
+    def __init__(self, instrument: 'SimInstrument') -> None:
+        self._instrument = instrument
+
+    def read(self, session: int, count: int) -> tuple:
+        return self._instrument._read(count), StatusCode.success
+
+
+class SimInstrument:
+    def __init__(self, name: str, spec: SimSpec, rng: random.Random, timeout: int=2000,
+                 read_termination: str='\n', write_termination: str='\r\n') -> None:
+        self.resource_name = name
+        self.spec = spec
+        self.timeout = timeout              # ms, as in pyvisa
+        self.read_termination = read_termination
+        self.write_termination = write_termination
+        self.visalib = _VisaLib(self)
+        self._rng = rng
+        self._session = id(self)
+        self._buffer = bytearray()
+        self._ready = 0.                    # time.monotonic() when the buffered reply becomes readable
+        self._lock = threading.Lock()
+        self.writes = 0
+        self.queries = 0
+        self.bytes_read = 0
+
+    @property
+    def session(self) -> int:
+        if self._session is None:
+            raise InvalidSession()
+        return self._session
+
+    @property
+    def bytes_in_buffer(self) -> int:
+        with self._lock:
+            return len(self._buffer) if time.monotonic() >= self._ready else 0
+
+    def _reply(self, msg: str) -> Optional[str]:
+        spec = self.spec
+        msg = msg.strip().lstrip(':').upper()
+        if not msg.endswith('?') and not msg.startswith('CALCULATE:DATA?'):
+            return None
+        self.queries += 1
+        if msg == '*IDN?':
+            return f"{spec.inst_type}-{spec.inst_id}"
+        if msg in ('*OPC?', '*ESR?', 'OUTPUT?'):
+            return '1'
+        if msg == 'VOLT?':
+            return '1.00'
+        if msg == 'SENSE:FREQUENCY:START?':
+            return '1.00'
+        if msg == 'SENSE:FREQUENCY:STOP?':
+            return '2.00'
+        if msg == 'SENSE:FREQUENCY:POINTS?':
+            return str(spec.trace_points)
+        if msg.startswith('CALCULATE:DATA?'):
+            return ','.join(f"{-1 - (i % 100) / 100:.6f}" for i in range(spec.trace_points))
+        return 'x' * spec.reply_size
+
+    def write(self, message: str) -> int:
+        self.session
+        self.writes += 1
+        spec = self.spec
+        if spec.write_latency:
+            time.sleep(spec.write_latency)
+        replies = [r for r in map(self._reply, message.rstrip(self.write_termination).split(';')) if r is not None]
+        if replies:
+            with self._lock:
+                delay = spec.latency + (self._rng.uniform(0, spec.jitter) if spec.jitter else 0.)
+                self._ready = max(self._ready, time.monotonic() + delay)
+                self._buffer += (';'.join(replies) + self.read_termination).encode()
+        return len(message) + len(self.write_termination)
+
+    def _read(self, count: int) -> bytes:
+        """Up to `count` buffered bytes, once the reply is ready; VISA timeout error if none arrive in time."""
+        self.session
+        with self._lock:
+            wait = self._ready - time.monotonic()
+            pending = bool(self._buffer)
+        if not pending or wait > self.timeout / 1000:
+            time.sleep(self.timeout / 1000)
+            raise VisaIOError(StatusCode.error_timeout)
+        if wait > 0:
+            time.sleep(wait)
+        with self._lock:
+            data = bytes(self._buffer[:count])
+            del self._buffer[:count]
+        self.bytes_read += len(data)
+        return data
+
+    def read(self) -> str:
+        term = self.read_termination.encode()
+        data = bytearray()
+        while not data.endswith(term):
+            data += self._read(4096)
+        return data[:-len(term)].decode()
+
+    def query(self, message: str) -> str:
+        self.write(message)
+        return self.read()
+
+    def clear(self) -> None:
+        """Device clear: discard pending replies."""
+        self.session
+        with self._lock:
+            del self._buffer[:]
+            self._ready = 0.
+
+    def read_stb(self) -> int:
+        raise NotImplementedError("simulated instruments have no status byte")
+
+    def enable_event(self, *args, **kwargs) -> None:
+        raise NotImplementedError("simulated instruments have no events")
+
+    def close(self) -> None:
+        self._session = None
+
+
+class SimResourceManager:
+    """Resource manager for simulated instruments: {resource name: `SimSpec`}, jitter seeded by `seed`."""
+    def __init__(self, specs: dict, seed: int=0) -> None:
+        self.specs = specs
+        self.seed = seed
+        self.opened = {}        # resource name -> SimInstrument
+
+    def list_resources(self, query: str='?*::INSTR') -> tuple:
+        return tuple(self.specs)
+
+    def open_resource(self, resource_name: str, timeout: int=2000, read_termination: str='\n',
+                      write_termination: str='\r\n', **kwargs) -> SimInstrument:
+        try:
+            spec = self.specs[resource_name]
+        except KeyError:
+            raise VisaIOError(StatusCode.error_resource_not_found) from None
+        # one generator per resource, so the jitter does not depend on how the threads interleave
+        rng = random.Random(f"{self.seed}:{resource_name}")
+        instr = self.opened[resource_name] = SimInstrument(resource_name, spec, rng, timeout,
+                                                           read_termination, write_termination)
+        return instr
+
+    def close(self) -> None:
+        for instr in self.opened.values():
+            instr.close()
@@ -0,0 +1,78 @@
+from typing import Optional, Callable, Awaitable
+import asyncio
+
+import aio_pika
+
+
+class ConnectionPool:
+    """
+    Shared robust AMQP connections, handing out one channel per purpose (e.g. 'consume:q_controller',
+    'publish').
+
+    Every component in a process that talks to the same broker should get its channels from the
+    same pool (see `get_pool`), so they share `size` TCP connections, heartbeats and reconnect
+    cycles instead of opening one each. Reconnection is handled by `aio_pika.connect_robust`;
+    channels that were closed (e.g. by a channel-level error) are reopened on the next request.
+    """
+    def __init__(self, uri: str, size: int=1,
+                 connect: Callable[..., Awaitable[aio_pika.abc.AbstractRobustConnection]]=aio_pika.connect_robust) -> None:
+        self.uri = uri
+        self.size = max(1, size)
+        self._connect = connect
+        self._connections = []
+        self._channels = {}         # purpose -> channel
+        self._lock = None           # created lazily, once there is a running loop
+
+    def _get_lock(self) -> asyncio.Lock:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    async def _connection(self, index: int) -> aio_pika.abc.AbstractRobustConnection:
+        while len(self._connections) < self.size:
+            self._connections.append(await self._connect(self.uri))
+        return self._connections[index % self.size]
+
+    async def connection(self, index: int=0) -> aio_pika.abc.AbstractRobustConnection:
+        """Get connection number `index % size`, connecting if necessary."""
+        async with self._get_lock():
+            return await self._connection(index)
+
+    async def channel(self, purpose: str, publisher_confirms: bool=False,
+                      prefetch_count: Optional[int]=None) -> aio_pika.abc.AbstractRobustChannel:
+        """
+        Get the channel dedicated to `purpose`, opening it on the first call. Channels are spread
+        over the pool's connections in the order they are first requested.
+        """
+        async with self._get_lock():
+            channel = self._channels.get(purpose)
+            if (channel is not None) and not channel.is_closed:
+                return channel
+            connection = await self._connection(len(self._channels))
+            channel = await connection.channel(publisher_confirms=publisher_confirms)
+            if prefetch_count is not None:
+                await channel.set_qos(prefetch_count=prefetch_count)
+            self._channels[purpose] = channel
+            return channel
+
+    async def close(self) -> None:
+        """Close all channels and connections of the pool."""
+        for channel in self._channels.values():
+            if not channel.is_closed:
+                await channel.close()
+        self._channels.clear()
+        for connection in self._connections:
+            await connection.close()
+        self._connections.clear()
+        _pools.pop(self.uri, None)
+
+
+_pools = {}
+
+def get_pool(uri: str, size: int=1) -> ConnectionPool:
+    """Return the process-wide pool for `uri`, creating it (with `size` connections) if necessary."""
+    try:
+        return _pools[uri]
+    except KeyError:
+        pool = _pools[uri] = ConnectionPool(uri, size=size)
+        return pool
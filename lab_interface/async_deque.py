@@ -0,0 +1,184 @@
+from typing import Optional, Iterable, Iterator, Callable, Any
+import asyncio
+from collections import deque
+
+
+class Signal:
+    """
+    Level-triggered wake-up flag for a single consumer task.
+
+    Unlike `asyncio.Event`, the underlying event is only created on first `wait`, so a Signal may be
+    created before the event loop is running (e.g. in `Controller.__init__`).
+    """
+    def __init__(self) -> None:
+        self._event = None
+        self._pending = False
+
+    def set(self) -> None:
+        """Wake up the waiting task (or the next one to wait)."""
+        self._pending = True
+        if self._event is not None:
+            self._event.set()
+
+    async def wait(self) -> None:
+        """Wait until `set` is called. Returns immediately if it was called since the last `wait`."""
+        if self._event is None:
+            self._event = asyncio.Event()
+        if not self._pending:
+            self._event.clear()
+            await self._event.wait()
+        self._pending = False
+
+
+class Bounded:
+    """
+    Soft capacity for a queue. Appends never fail; producers that can wait `await wait_space()`
+    before adding work, and producers that cannot check `full()` and reject it. Subclasses call
+    `_freed()` whenever items are removed.
+    """
+    capacity = None                 # max number of items (None = unbounded)
+    _space = None                   # created on first `wait_space`, set when there is room
+
+    def full(self, n: int=1) -> bool:
+        """True if adding `n` items would exceed the capacity."""
+        return (self.capacity is not None) and (len(self) + n > self.capacity)
+
+    def _freed(self) -> None:
+        if (self._space is not None) and not self.full():
+            self._space.set()
+
+    async def wait_space(self, n: int=1) -> None:
+        """Wait until `n` items can be added without exceeding the capacity (any size if empty)."""
+        while self and self.full(n):
+            if self._space is None:
+                self._space = asyncio.Event()
+            self._space.clear()
+            await self._space.wait()
+
+
+class AsyncDeque(Bounded, deque):
+    """
+    A `deque` that signals whenever items are added, so a consumer can `await wait()` for work
+    instead of polling. Several deques may share a single `signal` to wake one consumer. `capacity`
+    is a soft limit (see `Bounded`), unlike `maxlen`, which silently drops items.
+    """
+    def __init__(self, iterable: Iterable=(), maxlen: Optional[int]=None, signal: Optional[Signal]=None,
+                 capacity: Optional[int]=None) -> None:
+        super().__init__(iterable, maxlen)
+        self.signal = Signal() if (signal is None) else signal
+        self.capacity = capacity
+
+    def append(self, x) -> None:
+        super().append(x)
+        self.signal.set()
+
+    def appendleft(self, x) -> None:
+        super().appendleft(x)
+        self.signal.set()
+
+    def extend(self, iterable: Iterable) -> None:
+        super().extend(iterable)
+        self.signal.set()
+
+    def extendleft(self, iterable: Iterable) -> None:
+        super().extendleft(iterable)
+        self.signal.set()
+
+    def popleft(self):
+        x = super().popleft()
+        self._freed()
+        return x
+
+    def pop(self):
+        x = super().pop()
+        self._freed()
+        return x
+
+    def clear(self) -> None:
+        super().clear()
+        self._freed()
+
+    async def wait(self) -> None:
+        """Wait until the deque is not empty."""
+        while not self:
+            await self.signal.wait()
+
+
+class LaneQueue(Bounded):
+    """
+    FIFO lanes served in order: `popleft` takes from the first non-empty lane, so items appended to
+    lane 0 jump everything queued in later lanes. `key(item)` picks the lane of an appended item.
+    Supports the subset of the `deque` interface used by the queue consumers, and signals and
+    bounds (soft `capacity` over all lanes) like `AsyncDeque`.
+    """
+    def __init__(self, lanes: int=3, key: Optional[Callable[[Any], int]]=None, default: int=1,
+                 signal: Optional[Signal]=None, capacity: Optional[int]=None) -> None:
+        self.lanes = tuple(deque() for _ in range(lanes))
+        self.key = key
+        self.default = default          # lane used when there is no `key`
+        self.signal = Signal() if (signal is None) else signal
+        self.capacity = capacity
+        self._len = 0
+
+    def _lane(self, x) -> deque:
+        return self.lanes[self.default if (self.key is None) else self.key(x)]
+
+    def append(self, x) -> None:
+        self._lane(x).append(x)
+        self._len += 1
+        self.signal.set()
+
+    def appendleft(self, x) -> None:
+        self._lane(x).appendleft(x)
+        self._len += 1
+        self.signal.set()
+
+    def extend(self, iterable: Iterable) -> None:
+        for x in iterable:
+            self._lane(x).append(x)
+            self._len += 1
+        self.signal.set()
+
+    def popleft(self):
+        for lane in self.lanes:
+            if lane:
+                self._len -= 1
+                x = lane.popleft()
+                self._freed()
+                return x
+        raise IndexError("pop from an empty LaneQueue")
+
+    def peek(self):
+        """The item `popleft` would return, without removing it."""
+        for lane in self.lanes:
+            if lane:
+                return lane[0]
+        raise IndexError("peek into an empty LaneQueue")
+
+    def clear(self) -> None:
+        for lane in self.lanes:
+            lane.clear()
+        self._len = 0
+        self._freed()
+
+    def depths(self) -> list:
+        """Number of items in each lane."""
+        return [len(lane) for lane in self.lanes]
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __bool__(self) -> bool:
+        return self._len > 0
+
+    def __iter__(self) -> Iterator:
+        for lane in self.lanes:
+            yield from lane
+
+    def __repr__(self) -> str:
+        return f"LaneQueue({[list(lane) for lane in self.lanes]})"
+
+    async def wait(self) -> None:
+        """Wait until the queue is not empty."""
+        while not self:
+            await self.signal.wait()
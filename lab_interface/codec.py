@@ -0,0 +1,299 @@
+"""
+Wire codecs for commands and responses.
+
+Messages carry their format in the AMQP `content_type` property, and may ask for the format of the
+reply with an `accept` header. Two codecs are available:
+
+    application/json          : plain JSON (numeric arrays are sent as lists)
+    application/x-lab-binary  : compact tagged binary format; numeric arrays travel as raw typed
+                                buffers with dtype and shape, and decode without copying
+
+Within a process (see `transport.LocalTransport`), messages can skip encoding altogether with
+`application/x-python-object`, which passes the objects themselves.
+
+Arrays may be numpy arrays (if numpy is installed), `array.array`s or typed `memoryview`s. Decoded
+arrays are numpy arrays if numpy is installed, otherwise read-only `memoryview`s cast to the dtype.
+"""
+from typing import Optional, Any
+import json
+import struct
+import array as _array
+import sys
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+# struct format characters <-> numpy dtype kinds, for array frames without numpy
+_FMT_TO_DTYPE = {'b': 'i1', 'B': 'u1', 'h': 'i2', 'H': 'u2', 'i': 'i4', 'I': 'u4',
+                 'l': 'i8' if struct.calcsize('l') == 8 else 'i4',
+                 'L': 'u8' if struct.calcsize('L') == 8 else 'u4',
+                 'q': 'i8', 'Q': 'u8', 'f': 'f4', 'd': 'f8'}
+_DTYPE_TO_FMT = {'i1': 'b', 'u1': 'B', 'i2': 'h', 'u2': 'H', 'i4': 'i', 'u4': 'I',
+                 'i8': 'q', 'u8': 'Q', 'f4': 'f', 'f8': 'd'}
+_ENDIAN = '<' if sys.byteorder == 'little' else '>'
+
+
+class CodecError(ValueError):
+    """Raised when a message cannot be encoded or decoded."""
+
+
+class JsonCodec:
+    content_type = 'application/json'
+    wire = True     # encodes to bytes, so can be sent over any transport
+
+    @staticmethod
+    def _default(obj: Any) -> Any:
+        if np is not None and isinstance(obj, (np.ndarray, np.generic)):
+            return obj.tolist()
+        if isinstance(obj, (_array.array, memoryview)):
+            return obj.tolist()
+        if isinstance(obj, bytes):
+            return obj.decode(errors='replace')
+        raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+    def encode(self, obj: Any) -> bytes:
+        return json.dumps(obj, default=self._default).encode()
+
+    def decode(self, data: bytes) -> Any:
+        try:
+            return json.loads(data)
+        except ValueError as e:
+            raise CodecError(f"Invalid JSON message: {e}") from e
+
+
+class BinaryCodec:
+    """
+    Compact tagged binary format. Each value is a one-byte tag followed by its payload, where <n>
+    is an unsigned LEB128 varint and <z> a zigzag-encoded signed varint:
+
+        N / T / F            None / True / False
+        i <z>                integer
+        d <float64>          float (little-endian)
+        s <n> <utf-8>        str of n bytes
+        b <n> <raw>          bytes
+        l <n> <values>       list of n values (tuples encode as lists)
+        m <n> <k> <v> ...    dict of n items
+        a <dtype> <ndim:n> <shape:n * ndim> <nbytes:n> <pad:u8> <pad bytes> <raw>
+                             numeric array; <dtype> is a str value (e.g. '<f8') and the raw data
+                             is 8-byte aligned within the message
+    """
+    content_type = 'application/x-lab-binary'
+    wire = True
+
+    _f64 = struct.Struct('<d')
+
+    @staticmethod
+    def _varint(n: int) -> bytes:
+        out = bytearray()
+        while True:
+            b = n & 0x7f
+            n >>= 7
+            if n:
+                out.append(b | 0x80)
+            else:
+                out.append(b)
+                return bytes(out)
+
+    @staticmethod
+    def _read_varint(view: memoryview, i: int) -> tuple:
+        n = shift = 0
+        while True:
+            b = view[i]
+            i += 1
+            n |= (b & 0x7f) << shift
+            if not b & 0x80:
+                return n, i
+            shift += 7
+
+    def encode(self, obj: Any) -> bytes:
+        parts = []
+        self._encode(obj, parts, [0])
+        return b''.join(parts)
+
+    @staticmethod
+    def _array_info(obj: Any) -> Optional[tuple]:
+        """(dtype str, shape, buffer) for array-like `obj`, or None if it is not an array."""
+        if np is not None and isinstance(obj, np.ndarray):
+            obj = np.ascontiguousarray(obj)
+            if obj.dtype.byteorder == '>' or (obj.dtype.byteorder == '=' and _ENDIAN == '>'):
+                obj = obj.astype(obj.dtype.newbyteorder('<'))
+            return obj.dtype.str, obj.shape, memoryview(obj).cast('B')
+        if isinstance(obj, _array.array):
+            obj = memoryview(obj)
+        if isinstance(obj, memoryview) and obj.format.lstrip('@=<') in _FMT_TO_DTYPE:
+            if _ENDIAN != '<':
+                raise CodecError("Array frames without numpy are only supported on little-endian hosts")
+            return '<' + _FMT_TO_DTYPE[obj.format.lstrip('@=<')], obj.shape, obj.cast('B')
+        return None
+
+    def _encode(self, obj: Any, parts: list, pos: list) -> None:
+        # `pos` tracks the current offset (in a 1-element list) so array data can be aligned
+        def put(b) -> None:
+            parts.append(b)
+            pos[0] += len(b)
+        varint = self._varint
+
+        if obj is None:
+            put(b'N')
+        elif obj is True:
+            put(b'T')
+        elif obj is False:
+            put(b'F')
+        elif isinstance(obj, int):
+            put(b'i' + varint((obj << 1) if obj >= 0 else ((-obj << 1) - 1)))
+        elif isinstance(obj, float):
+            put(b'd' + self._f64.pack(obj))
+        elif isinstance(obj, str):
+            s = obj.encode()
+            put(b's' + varint(len(s)) + s)
+        elif isinstance(obj, (bytes, bytearray)):
+            put(b'b' + varint(len(obj)))
+            put(bytes(obj))
+        elif isinstance(obj, (list, tuple)):
+            put(b'l' + varint(len(obj)))
+            for item in obj:
+                self._encode(item, parts, pos)
+        elif isinstance(obj, dict):
+            put(b'm' + varint(len(obj)))
+            for key, value in obj.items():
+                self._encode(key, parts, pos)
+                self._encode(value, parts, pos)
+        elif np is not None and isinstance(obj, np.generic):
+            self._encode(obj.item(), parts, pos)
+        else:
+            info = self._array_info(obj)
+            if info is None:
+                raise CodecError(f"Cannot encode object of type {type(obj).__name__}")
+            dtype, shape, data = info
+            put(b'a')
+            self._encode(dtype, parts, pos)
+            put(varint(len(shape)) + b''.join(varint(n) for n in shape) + varint(data.nbytes))
+            pad = (-(pos[0] + 1)) % 8
+            put(bytes((pad,)) + b'\0' * pad)
+            put(data)   # joined without an intermediate copy
+
+    def decode(self, data: bytes) -> Any:
+        view = memoryview(data)
+        try:
+            obj, end = self._decode(view, 0)
+        except (struct.error, IndexError, UnicodeDecodeError) as e:
+            raise CodecError(f"Invalid binary message: {e}") from e
+        if end != len(view):
+            raise CodecError(f"Trailing bytes in binary message ({len(view) - end})")
+        return obj
+
+    def _decode(self, view: memoryview, i: int) -> tuple:
+        tag = view[i]
+        i += 1
+        if tag == 0x4e:     # N
+            return None, i
+        if tag == 0x54:     # T
+            return True, i
+        if tag == 0x46:     # F
+            return False, i
+        if tag == 0x69:     # i
+            z, i = self._read_varint(view, i)
+            return (z >> 1) if not z & 1 else -((z + 1) >> 1), i
+        if tag == 0x64:     # d
+            return self._f64.unpack_from(view, i)[0], i + 8
+        if tag in (0x73, 0x62):     # s, b
+            n, i = self._read_varint(view, i)
+            if i + n > len(view):
+                raise CodecError("Truncated binary message")
+            raw = view[i:i + n].tobytes()
+            return (raw.decode() if tag == 0x73 else raw), i + n
+        if tag == 0x6c:     # l
+            n, i = self._read_varint(view, i)
+            items = []
+            for _ in range(n):
+                item, i = self._decode(view, i)
+                items.append(item)
+            return items, i
+        if tag == 0x6d:     # m
+            n, i = self._read_varint(view, i)
+            d = {}
+            for _ in range(n):
+                key, i = self._decode(view, i)
+                if isinstance(key, list):
+                    key = tuple(key)
+                d[key], i = self._decode(view, i)
+            return d, i
+        if tag == 0x61:     # a
+            dtype, i = self._decode(view, i)
+            ndim, i = self._read_varint(view, i)
+            shape = []
+            for _ in range(ndim):
+                n, i = self._read_varint(view, i)
+                shape.append(n)
+            nbytes, i = self._read_varint(view, i)
+            i += 1 + view[i]
+            if i + nbytes > len(view):
+                raise CodecError("Truncated array frame")
+            return self._make_array(view[i:i + nbytes], dtype, tuple(shape)), i + nbytes
+        raise CodecError(f"Unknown tag {bytes((tag,))!r} in binary message")
+
+    @staticmethod
+    def _make_array(buf: memoryview, dtype: str, shape: tuple) -> Any:
+        """Zero-copy view of `buf` as an array of `dtype` and `shape`."""
+        if np is not None:
+            return np.frombuffer(buf, dtype=np.dtype(dtype)).reshape(shape)
+        kind = dtype.lstrip('<>=|')
+        if kind not in _DTYPE_TO_FMT or (dtype[0] in '<>' and dtype[0] != _ENDIAN):
+            raise CodecError(f"Cannot decode array of dtype {dtype} without numpy")
+        fmt = _DTYPE_TO_FMT[kind]
+        if buf.nbytes == 0:
+            return buf.cast(fmt)
+        return buf.cast(fmt, shape) if len(shape) > 1 else buf.cast(fmt)
+
+
+class ObjectCodec:
+    """
+    Passes objects through unencoded, for transports that deliver messages by reference within a
+    process. Objects are shared, not copied: neither side may modify them once sent."""
+    content_type = 'application/x-python-object'
+    wire = False
+
+    def encode(self, obj: Any) -> Any:
+        return obj
+
+    def decode(self, data: Any) -> Any:
+        return data
+
+
+JSON = JsonCodec()
+BINARY = BinaryCodec()
+OBJECT = ObjectCodec()
+codecs = {JSON.content_type: JSON,
+          BINARY.content_type: BINARY,
+          OBJECT.content_type: OBJECT,
+          'json': JSON,
+          'binary': BINARY,
+          'object': OBJECT}
+
+
+def get_codec(name: Optional[str]=None):
+    """Look up a codec by content type or short name ('json', 'binary', 'object'). Defaults to JSON."""
+    if not name:
+        return JSON
+    try:
+        return codecs[name]
+    except KeyError:
+        raise CodecError(f"Unknown codec {name!r}; valid codecs are {list(codecs)}")
+
+
+def decode(data: bytes, content_type: Optional[str]=None) -> Any:
+    """Decode `data` according to its `content_type` (JSON if not given)."""
+    return get_codec(content_type).decode(data)
+
+
+def array_info(obj: Any) -> Optional[tuple]:
+    """(dtype str, shape, byte memoryview) of a numeric array, or None if `obj` is not an array."""
+    return BinaryCodec._array_info(obj)
+
+
+def make_array(buf: memoryview, dtype: str, shape: tuple) -> Any:
+    """Zero-copy view of the bytes `buf` as an array (numpy if installed, else typed memoryview)."""
+    return BinaryCodec._make_array(buf, dtype, shape)
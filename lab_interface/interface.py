@@ -1,19 +1,56 @@
 from typing import Optional, Callable
 import inspect
 import asyncio
+import threading
+import time
+from array import array
 from collections import deque, defaultdict
 from pyvisa import ResourceManager, InvalidSession
+from pyvisa.constants import StatusCode, EventType, EventMechanism
+from pyvisa.errors import VisaIOError
 # import numpy as np
 
+from read_buffer import ReadBuffer
+from io_executor import IOExecutor, default_executor
+from async_deque import LaneQueue
+from request_context import Outbox, current_request, priority_of, HIGH
+from query_cache import QueryCache
+import postprocess
+
 
 class AsynchronousInterface:
+    # query replies that may be cached: {query pattern: TTL in s (None = until invalidated)}; patterns
+    # are fnmatch-style, so SCPI's literal '*' and '?' are written '[*]' and '[?]'
+    cache_ttls = {'[*]IDN[?]': None}
+    # writes that make cached replies stale: {write pattern: (query patterns,)}
+    cache_invalidations = {'[*]RST': ('*',)}
+    # commands that can be answered entirely from the cache: {cmd: (queries,)}
+    cached_commands = {'idn': ('*IDN?',)}
+    # coroutine commands that may be cancelled to make way for higher-priority work
+    cancellable = ('sleep_async', 'slow_async')
+    # cancellable commands that talk to the instrument, which is resynchronized after they are
+    # cancelled (see `resync_async`)
+    resync_on_cancel = ()
+    # how `wait_complete_async` detects the end of pending operations: 'srq' (service request
+    # event), 'poll' (status polling with backoff) or 'opc' (blocking *OPC? query)
+    completion = 'opc'
+    poll_interval = (0.001, 0.1)        # first and longest status poll period (s)
+
     def __init__(self, resource_name: str, rm: ResourceManager, 
                  inst_id: Optional[str]=None,
                  inst_type: Optional[str]=None,
                  visa_timeout:int=10, read_term:str='\n',
                  write_term:str='\r\n',
                  aiosleep:float=0.01, timeout:int=300,
+                 chunk_size:int=4096,
                  outbox:Optional[deque]=None,
+                 executor:Optional[IOExecutor]=None,
+                 on_idle:Optional[Callable[[], None]]=None,
+                 coalesce:bool=False, coalesce_max:int=16,
+                 cache_size:int=128,
+                 conn=None,
+                 store=None, station:Optional[str]=None, postprocessor=None,
+                 metrics=None,
                  interactive:bool=False) -> None:
         #TODO add error checking
         self.resource_name = resource_name         # name of VISA resource
@@ -25,20 +62,42 @@ class AsynchronousInterface:
         self.read_term = read_term                 # read message termination characters
         self.write_term = write_term               # write message termination characters
         self.aiosleep = aiosleep                   # internal asyncio loop sleep period
+        self.chunk_size = chunk_size               # max bytes pulled from the instrument per read
         self.interactive = interactive             # True = stand-alone mode, no pre-existing event loop
-
-        # VISA connection to instrument
-        self._conn = None
+        self.on_idle = on_idle                     # called whenever the interface finishes its work
+        self.coalesce = coalesce                   # merge consecutive writes/queries into one SCPI transaction
+        self.coalesce_max = coalesce_max           # max commands merged into one transaction
+        self.store = store                         # measurement_store.MeasurementStore for recorded traces
+        self.station = station                     # station the instrument belongs to (recorded with its traces)
+        self.postprocessor = postprocessor         # postprocess.PostProcessor for transforms of recorded traces
+        self.metrics = metrics                     # metrics.Metrics recording inbox, command and VISA timings
+
+        # VISA connection to instrument; all blocking VISA calls run on this session's worker thread
+        self.executor = executor or default_executor()
+        self._io = self.executor.session(resource_name)
+        self._conn = conn                          # reuse an already open session (e.g. from discovery)
+        if conn is not None:
+            conn.timeout = visa_timeout
+            conn.read_termination = read_term
+            conn.write_termination = write_term
         self.connect()
+        self._rbuf = ReadBuffer()                  # bytes read from the instrument but not yet consumed
 
-        # command and output FIFOs
-        self.inbox = deque()
-        self.outbox = deque() if (outbox is None) else outbox
+        # replies to idempotent queries (disabled if cache_size=0)
+        self.cache = QueryCache(self.cache_ttls, self.cache_invalidations, maxsize=cache_size) if cache_size else None
+
+        # command queue (one FIFO lane per priority class) and output FIFO
+        self.inbox = LaneQueue(key=lambda entry: priority_of(entry[4]))
+        self.outbox = Outbox() if (outbox is None) else outbox
         
         # control flag
         self._stop = True
         self._task = None
         self._busy = False
+        self._running = None                       # (cmd, request) of the coroutine command being run
+        self._preempted = False
+        self._srq = None                           # True/False once service requests were tried
+        self._stb = None                           # True/False once serial polls were tried
 
     def connect(self) -> None:
         """
@@ -50,6 +109,15 @@ class AsynchronousInterface:
                                                              read_termination=self.read_term,
                                                              write_termination=self.write_term)
 
+    async def connect_async(self) -> None:
+        """Asynchronous `connect`, opening the resource on the session's worker thread."""
+        await self._io.run(self.connect)
+
+    def _write(self, msg: str) -> int:
+        """Write `msg`, connecting first if needed (one call on the worker thread, like `read_chunk`)."""
+        self.connect()
+        return self._conn.write(msg)
+
     @staticmethod
     def passfunc(r: bytes) -> None:
         pass
@@ -61,30 +129,252 @@ class AsynchronousInterface:
         """Returns True if inbox is empty and not processing a command."""
         return (self.inbox or self._busy)
 
-    async def read_async(self, *args, **kwargs) -> str:
-        """Asynchronous read of resource until `term_char` encountered. Will not timeout."""
+    def _buffered(self) -> Optional[int]:
+        """Number of bytes waiting in the session's buffer, or None if the session cannot tell."""
+        try:
+            return self._conn.bytes_in_buffer
+        except (AttributeError, NotImplementedError, VisaIOError):
+            return None
+
+    def _read_raw(self, count: int) -> bytes:
+        data, _ = self._conn.visalib.read(self._conn.session, count)
+        return bytes(data)
+
+    def read_chunk(self) -> bytes:
+        """
+        Read whatever bytes the instrument has available (up to `chunk_size`), connecting first if
+        needed. Returns b'' if nothing arrived within the VISA timeout.
+
+        Only bytes known to be buffered are asked for, since a read that times out waiting for more
+        loses the bytes it did get: if the buffer is empty, the read waits for one byte and then
+        takes whatever arrived with it. Sessions that cannot report their buffer are asked for
+        `chunk_size` bytes, and rely on the termination character (or END) to end the read."""
         self.connect()
-        toret = []
-        c = None
-        while c != self.read_term[-1].encode():
-            await asyncio.sleep(self.aiosleep)
-            c = self._conn.read_bytes(1)
-            if c:
-                toret.append(c)
-        r = b''.join(toret)
-        return r
+        n = self._buffered()
+        try:
+            data = self._read_raw(self.chunk_size if n is None else (min(n, self.chunk_size) or 1))
+        except VisaIOError as e:
+            if e.error_code == StatusCode.error_timeout:
+                return b''
+            raise
+        if n == 0:
+            rest = min(self._buffered() or 0, self.chunk_size - len(data))
+            if rest:
+                data += self._read_raw(rest)
+        return data
+
+    async def _read_buffered(self, take: Callable[[ReadBuffer], Optional[bytes]]) -> bytes:
+        """
+        Feed the read buffer chunk by chunk until `take` can extract a complete reply from it. The VISA
+        reads block on the session's worker thread (for up to `visa_timeout`), not on the event loop."""
+        while True:
+            r = take(self._rbuf)
+            if r is not None:
+                return r
+            chunk = await self._read_chunk_async()
+            if chunk:
+                self._rbuf.feed(chunk)
+
+    async def _read_chunk_async(self) -> bytes:
+        """`read_chunk` on the session's worker thread, recording its time and size in `metrics`."""
+        if self.metrics is None:
+            return await self._io.run(self.read_chunk)
+        start = time.perf_counter()
+        chunk = await self._io.run(self.read_chunk)
+        self.metrics.observe('visa_read', time.perf_counter() - start, self.id)
+        self.metrics.inc('visa_reads', label=self.id)
+        self.metrics.inc('visa_read_bytes', len(chunk), self.id)
+        return chunk
+
+    async def read_async(self, *args, **kwargs) -> bytes:
+        """Asynchronous read of resource until `read_term` encountered. Will not timeout."""
+        term = self.read_term.encode()
+        return await self._read_buffered(lambda buf: buf.take_until(term))
+
+    async def read_bytes_async(self, count: int, *args, **kwargs) -> bytes:
+        """Asynchronous read of exactly `count` bytes from the resource. Will not timeout."""
+        return await self._read_buffered(lambda buf: buf.take_exactly(count))
+
+    async def read_binblock_async(self, *args, **kwargs) -> bytes:
+        """Asynchronous read of an IEEE-488.2 binary block (#<n><length><data>); returns <data>."""
+        term = self.read_term.encode()
+        return await self._read_buffered(lambda buf: buf.take_binblock(term))
 
     async def write_async(self, msg: str, *args, **kwargs) -> None:
-        """Write to resource. Is blocking because write assumed to be very fast."""
-        self._conn.write(msg)
+        """Asynchronous write to resource, run on the session's worker thread."""
+        if self.metrics is None:
+            await self._io.run(self._write, msg)
+        else:
+            start = time.perf_counter()
+            n = await self._io.run(self._write, msg)
+            self.metrics.observe('visa_write', time.perf_counter() - start, self.id)
+            self.metrics.inc('visa_writes', label=self.id)
+            self.metrics.inc('visa_write_bytes', n or 0, self.id)
+        if self.cache is not None:
+            self.cache.invalidate_for(msg)
+
+    async def query_async(self, msg: str, *args, **kwargs) -> bytes:
+        """
+        Atomic write of `msg` then read of the reply, as a single inbox entry. Cacheable queries are
+        answered from the cache when possible."""
+        if self.cache is not None:
+            reply = self.cache.get(msg)
+            if reply is not None:
+                return reply
+        await self.write_async(msg)
+        reply = await self.read_async()
+        if self.cache is not None:
+            self.cache.put(msg, reply)
+        return reply
+
+    async def stream_values_async(self, name: str, chunk_points: int=256, sep: str=',', *args, **kwargs) -> int:
+        """
+        Read a `sep`-separated list of numbers (the reply to a query already written) and send it to
+        the outbox while it arrives, as a stream `name` of chunks {'offset': n, 'data': array('d')}
+        of up to `chunk_points` values, so the whole trace is never held in memory. Returns the
+        number of values read."""
+        term, sep = self.read_term.encode(), sep.encode()
+        wait_space = getattr(self.outbox, 'wait_space', None)
+        pending = array('d')
+        offset = seq = 0
+        last = False
+        while not last:
+            fields = self._rbuf.take_fields(sep, term)
+            if fields is None:
+                chunk = await self._read_chunk_async()
+                if chunk:
+                    self._rbuf.feed(chunk)
+                continue
+            data, last = fields
+            pending.extend(float(v) for v in data.split(sep) if v.strip())
+            # keep at least one value back until the end, so the final chunk is never empty
+            while len(pending) > chunk_points or (last and (pending or not seq)):
+                if wait_space is not None:
+                    await wait_space()
+                values, pending = pending[:chunk_points], pending[chunk_points:]
+                final = last and not pending
+                self.outbox.append_chunk({'offset': offset, 'data': values}, name, seq, final)
+                offset += len(values)
+                seq += 1
+                if final:
+                    break
+        return offset
 
-    async def slow_async(self, t: int=5, *args, **kwargs) -> None:  #DELME
+    @staticmethod
+    def join_scpi(msgs: list) -> str:
+        """
+        Join SCPI commands into one compound message. Every command after the first is made absolute
+        (leading ':') unless it is a common command ('*...'), so it does not resolve relative to the
+        previous command's header path."""
+        return ';'.join([msgs[0]] + [m if m.startswith((':', '*')) else f":{m}" for m in msgs[1:]])
+
+    async def transaction_async(self, msgs: list, n_queries: int, *args, **kwargs) -> list:
+        """
+        Write `msgs` as a single ';'-joined SCPI transaction and return the replies to its
+        `n_queries` queries, in order (each with the read termination, like `read_async`)."""
+        await self.write_async(self.join_scpi(msgs))
+        if not n_queries:
+            return []
+        term = self.read_term.encode()
+        reply = await self.read_async()
+        parts = reply[:-len(term)].split(b';') if reply.endswith(term) else reply.split(b';')
+        if len(parts) != n_queries:
+            raise ValueError(f"Expected {n_queries} replies to {msgs}, got {reply!r}")
+        return [part + term for part in parts]
+
+    async def wait_complete_async(self, mode: Optional[str]=None, *args, **kwargs) -> float:
+        """
+        Wait until the instrument reports that all pending operations are complete, using `mode`
+        (default: `completion`; 'srq' falls back to 'poll' if the backend has no service request
+        events). Returns the time waited, in s."""
+        start = time.monotonic()
+        mode = mode or self.completion
+        if mode not in ('srq', 'poll', 'opc'):
+            raise ValueError(f"Invalid completion mode {mode!r}")
+        if mode == 'srq':
+            if await self._wait_srq():
+                return time.monotonic() - start
+            mode = 'poll'
+        if mode == 'poll':
+            await self._poll_complete()
+        else:
+            await self.query_async('*OPC?')
+        return time.monotonic() - start
+
+    def _enable_srq(self) -> bool:
+        """Enable queued service request events; False if the backend does not support them."""
+        self.connect()
+        if self._srq is None:
+            try:
+                self._conn.enable_event(EventType.service_request, EventMechanism.queue)
+                self._srq = True
+            except (NotImplementedError, VisaIOError):
+                self._srq = False
+        return self._srq
+
+    def _wait_srq_blocking(self, deadline: float, cancelled: threading.Event) -> None:
+        """Wait for a service request in `visa_timeout` slices, until `deadline` or until `cancelled` is set."""
+        while not cancelled.is_set():
+            if time.monotonic() > deadline:
+                raise VisaIOError(StatusCode.error_timeout)
+            try:
+                self._conn.wait_on_event(EventType.service_request, self.visa_timeout)
+                return
+            except VisaIOError as e:
+                if e.error_code != StatusCode.error_timeout:
+                    raise
+
+    async def _wait_srq(self) -> bool:
+        """
+        Wait for the service request raised when the pending operations complete (operation complete
+        -> event status bit -> SRQ). Returns False if service requests are not supported."""
+        if not await self._io.run(self._enable_srq):
+            return False
+        for msg in ('*CLS', '*ESE 1', '*SRE 32'):
+            await self.write_async(msg)
+        # drop service requests queued by earlier operations, so only this *OPC can end the wait
+        await self._io.run(self._conn.discard_events, EventType.service_request, EventMechanism.queue)
+        await self.write_async('*OPC')
+        deadline = time.monotonic() + self.timeout
+        request = current_request.get()
+        if (request is not None) and (request.deadline is not None):
+            deadline = min(deadline, request.deadline)
+        cancelled = threading.Event()
+        try:
+            await self._io.run(self._wait_srq_blocking, deadline, cancelled)
+        except asyncio.CancelledError:
+            cancelled.set()  # the worker thread gives up within `visa_timeout`
+            raise
+        await self.query_async('*ESR?')  # clears the event status register
+        return True
+
+    async def _poll_complete(self) -> None:
+        """
+        Set the operation complete bit when pending operations finish (*OPC) and poll for it, with a
+        poll period doubling from `poll_interval[0]` up to `poll_interval[1]`. Uses serial polls of the
+        status byte where supported, otherwise *ESR? queries."""
+        for msg in ('*CLS', '*ESE 1', '*OPC'):
+            await self.write_async(msg)
+        delay, longest = self.poll_interval
+        while not await self._operation_complete():
+            await asyncio.sleep(delay)
+            delay = min(2 * delay, longest)
+
+    async def _operation_complete(self) -> bool:
+        if self._stb is not False:
+            try:
+                stb = await self._io.run(self._conn.read_stb)
+                self._stb = True
+                if not stb & 32:  # event status bit, summarizing *ESE 1 = operation complete
+                    return False
+            except (NotImplementedError, VisaIOError):
+                self._stb = False
+        return bool(int(await self.query_async('*ESR?')) & 1)
+
+    async def slow_async(self, t: int=5, *args, **kwargs) -> None:
         """A slow-running task for testing."""
-        print("entered slow")
         for i in range(t):
-            print(f"-->slow {i}")
             await asyncio.sleep(1)
-        print("exiting slow")
 
     async def sleep_async(self, period: float=5, *args, **kwargs) -> None:
         """Sleep this instrument for `period` seconds."""
@@ -93,34 +383,156 @@ class AsynchronousInterface:
         self._busy = False
 
     def add_to_inbox(self, cmd: str, *args, callback: Optional[Callable[..., None]]=None, **kwargs) -> None:
-        """Schedules command for execution. First pos arg is cmd, rest are args/kwargs."""
-        self.inbox.append((cmd, callback, args, kwargs))
+        """
+        Schedules command for execution. First pos arg is cmd, rest are args/kwargs. The command
+        belongs to the current request (see `request_context.current_request`)."""
+        self.inbox.append((cmd, callback, args, kwargs, current_request.get()))
     
+    _coalescable = ('write_async', 'query_async')
+
+    def _next_batch(self) -> list:
+        """
+        Pop the next inbox entry, plus (if `coalesce`) the consecutive writes/queries that follow it
+        when it is a write/query itself."""
+        batch = [self.inbox.popleft()]
+        if self.coalesce and batch[0][0] in self._coalescable:
+            while self.inbox and (len(batch) < self.coalesce_max) and (self.inbox.peek()[0] in self._coalescable):
+                batch.append(self.inbox.popleft())
+        return batch
+
+    def _drop_expired(self, batch: list) -> list:
+        """Answer the entries of `batch` whose request deadline has passed with an error; return the rest."""
+        keep = []
+        for entry in batch:
+            cmd, _, _, _, request = entry
+            if (request is not None) and request.expired():
+                token = current_request.set(request)
+                self.outbox.append_error(f"{self.id} / {cmd}: dropped, deadline expired")
+                current_request.reset(token)
+            else:
+                keep.append(entry)
+        return keep
+
     async def process_command(self) -> None:
-        """Process a single command off the queue."""
+        """Process a single command (or a coalesced transaction of commands) off the queue."""
         if not self.inbox:
             return
 
         self._busy = True
-        cmd, callback, args, kwargs = self.inbox.popleft()
-        method = getattr(self, cmd)
-        if asyncio.iscoroutinefunction(method):
+        batch = self._drop_expired(self._next_batch())
+        if len(batch) == 1:
+            await self._process_entry(*batch[0])
+        elif batch:
+            await self._process_transaction(batch)
+        self._busy = False
+        if self.on_idle and not self.busy():
+            self.on_idle()
+
+    def _started(self, request) -> None:
+        """Record how long the command of `request` waited in the inbox since it was dispatched."""
+        if (self.metrics is not None) and (request is not None) and (request.dispatched is not None):
+            self.metrics.observe('inbox', time.monotonic() - request.dispatched, self.id)
+            request.dispatched = None  # follow-up commands of the same request are not counted again
+
+    async def _process_entry(self, cmd, callback, args, kwargs, request) -> None:
+        token = current_request.set(request)  # responses and follow-up commands belong to this request
+        self._started(request)
+        start = time.perf_counter()
+        method = getattr(self, cmd, None)
+        if method is None:
+            self.outbox.append_error(f"Invalid command: {self.id} {cmd} {args} {kwargs}")
+        elif asyncio.iscoroutinefunction(method):
             loop = asyncio.get_running_loop()
             self._task = loop.create_task(method(*args, **kwargs))
+            self._running = (cmd, request)
             try:
                 ret = await asyncio.wait_for(self._task, timeout=self.timeout)  # give up after timeout
                 if callback:
                     callback(ret)
-            except TimeoutError:
-                print(f"task {self._task} timed out")  #DELME
-                #TODO handle timeouts meaningfully
+            except asyncio.TimeoutError:
+                self.outbox.append_error(f"{self.id} / {cmd}: timed out after {self.timeout} s")
+            except asyncio.CancelledError:
+                if not self._preempted:
+                    raise
+                self.outbox.append_error(f"{self.id} / {cmd}: preempted by a higher-priority command")
+                if cmd in self.resync_on_cancel:
+                    await self.resync_async()
+            except (ValueError, TypeError, VisaIOError) as e:
+                self.outbox.append_error(f"{self.id} / {cmd}: failed ({e!r})")
+            finally:
+                self._running = None
+                self._preempted = False
         else:
             try:
                 method(*args, **kwargs)
             except (AttributeError, TypeError) as e:
-                print(f"Invalid command: {self.id} {cmd} {args} {kwargs}")
-                self.outbox.append(f"Invalid command: {self.id} {cmd} {args} {kwargs}")
-        self._busy = False
+                self.outbox.append_error(f"Invalid command: {self.id} {cmd} {args} {kwargs}")
+        if self.metrics is not None:
+            self.metrics.observe('command', time.perf_counter() - start, self.id)
+        current_request.reset(token)
+
+    def _answer(self, callback: Optional[Callable[..., None]], reply, source: str) -> None:
+        """Hand `reply` to `callback`; a failing callback is reported as an error instead of stopping the interface."""
+        if not callback:
+            return
+        try:
+            callback(reply)
+        except (ValueError, TypeError, ArithmeticError, LookupError, AttributeError) as e:
+            self.outbox.append_error(f"{self.id} / {source}: failed ({e!r})")
+
+    async def _process_transaction(self, batch: list) -> None:
+        """Run coalesced write/query entries as one transaction and hand each caller its own reply."""
+        for *_, request in batch:
+            self._started(request)
+        start = time.perf_counter()
+        # answer cacheable queries from the cache part by part, in order, so that a write earlier in
+        # the batch still makes the cached replies of the queries after it stale
+        cached = {}     # batch index -> cached reply
+        if self.cache is not None:
+            for i, (cmd, _, args, _, _) in enumerate(batch):
+                if cmd != 'query_async':
+                    self.cache.invalidate_for(args[0])
+                    continue
+                reply = self.cache.get(args[0])
+                if reply is not None:
+                    cached[i] = reply
+        sent = [entry for i, entry in enumerate(batch) if i not in cached]
+        replies, error = iter(()), None
+        if sent:
+            msgs = [args[0] for _, _, args, _, _ in sent]
+            n_queries = sum(1 for cmd, *_ in sent if cmd == 'query_async')
+            loop = asyncio.get_running_loop()
+            self._task = loop.create_task(self.transaction_async(msgs, n_queries))
+            try:
+                fresh = await asyncio.wait_for(self._task, timeout=self.timeout)
+            except (asyncio.TimeoutError, ValueError, VisaIOError) as e:
+                error = e
+            else:
+                if self.cache is not None:
+                    # replay the transaction on the cache, so replies of queries followed by an
+                    # invalidating write are not stored
+                    parts = iter(fresh)
+                    for cmd, _, args, _, _ in sent:
+                        if cmd == 'query_async':
+                            self.cache.put(args[0], next(parts))
+                        else:
+                            self.cache.invalidate_for(args[0])
+                replies = iter(fresh)
+        for i, (cmd, callback, args, kwargs, request) in enumerate(batch):
+            token = current_request.set(request)
+            try:
+                if i in cached:
+                    self._answer(callback, cached[i], args[0])
+                elif error is not None:
+                    self.outbox.append_error(f"{self.id} / {args[0]}: transaction failed ({error!r})")
+                elif cmd == 'query_async':
+                    self._answer(callback, next(replies), args[0])
+                else:
+                    self._answer(callback, None, args[0])
+            finally:
+                current_request.reset(token)
+        if self.metrics is not None:
+            self.metrics.observe('command', time.perf_counter() - start, self.id)
 
     async def process_all_commands(self) -> None:
         """Process all of the commands in the queue."""
@@ -130,12 +542,52 @@ class AsynchronousInterface:
     async def process_commands_forever(self) -> None:
         """Continually processes commands in the queue until stopped by self.stop()."""
         self._stop = False
+        wait_space = getattr(self.outbox, 'wait_space', None)
         while not self._stop:
-            if not self.inbox:
-                await asyncio.sleep(self.aiosleep)  #FIXME
-                continue
+            await self.inbox.wait()
+            if wait_space is not None:
+                await wait_space()  # let the responses drain before producing more
             await self.process_command()
 
+    async def resync_async(self) -> None:
+        """
+        Bring the instrument back in step after a command was cancelled part-way through its I/O:
+        device clear (aborts pending operations and replies), *CLS, and drop partially read replies."""
+        try:
+            await self._io.run(self._conn.clear)
+        except (NotImplementedError, AttributeError, VisaIOError):
+            pass
+        self._rbuf.clear()
+        try:
+            await self.write_async('*CLS')
+        except VisaIOError as e:
+            self.outbox.append_error(f"{self.id} / resync: failed ({e!r})")
+
+    def preempt(self, priority: int=HIGH) -> bool:
+        """
+        Cancel the running command if it is `cancellable` and has a lower priority than `priority`, so
+        queued higher-priority work can start. Returns True if a command was cancelled."""
+        if (self._running is None) or self._preempted or self._task.done():
+            return False
+        cmd, request = self._running
+        if (cmd not in self.cancellable) or (priority_of(request) <= priority):
+            return False
+        self._preempted = True
+        self._task.cancel()
+        return True
+
+    def serve_cached(self, cmd: str, args: list, kwargs: dict) -> bool:
+        """
+        Run `cmd` right away if the interface is idle and every query it needs is cached, so it is
+        answered without queueing or touching the instrument. Returns True if it was served."""
+        queries = self.cached_commands.get(cmd)
+        if (self.cache is None) or (queries is None) or self.busy():
+            return False
+        if any(self.cache.peek(q) is None for q in queries):
+            return False
+        getattr(self, cmd)(*args, **kwargs)
+        return True
+
     def stop(self) -> None:
         """Stops self.process_commands_forever loop."""
         self._stop = True
@@ -146,8 +598,12 @@ class AsynchronousInterface:
         """@expose Ask (write then read response) of command `cmd`"""
         if callback is None:
             callback = lambda r: self.outbox.append(f"{self.id} / ask: {r}")
-        self.add_to_inbox("write_async", cmd, callback=False)
-        self.add_to_inbox("read_async", callback=callback)
+        if (self.cache is not None) and not self.busy():
+            reply = self.cache.get(cmd)
+            if reply is not None:
+                callback(reply)
+                return
+        self.add_to_inbox("query_async", cmd, callback=callback)
         
         if self.interactive:
             asyncio.run(interface.process_all_commands())
@@ -173,7 +629,6 @@ class AsynchronousInterface:
         elif not callback:
             callback = lambda x: self.outbox.append(f"{self.id} / write: {msg}")
 
-        print(f"--> instr.write {msg = }")  #DELME
         self.add_to_inbox("write_async", msg, callback=callback)
 
         if self.interactive:
@@ -185,12 +640,22 @@ class AsynchronousInterface:
             callback = self.passfunc
         elif not callback:
             callback = lambda x: self.outbox.append(f"{self.id} / sleep: {period} s")
-        print(f"IN sleep {period = }")  #DELME
         self.add_to_inbox("sleep_async", period, callback=callback)
 
         if self.interactive:
             asyncio.run(interface.process_all_commands())        
 
+    def wait_complete(self, mode: Optional[str]=None, callback: Optional[Callable[..., None]]=None) -> None:
+        """@expose Wait until the instrument reports its pending operations complete (`mode` = 'opc', 'poll' or 'srq')"""
+        if callback is False:
+            callback = self.passfunc
+        elif not callback:
+            callback = lambda t: self.outbox.append(f"{self.id} / wait_complete: {t:.3f} s")
+        self.add_to_inbox("wait_complete_async", mode, callback=callback)
+
+        if self.interactive:
+            asyncio.run(interface.process_all_commands())
+
     # default SCPI commands
     def idn(self) -> None:
         """@expose Get the ID of the instrument. Asks the *IDN? command."""
@@ -199,6 +664,11 @@ class AsynchronousInterface:
 
     #TODO add other default commands...
 
+    def cache_stats(self) -> None:
+        """@expose Report the size and hit/miss counters of the query cache"""
+        stats = self.cache.stats() if (self.cache is not None) else "cache disabled"
+        self.outbox.append({f"{self.id} / cache_stats": stats})
+
     def list_methods(self) -> None:
         d = {}
         methods = inspect.getmembers(self, predicate=inspect.ismethod)
@@ -214,6 +684,12 @@ class AsynchronousInterface:
 
 class PowerSupply(AsynchronousInterface):
     """@expose This is a power supply."""
+    cache_ttls = {**AsynchronousInterface.cache_ttls, 'VOLT[?]': 1., 'OUTPUT[?]': 1.}
+    cache_invalidations = {**AsynchronousInterface.cache_invalidations,
+                           'VOLT *': ('VOLT[?]',), 'OUTPUT *': ('OUTPUT[?]',)}
+    cached_commands = {**AsynchronousInterface.cached_commands,
+                       'get_voltage': ('VOLT?',), 'get_output': ('OUTPUT?',)}
+
     def __init__(self, resource_name: str, rm: ResourceManager, inst_type: str='PowerSupply', *args, **kwargs) -> None:
         super().__init__(resource_name, rm, inst_type=inst_type, *args, **kwargs)
 
@@ -235,13 +711,24 @@ class PowerSupply(AsynchronousInterface):
 
     def get_output(self, enable: bool=True) -> None:
         """@expose Get the current output state"""
-        callback = lambda r: self.outbox.append(f"{self.id} ({self.inst_type}) / get_output: {'1' if r else '0'}")
-        self.write(f"OUTPUT?", callback=callback)
+        callback = lambda r: self.outbox.append(f"{self.id} ({self.inst_type}) / get_output: {'1' if int(r) else '0'}")
+        self.ask(f"OUTPUT?", callback=callback)
 
 class VectorNetworkAnalyzer(AsynchronousInterface):
     """@expose This is a VNA."""
+    cache_ttls = {**AsynchronousInterface.cache_ttls, 'SENSE:FREQUENCY:*[?]': 5.}
+    cache_invalidations = {**AsynchronousInterface.cache_invalidations,
+                           'SENSE:FREQUENCY:*': ('SENSE:FREQUENCY:*[?]',)}
+    cached_commands = {**AsynchronousInterface.cached_commands,
+                       'get_frequency_range': ('SENSE:FREQUENCY:START?', 'SENSE:FREQUENCY:STOP?',
+                                               'SENSE:FREQUENCY:POINTS?')}
+    cancellable = AsynchronousInterface.cancellable + ('sweep_async', 'trace_async', 'measure_async')
+    resync_on_cancel = ('sweep_async', 'trace_async', 'measure_async')
+
     def __init__(self, resource_name: str, rm: ResourceManager, inst_type: str='VNA', *args, **kwargs) -> None:
         super().__init__(resource_name, rm, inst_type=inst_type, *args, **kwargs)
+        self.pipeline = ()              # post-processing applied to S-parameter measurements
+        self._postprocessing = set()    # running post-processing tasks
 
     def set_frequency_range(self, start:float, end:float, Npoints:int) -> None:
         """@expose Sets the frequency range from `start` to `end` in GHz, with `Npoints` steps."""
@@ -259,32 +746,93 @@ class VectorNetworkAnalyzer(AsynchronousInterface):
         callback = lambda r: self.outbox.append(f"{self.id} ({self.inst_type}) / get_freq_npoints: {int(r):d}")
         self.ask(f"SENSE:FREQUENCY:POINTS?", callback=callback)
 
-    def snm(self, fname:str, param:str, Npoints:Optional[int]=201) -> None:
-        """Sleep a bit then write junk data to the specific file, simulating a S-parameter measurement"""
-        callback = lambda x: self.outbox.append(f"{self.id} / {param}: data saved to {fname}")
+    async def sweep_async(self, *args, **kwargs) -> float:
+        """Trigger a single sweep and wait until the instrument reports it complete; returns its duration."""
+        await self.write_async("INITIATE:IMMEDIATE")
+        return await self.wait_complete_async()
 
-        self.sleep(5, callback=callback)
-        with open(fname, 'w') as f:
-            import random
-            for i in range(Npoints):
-                f.write("{}\n".format(random.uniform(-60, 0)))
+    async def trace_async(self, param: str='S11', chunk_points: int=256, *args, **kwargs) -> int:
+        """Sweep, then stream the `param` trace to the outbox while it is read; returns the number of points."""
+        await self.sweep_async()
+        await self.write_async(f"CALCULATE:DATA? {param.upper()}")
+        return await self.stream_values_async(f"{self.id} / trace {param.upper()}", chunk_points)
 
-    def s11(self, fname:str) -> None:
-        """@expose Make S11 measurement and write results to `fname`. NOTE: Toy placeholder. Sleeps for 5 sec, then writes junk."""
-        self.snm(fname, 's11')
+    def trace(self, param: str='S11', chunk_points: int=256) -> None:
+        """@expose Measure S-parameter `param` and stream the trace back in chunks of up to `chunk_points` points"""
+        self.add_to_inbox("trace_async", param, chunk_points, callback=self.passfunc)
+
+    async def measure_async(self, param: str, meta: Optional[dict]=None, *args, **kwargs) -> tuple:
+        """
+        Sweep, read the `param` trace and record it in the measurement store with the sweep settings;
+        returns (measurement ID, trace)."""
+        if self.store is None:
+            raise ValueError(f"{self.id} has no measurement store")
+        await self.sweep_async()
+        reply = await self.query_async(f"CALCULATE:DATA? {param.upper()}")
+        data = array('d', (float(v) for v in reply.split(b',') if v.strip()))
+        start = float(await self.query_async("SENSE:FREQUENCY:START?"))
+        stop = float(await self.query_async("SENSE:FREQUENCY:STOP?"))
+        mid = await self._io.run(self.store.append, data, self.id, station=self.station, param=param.upper(),
+                                 start=start, stop=stop, meta=meta)
+        return mid, data
+
+    async def postprocess_async(self, param: str, mid: int, data: array, pipeline: tuple) -> None:
+        """
+        Run `pipeline` on the trace of measurement `mid` and record the result next to it (with
+        metadata {'source': mid, 'pipeline': ...}), then report both measurement IDs."""
+        spec = postprocess.format_pipeline(pipeline)
+        try:
+            result, = await self.postprocessor.run(pipeline, [data])
+            record = await self.executor.run(self.store.record, mid)
+            pid = await self.executor.run(self.store.append, result, self.id, station=self.station,
+                                          param=record.param, start=record.start, stop=record.stop,
+                                          meta={'source': mid, 'pipeline': spec})
+        except (ValueError, TypeError, ArithmeticError) as e:
+            self.outbox.append_error(f"{self.id} / {param}: saved as measurement {mid}; {spec} failed ({e!r})")
+            return
+        self.outbox.append(f"{self.id} / {param}: saved as measurement {mid}, {spec} as measurement {pid}")
+
+    def snm(self, param: str, fname: Optional[str]=None) -> None:
+        """
+        Measure S-parameter `param` into the measurement store, labelling it `fname` if given. If a
+        post-processing pipeline is set, it runs after the instrument is released for its next
+        command, and the reply is sent once the processed trace is recorded too."""
+        def callback(result):
+            mid, data = result
+            if self.pipeline and (self.postprocessor is not None):
+                task = asyncio.ensure_future(self.postprocess_async(param, mid, data, self.pipeline))
+                self._postprocessing.add(task)
+                task.add_done_callback(self._postprocessing.discard)
+            else:
+                self.outbox.append(f"{self.id} / {param}: saved as measurement {mid}")
+
+        meta = {'name': fname} if fname else None
+        self.add_to_inbox("measure_async", param, meta, callback=callback)
+
+    def set_pipeline(self, pipeline: str='') -> None:
+        """@expose Post-process every S-parameter measurement with `pipeline` (e.g. 'smooth:5,db'; '' = none)"""
+        try:
+            self.pipeline = postprocess.parse_pipeline(pipeline)
+        except ValueError as e:
+            self.outbox.append_error(f"{self.id} ({self.inst_type}) / set_pipeline: {e}")
+            return
+        self.outbox.append(f"{self.id} ({self.inst_type}) / set_pipeline: {postprocess.format_pipeline(self.pipeline) or 'none'}")
 
-    def s12(self, fname:str) -> None:
-        """@expose Make S12 measurement and write results to `fname`. NOTE: Toy placeholder. Sleeps for 5 sec, then writes junk."""
-        self.snm(fname, 's12')
+    def s11(self, fname: Optional[str]=None) -> None:
+        """@expose Make S11 measurement and record it in the measurement store (labelled `fname`, if given)."""
+        self.snm('s11', fname)
 
-    def s21(self, fname:str) -> None:
-        """@expose Make S21 measurement and write results to `fname`. NOTE: Toy placeholder. Sleeps for 5 sec, then writes junk."""
-        self.snm(fname, 's21')
+    def s12(self, fname: Optional[str]=None) -> None:
+        """@expose Make S12 measurement and record it in the measurement store (labelled `fname`, if given)."""
+        self.snm('s12', fname)
 
-    def s22(self, fname:str) -> None:
-        """@expose Make S22 measurement and write results to `fname`. NOTE: Toy placeholder. Sleeps for 5 sec, then writes junk."""
-        self.snm(fname, 's22')
+    def s21(self, fname: Optional[str]=None) -> None:
+        """@expose Make S21 measurement and record it in the measurement store (labelled `fname`, if given)."""
+        self.snm('s21', fname)
 
+    def s22(self, fname: Optional[str]=None) -> None:
+        """@expose Make S22 measurement and record it in the measurement store (labelled `fname`, if given)."""
+        self.snm('s22', fname)
 
 if __name__ == "__main__":
     rm = ResourceManager('default.yaml@sim')
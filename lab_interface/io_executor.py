@@ -0,0 +1,92 @@
+from typing import Optional, Callable, Any
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class SessionExecutor:
+    """
+    Awaitable wrapper around the worker thread dedicated to a single VISA session.
+
+    All calls for one session run in order on the same thread, so a slow or timed-out instrument
+    only ever blocks its own calls, never the event loop or another instrument.
+    """
+    def __init__(self, key: str, pool: ThreadPoolExecutor) -> None:
+        self.key = key
+        self._pool = pool
+
+    async def run(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """Run blocking `func(*args, **kwargs)` on this session's worker thread and await the result."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._pool, functools.partial(func, *args, **kwargs))
+
+
+class IOExecutor:
+    """
+    Pool of worker threads for blocking VISA I/O.
+
+    Each session (keyed by resource name) gets its own single-threaded executor, up to
+    `max_threads` threads; past that, new sessions share the least-loaded existing thread.
+    Calls that do not belong to a session (e.g. `ResourceManager.list_resources`) run on a
+    small shared pool of `shared_workers` threads.
+    """
+    def __init__(self, max_threads: Optional[int]=None, shared_workers: int=4) -> None:
+        self.max_threads = max_threads
+        self._lock = threading.Lock()
+        self._threads = []      # [[ThreadPoolExecutor, n_sessions], ...]
+        self._sessions = {}     # key -> (SessionExecutor, thread entry)
+        self._shared = ThreadPoolExecutor(max_workers=shared_workers, thread_name_prefix='visa-shared')
+
+    def session(self, key: str) -> SessionExecutor:
+        """Get (creating if necessary) the executor dedicated to session `key`."""
+        with self._lock:
+            try:
+                return self._sessions[key][0]
+            except KeyError:
+                pass
+            if (self.max_threads is None) or (len(self._threads) < self.max_threads):
+                entry = [ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'visa-{key}'), 0]
+                self._threads.append(entry)
+            else:
+                entry = min(self._threads, key=lambda e: e[1])
+            entry[1] += 1
+            session = SessionExecutor(key, entry[0])
+            self._sessions[key] = (session, entry)
+            return session
+
+    def release(self, key: str) -> None:
+        """Forget session `key`, shutting down its thread if no other session uses it."""
+        with self._lock:
+            try:
+                _, entry = self._sessions.pop(key)
+            except KeyError:
+                return
+            entry[1] -= 1
+            if entry[1] <= 0:
+                self._threads.remove(entry)
+                entry[0].shutdown(wait=False)
+
+    async def run(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """Run blocking `func(*args, **kwargs)` on the shared pool and await the result."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._shared, functools.partial(func, *args, **kwargs))
+
+    def shutdown(self, wait: bool=False) -> None:
+        """Shut down all worker threads."""
+        with self._lock:
+            for pool, _ in self._threads:
+                pool.shutdown(wait=wait)
+            self._threads.clear()
+            self._sessions.clear()
+        self._shared.shutdown(wait=wait)
+
+
+_default_executor = None
+
+def default_executor() -> IOExecutor:
+    """Process-wide executor used by interfaces that are not given one explicitly."""
+    global _default_executor
+    if _default_executor is None:
+        _default_executor = IOExecutor()
+    return _default_executor
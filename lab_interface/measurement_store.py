@@ -0,0 +1,201 @@
+"""
+Binary measurement store.
+
+Traces are appended as raw typed arrays to memory-mapped segment files (`segment-NNNNNN.bin`,
+preallocated to `segment_size` bytes, every trace 8-byte aligned) under the store directory. An
+SQLite index (`index.sqlite`) records, for every trace, the instrument, station, parameter,
+timestamp, sweep settings and free-form metadata, plus where its data lives. Reading a trace back
+returns a zero-copy view of the mapped segment (a numpy array if numpy is installed, otherwise a
+typed memoryview), valid while the store is open.
+
+All methods are blocking and thread-safe; from the event loop, run them on an executor.
+"""
+from typing import Optional, Any, NamedTuple
+import json
+import mmap
+import os
+import sqlite3
+import threading
+import time
+from array import array
+
+import codec
+
+
+class Measurement(NamedTuple):
+    id: int
+    instrument: str
+    station: Optional[str]
+    param: Optional[str]
+    timestamp: float        # time.time() when the trace was stored
+    start: Optional[float]  # sweep settings (e.g. frequencies in GHz); None if not applicable
+    stop: Optional[float]
+    npoints: int
+    dtype: str
+    shape: tuple
+    meta: dict
+    segment: int
+    offset: int
+    nbytes: int
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS measurements (
+    id INTEGER PRIMARY KEY,
+    instrument TEXT NOT NULL,
+    station TEXT,
+    param TEXT,
+    timestamp REAL NOT NULL,
+    start REAL,
+    stop REAL,
+    npoints INTEGER NOT NULL,
+    dtype TEXT NOT NULL,
+    shape TEXT NOT NULL,
+    meta TEXT NOT NULL,
+    segment INTEGER NOT NULL,
+    offset INTEGER NOT NULL,
+    nbytes INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS by_instrument ON measurements (instrument, timestamp);
+CREATE INDEX IF NOT EXISTS by_station ON measurements (station, timestamp);
+CREATE INDEX IF NOT EXISTS by_param ON measurements (param, timestamp);
+CREATE INDEX IF NOT EXISTS by_timestamp ON measurements (timestamp);
+"""
+_COLUMNS = "id, instrument, station, param, timestamp, start, stop, npoints, dtype, shape, meta, segment, offset, nbytes"
+
+
+class MeasurementStore:
+    def __init__(self, root: str, segment_size: int=64 * 2**20) -> None:
+        self.root = root
+        self.segment_size = segment_size
+        os.makedirs(root, exist_ok=True)
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(os.path.join(root, 'index.sqlite'), check_same_thread=False)
+        self._db.executescript(_SCHEMA)
+        self._maps = {}         # segment number -> (file, mmap)
+        row = self._db.execute("SELECT segment, offset + nbytes FROM measurements "
+                               "ORDER BY segment DESC, offset DESC LIMIT 1").fetchone()
+        self._segment, self._offset = row if row else (0, 0)
+
+    def _path(self, segment: int) -> str:
+        return os.path.join(self.root, f"segment-{segment:06d}.bin")
+
+    def _map(self, segment: int, size: Optional[int]=None) -> mmap.mmap:
+        """Map segment number `segment`, creating or growing its file to at least `size` bytes."""
+        entry = self._maps.get(segment)
+        if entry is None:
+            path = self._path(segment)
+            f = open(path, 'r+b' if os.path.exists(path) else 'w+b')
+            if (size is not None) and (os.fstat(f.fileno()).st_size < size):
+                f.truncate(size)    # sparse on most filesystems
+            m = mmap.mmap(f.fileno(), 0)
+            self._maps[segment] = (f, m)
+        else:
+            m = entry[1]
+            if (size is not None) and (len(m) < size):
+                m.resize(size)
+        return m
+
+    def append(self, data: Any, instrument: str, station: Optional[str]=None, param: Optional[str]=None,
+               start: Optional[float]=None, stop: Optional[float]=None, meta: Optional[dict]=None,
+               timestamp: Optional[float]=None) -> int:
+        """
+        Store the trace `data` (numpy array, `array.array`, typed memoryview or list of floats) with
+        its index entry; returns the measurement ID.
+        """
+        if isinstance(data, (list, tuple)):
+            data = array('d', data)
+        info = codec.array_info(data)
+        if info is None:
+            raise TypeError(f"Cannot store object of type {type(data).__name__}")
+        dtype, shape, raw = info
+        nbytes = raw.nbytes
+        with self._lock:
+            offset = (self._offset + 7) & ~7
+            if offset and (offset + nbytes > len(self._map(self._segment))):
+                self._segment += 1  # traces never straddle segments; an oversized one gets its own
+                offset = 0
+            m = self._map(self._segment, max(self.segment_size, offset + nbytes))
+            m[offset:offset + nbytes] = raw
+            self._offset = offset + nbytes
+            cur = self._db.execute(
+                f"INSERT INTO measurements ({_COLUMNS}) VALUES (NULL, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (instrument, station, param, time.time() if timestamp is None else timestamp, start, stop,
+                 shape[0] if shape else 0, dtype, json.dumps(list(shape)), json.dumps(meta or {}),
+                 self._segment, offset, nbytes))
+            self._db.commit()
+            return cur.lastrowid
+
+    @staticmethod
+    def _record(row: tuple) -> Measurement:
+        row = list(row)
+        row[9] = tuple(json.loads(row[9]))
+        row[10] = json.loads(row[10])
+        return Measurement(*row)
+
+    def record(self, mid: int) -> Measurement:
+        """Index entry of measurement `mid` (KeyError if there is none)."""
+        with self._lock:
+            row = self._db.execute(f"SELECT {_COLUMNS} FROM measurements WHERE id = ?", (mid,)).fetchone()
+        if row is None:
+            raise KeyError(f"No measurement {mid}")
+        return self._record(row)
+
+    def data(self, record: Measurement) -> Any:
+        """Zero-copy view of the trace of `record`, backed by the mapped segment file."""
+        with self._lock:
+            m = self._map(record.segment)
+        buf = memoryview(m)[record.offset:record.offset + record.nbytes]
+        return codec.make_array(buf, record.dtype, record.shape)
+
+    def load(self, mid: int) -> tuple:
+        """(index entry, zero-copy trace) of measurement `mid`."""
+        record = self.record(mid)
+        return record, self.data(record)
+
+    def query(self, instrument: Optional[str]=None, station: Optional[str]=None, param: Optional[str]=None,
+              since: Optional[float]=None, until: Optional[float]=None, fmin: Optional[float]=None,
+              fmax: Optional[float]=None, limit: Optional[int]=None) -> list:
+        """
+        Index entries matching all of the given criteria, oldest first: `since` <= timestamp <
+        `until`, and sweeps overlapping the [`fmin`, `fmax`] range.
+        """
+        where, values = [], []
+        for column, value in (('instrument', instrument), ('station', station), ('param', param)):
+            if value is not None:
+                where.append(f"{column} = ?")
+                values.append(value)
+        for clause, value in (("timestamp >= ?", since), ("timestamp < ?", until),
+                              ("stop >= ?", fmin), ("start <= ?", fmax)):
+            if value is not None:
+                where.append(clause)
+                values.append(value)
+        sql = f"SELECT {_COLUMNS} FROM measurements"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY timestamp, id"
+        if limit is not None:
+            sql += " LIMIT ?"
+            values.append(int(limit))
+        with self._lock:
+            rows = self._db.execute(sql, values).fetchall()
+        return [self._record(row) for row in rows]
+
+    def flush(self) -> None:
+        """Write the mapped segments back to disk."""
+        with self._lock:
+            for _, m in self._maps.values():
+                m.flush()
+
+    def close(self) -> None:
+        """Flush and unmap all segments and close the index. Views of traces must not be used afterwards."""
+        with self._lock:
+            for f, m in self._maps.values():
+                m.flush()
+                try:
+                    m.close()
+                except BufferError:
+                    pass    # a trace view is still alive; the mapping is released with it
+                f.close()
+            self._maps.clear()
+            self._db.close()
@@ -0,0 +1,177 @@
+"""
+Low-overhead instrumentation of the controller pipeline.
+
+`Metrics` holds latency histograms (fixed log-spaced buckets, so recording a value is one bisect and
+a few increments), counters, and gauges that are only evaluated when a snapshot is taken. Stage
+latencies recorded by the controller (in seconds):
+    receive         : AMQP delivery to routing (consumer batching and intake queue)
+    station_queue   : routing to dispatch to an interface, per station
+    inbox           : dispatch to the start of processing, per instrument
+    command         : processing time of a command, per instrument
+    visa_read/visa_write : blocking VISA calls, per instrument (bytes and ops are counted too)
+    publish         : response appended to the outbox to published
+    total           : command routed to its response published
+    loop_lag        : how late the event loop wakes up a sleeping task
+
+Snapshots are available as a dict (`snapshot`), in the Prometheus text format (`prometheus`), from a
+local HTTP endpoint (`serve`: /metrics and /metrics.json) and as a periodically rewritten JSON file
+(`write_snapshots`).
+"""
+from typing import Callable
+import asyncio
+import json
+import os
+import time
+from bisect import bisect_left
+from collections import defaultdict
+
+
+def _escape(value) -> str:
+    """Label value escaped as the Prometheus text format requires (backslash, double quote, newline)."""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Histogram:
+    """Distribution of durations (s) in log-spaced buckets, 4 per decade from 1 us to 1000 s."""
+    BOUNDS = tuple(10 ** (e / 4) for e in range(-24, 13))
+    __slots__ = ('counts', 'count', 'sum', 'max')
+
+    def __init__(self) -> None:
+        self.counts = [0] * (len(self.BOUNDS) + 1)     # last bucket: above the largest bound
+        self.count = 0
+        self.sum = 0.
+        self.max = 0.
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.BOUNDS, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding quantile `q` (never more than the largest value seen)."""
+        if not self.count:
+            return 0.
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank and n:
+                return min(self.BOUNDS[i], self.max) if i < len(self.BOUNDS) else self.max
+        return self.max
+
+    def snapshot(self) -> dict:
+        return {'count': self.count, 'mean': self.sum / self.count if self.count else 0., 'max': self.max,
+                'p50': self.quantile(.5), 'p90': self.quantile(.9), 'p99': self.quantile(.99)}
+
+
+class Metrics:
+    def __init__(self) -> None:
+        self.histograms = {}                # (name, label) -> Histogram
+        self.counters = defaultdict(int)    # (name, label) -> count
+        self.gauges = {}                    # name -> callable returning {label: value}
+        self.started = time.time()
+
+    def observe(self, name: str, value: float, label: str='') -> None:
+        """Record a duration (s) in the histogram `name` (for `label`, e.g. an instrument ID)."""
+        try:
+            hist = self.histograms[name, label]
+        except KeyError:
+            hist = self.histograms[name, label] = Histogram()
+        hist.observe(value)
+
+    def inc(self, name: str, n: int=1, label: str='') -> None:
+        self.counters[name, label] += n
+
+    def gauge(self, name: str, read: Callable[[], dict]) -> None:
+        """Register the gauge `name`; `read()` returns its current {label: value} when a snapshot is taken."""
+        self.gauges[name] = read
+
+    def snapshot(self) -> dict:
+        """{'time', 'uptime', 'histograms': {name: {label: stats}}, 'counters': {name: {label: n}}, 'gauges': ...}"""
+        histograms, counters = defaultdict(dict), defaultdict(dict)
+        for (name, label), hist in list(self.histograms.items()):
+            histograms[name][label] = hist.snapshot()
+        for (name, label), n in list(self.counters.items()):
+            counters[name][label] = n
+        now = time.time()
+        return {'time': now, 'uptime': now - self.started, 'histograms': dict(histograms),
+                'counters': dict(counters), 'gauges': {name: read() for name, read in self.gauges.items()}}
+
+    def prometheus(self, prefix: str='lab_') -> str:
+        """Current metrics in the Prometheus text exposition format."""
+        lines = []
+        def labels(label: str, **extra) -> str:
+            pairs = ([('id', label)] if label else []) + list(extra.items())
+            pairs = [f'{k}="{_escape(v)}"' for k, v in pairs]
+            return '{' + ','.join(pairs) + '}' if pairs else ''
+        by_name = defaultdict(list)
+        for (name, label), hist in list(self.histograms.items()):
+            by_name[name].append((label, hist))
+        for name, hists in sorted(by_name.items()):
+            metric = f"{prefix}{name}_seconds"
+            lines.append(f"# TYPE {metric} histogram")
+            for label, hist in hists:
+                seen = 0
+                for bound, n in zip(Histogram.BOUNDS, hist.counts):
+                    seen += n
+                    lines.append(f"{metric}_bucket{labels(label, le=f'{bound:.6g}')} {seen}")
+                lines.append(f"{metric}_bucket{labels(label, le='+Inf')} {hist.count}")
+                lines.append(f"{metric}_sum{labels(label)} {hist.sum}")
+                lines.append(f"{metric}_count{labels(label)} {hist.count}")
+        by_name = defaultdict(list)
+        for (name, label), n in list(self.counters.items()):
+            by_name[name].append((label, n))
+        for name, values in sorted(by_name.items()):
+            lines.append(f"# TYPE {prefix}{name}_total counter")
+            lines.extend(f"{prefix}{name}_total{labels(label)} {n}" for label, n in values)
+        for name, read in sorted(self.gauges.items()):
+            lines.append(f"# TYPE {prefix}{name} gauge")
+            lines.extend(f"{prefix}{name}{labels(label)} {value}" for label, value in read().items())
+        return '\n'.join(lines) + '\n'
+
+    async def watch_loop_lag(self, stopped: Callable[[], bool], interval: float=0.25) -> None:
+        """Record how late the event loop wakes up from `interval` s sleeps, until `stopped()`."""
+        loop = asyncio.get_running_loop()
+        while not stopped():
+            start = loop.time()
+            await asyncio.sleep(interval)
+            self.observe('loop_lag', max(0., loop.time() - start - interval))
+
+    async def write_snapshots(self, path: str, stopped: Callable[[], bool], interval: float=10.) -> None:
+        """Rewrite the JSON snapshot file `path` every `interval` s (atomically), until `stopped()`."""
+        loop = asyncio.get_running_loop()
+        while not stopped():
+            await asyncio.sleep(interval)
+            await loop.run_in_executor(None, self._write, path, json.dumps(self.snapshot()))
+
+    @staticmethod
+    def _write(path: str, data: str) -> None:
+        tmp = f"{path}.tmp"
+        with open(tmp, 'w') as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    async def serve(self, port: int, host: str='127.0.0.1') -> asyncio.AbstractServer:
+        """Serve GET /metrics (Prometheus text) and /metrics.json on `host`:`port`."""
+        async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+            try:
+                request = await reader.readline()
+                while (await reader.readline()).strip():
+                    pass  # skip the headers
+                parts = request.decode(errors='replace').split()
+                path = parts[1] if len(parts) > 1 else '/'
+                if path == '/metrics':
+                    status, ctype, body = '200 OK', 'text/plain; version=0.0.4', self.prometheus()
+                elif path == '/metrics.json':
+                    status, ctype, body = '200 OK', 'application/json', json.dumps(self.snapshot())
+                else:
+                    status, ctype, body = '404 Not Found', 'text/plain', 'not found\n'
+                data = body.encode()
+                writer.write(f"HTTP/1.0 {status}\r\nContent-Type: {ctype}\r\n"
+                             f"Content-Length: {len(data)}\r\n\r\n".encode() + data)
+                await writer.drain()
+            finally:
+                writer.close()
+        return await asyncio.start_server(handle, host, port)
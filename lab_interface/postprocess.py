@@ -0,0 +1,177 @@
+"""
+Post-processing of VNA traces.
+
+A pipeline is a sequence of (transform, args) steps, written as text like 'smooth:5,db' (steps
+separated by ',', arguments by ':'). Each step is applied to every trace; 'average' reduces the
+traces (e.g. repeated sweeps) to their mean. Transforms:
+    db              : 20 log10 |x| (linear magnitude -> dB)
+    linear          : 10^(x / 20) (dB -> linear magnitude)
+    smooth[:n]      : centered moving average over n points (default 5)
+    average         : point-by-point mean of all traces
+    time_domain     : magnitude of the inverse FFT (requires numpy)
+
+Transforms are vectorized with numpy when it is installed, and fall back to plain Python otherwise.
+`PostProcessor` runs pipelines on a process pool, so heavy analysis uses other cores instead of the
+controller's event loop.
+"""
+from typing import Optional
+import asyncio
+import inspect
+import itertools
+import math
+import warnings
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def _db(x):
+    if np is not None:
+        with np.errstate(divide='ignore'):
+            return 20 * np.log10(np.abs(x))
+    return array('d', (20 * math.log10(abs(v)) if v else -math.inf for v in x))
+
+
+def _linear(x):
+    if np is not None:
+        return 10 ** (np.asarray(x) / 20)
+    return array('d', (10 ** (v / 20) for v in x))
+
+
+def _smooth(x, n: int=5):
+    n = int(n)
+    if n < 1:
+        raise ValueError(f"smoothing window must be at least 1 point, not {n}")
+    half = n // 2
+    if np is not None:
+        x = np.asarray(x, dtype=float)
+        c = np.concatenate(([0.], np.cumsum(x)))
+        i = np.arange(len(x))
+        lo, hi = np.maximum(i - half, 0), np.minimum(i + half + 1, len(x))
+        return (c[hi] - c[lo]) / (hi - lo)
+    c = [0.] + list(itertools.accumulate(x))
+    out = array('d')
+    for i in range(len(x)):
+        lo, hi = max(i - half, 0), min(i + half + 1, len(x))
+        out.append((c[hi] - c[lo]) / (hi - lo))
+    return out
+
+
+def _time_domain(x):
+    if np is None:
+        raise ValueError("time_domain requires numpy")
+    return np.abs(np.fft.ifft(np.asarray(x)))
+
+
+def _average(traces: list) -> list:
+    if len({len(t) for t in traces}) > 1:
+        raise ValueError("cannot average traces of different lengths")
+    if np is not None:
+        return [np.mean([np.asarray(t, dtype=float) for t in traces], axis=0)]
+    return [array('d', (sum(v) / len(v) for v in zip(*traces)))]
+
+
+# transforms applied to each trace
+transforms = {'db': _db, 'linear': _linear, 'smooth': _smooth, 'time_domain': _time_domain}
+# transforms applied to the list of traces
+reductions = {'average': _average}
+
+
+def _parse_value(v: str):
+    try:
+        return int(v)
+    except ValueError:
+        return float(v)
+
+
+def parse_pipeline(spec) -> tuple:
+    """
+    Parse and validate a pipeline, given as text ('smooth:5,db') or as a sequence of (name, args)
+    steps. Raises ValueError if a transform is unknown or gets the wrong arguments."""
+    if isinstance(spec, str):
+        steps = []
+        for part in spec.split(','):
+            if part.strip():
+                name, *args = part.strip().split(':')
+                try:
+                    steps.append((name.lower(), tuple(_parse_value(a) for a in args)))
+                except ValueError:
+                    raise ValueError(f"invalid arguments in pipeline step {part!r}") from None
+    else:
+        steps = [(name.lower(), tuple(args)) for name, args in spec]
+    for name, args in steps:
+        fn = transforms.get(name) or reductions.get(name)
+        if fn is None:
+            raise ValueError(f"unknown transform {name!r}; valid transforms are {list(transforms) + list(reductions)}")
+        try:
+            inspect.signature(fn).bind(None, *args)
+        except TypeError:
+            raise ValueError(f"wrong number of arguments for transform {name!r}") from None
+    return tuple(steps)
+
+
+def format_pipeline(pipeline: tuple) -> str:
+    """Text form of a parsed pipeline (inverse of `parse_pipeline`)."""
+    return ','.join(':'.join([name, *map(str, args)]) for name, args in pipeline)
+
+
+def run_pipeline(pipeline: tuple, traces: list) -> list:
+    """Apply the parsed `pipeline` to `traces`; returns the resulting traces."""
+    for name, args in pipeline:
+        if name in reductions:
+            traces = reductions[name](traces, *args)
+        else:
+            fn = transforms[name]
+            traces = [fn(t, *args) for t in traces]
+    return traces
+
+
+def _portable(trace):
+    """Copy of `trace` that can be sent to another process (memoryviews cannot be pickled)."""
+    if isinstance(trace, memoryview):
+        if np is not None:
+            return np.array(trace)
+        out = array(trace.format)
+        out.frombytes(trace.cast('B'))
+        return out
+    return trace
+
+
+class PostProcessor:
+    """
+    Runs pipelines on a process pool of up to `max_workers` processes (started on first use).
+    Pipelines over fewer than `inline_points` points in total are run directly, as sending them to
+    another process would cost more than it saves."""
+    def __init__(self, max_workers: Optional[int]=None, inline_points: int=4096) -> None:
+        if np is None:
+            warnings.warn("numpy is not installed: post-processing falls back to plain Python and "
+                          "time_domain is unavailable", RuntimeWarning, stacklevel=2)
+        self.max_workers = max_workers
+        self.inline_points = inline_points
+        self.runs = 0
+        self.offloaded = 0
+        self._pool = None
+
+    def _executor(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self._pool
+
+    async def run(self, pipeline: tuple, traces: list) -> list:
+        """Apply the parsed `pipeline` to `traces` without blocking the event loop; returns the resulting traces."""
+        self.runs += 1
+        if sum(len(t) for t in traces) < self.inline_points:
+            return run_pipeline(pipeline, traces)
+        self.offloaded += 1
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor(), run_pipeline, pipeline,
+                                          [_portable(t) for t in traces])
+
+    def shutdown(self, wait: bool=False) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=wait, cancel_futures=True)
+            self._pool = None
@@ -0,0 +1,104 @@
+from typing import Optional
+import time
+from collections import OrderedDict
+from fnmatch import fnmatchcase
+
+
+_NOT_CACHEABLE = object()
+
+
+class QueryCache:
+    """
+    Size-bounded LRU cache of instrument query replies.
+
+    `ttls` maps query patterns (fnmatch-style, e.g. 'SENSE:FREQUENCY:*[?]') to how long a reply stays
+    valid, in seconds (None = until invalidated). Queries that match no pattern are never cached.
+    `invalidations` maps write patterns (e.g. 'VOLT *') to the query patterns a matching write makes
+    stale. Patterns and messages are compared case-insensitively. '*' and '?' are wildcards, so the
+    literal characters of SCPI commands are written '[*]' and '[?]' (e.g. '[*]IDN[?]').
+    """
+    def __init__(self, ttls: dict, invalidations: Optional[dict]=None, maxsize: int=128) -> None:
+        self.ttls = {pattern.upper(): ttl for pattern, ttl in ttls.items()}
+        self.invalidations = {pattern.upper(): tuple(q.upper() for q in queries)
+                              for pattern, queries in (invalidations or {}).items()}
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()   # query -> (reply, expiry time or None)
+        self._ttl_of = {}               # query -> resolved ttl (memoized pattern lookup)
+
+    @staticmethod
+    def normalize(msg: str) -> str:
+        return ' '.join(msg.split()).upper()
+
+    def _ttl(self, query: str):
+        try:
+            return self._ttl_of[query]
+        except KeyError:
+            pass
+        ttl = _NOT_CACHEABLE
+        for pattern, value in self.ttls.items():
+            if fnmatchcase(query, pattern):
+                ttl = value
+                break
+        if len(self._ttl_of) < 4 * self.maxsize:
+            self._ttl_of[query] = ttl
+        return ttl
+
+    def cacheable(self, query: str) -> bool:
+        return self._ttl(self.normalize(query)) is not _NOT_CACHEABLE
+
+    def peek(self, query: str) -> Optional[bytes]:
+        """Return the cached reply to `query` if still valid, without counting a hit or miss."""
+        query = self.normalize(query)
+        try:
+            reply, expiry = self._entries[query]
+        except KeyError:
+            return None
+        if (expiry is not None) and (time.monotonic() >= expiry):
+            del self._entries[query]
+            return None
+        return reply
+
+    def get(self, query: str) -> Optional[bytes]:
+        """Return the cached reply to `query` (None on a miss), counting hits and misses."""
+        if not self.cacheable(query):
+            return None
+        reply = self.peek(query)
+        if reply is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self._entries.move_to_end(self.normalize(query))
+        return reply
+
+    def put(self, query: str, reply: bytes) -> None:
+        """Store the reply to `query` if the query is cacheable, evicting the least recently used."""
+        query = self.normalize(query)
+        ttl = self._ttl(query)
+        if ttl is _NOT_CACHEABLE:
+            return
+        self._entries[query] = (reply, None if ttl is None else time.monotonic() + ttl)
+        self._entries.move_to_end(query)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate_for(self, write: str) -> None:
+        """Drop the cached replies made stale by the (possibly ';'-compound) write `write`."""
+        for part in self.normalize(write).split(';'):
+            part = part.strip().lstrip(':')
+            if not part or part.endswith('?'):
+                continue
+            for pattern, queries in self.invalidations.items():
+                if fnmatchcase(part, pattern):
+                    for query in [q for q in self._entries if any(fnmatchcase(q, p) for p in queries)]:
+                        del self._entries[query]
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        return {'size': len(self._entries), 'maxsize': self.maxsize, 'hits': self.hits,
+                'misses': self.misses, 'evictions': self.evictions}
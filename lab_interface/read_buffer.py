@@ -0,0 +1,140 @@
+from typing import Optional
+
+
+class BlockFormatError(ValueError):
+    """Raised when the buffer does not hold a valid IEEE-488.2 block header."""
+
+
+class ReadBuffer:
+    """
+    Byte buffer that accumulates chunks read from an instrument and hands back complete replies.
+
+    Bytes left over after a reply (e.g. the start of the next reply) are kept for the next call.
+    All `take_*` methods return None when the buffer does not yet hold a complete reply, in which
+    case the caller should `feed` more bytes and try again.
+    """
+    def __init__(self) -> None:
+        self._buf = bytearray()
+        self._scanned = 0   # bytes already searched for the terminator, so we don't rescan them
+        self._skip = b''    # terminator still expected after a definite-length block
+
+    def __len__(self) -> int:
+        return len(self._buf)
+
+    def feed(self, data: bytes) -> None:
+        """Append freshly read bytes to the buffer."""
+        self._buf += data
+        self._drop_skip()
+
+    def _drop_skip(self) -> None:
+        while self._skip and self._buf:
+            if self._buf[0] == self._skip[0]:
+                del self._buf[0]
+                self._skip = self._skip[1:]
+            else:
+                self._skip = b''
+
+    def clear(self) -> bytes:
+        """Discard (and return) everything currently buffered."""
+        data = bytes(self._buf)
+        del self._buf[:]
+        self._scanned = 0
+        self._skip = b''
+        return data
+
+    def _take(self, n: int) -> bytes:
+        data = bytes(self._buf[:n])
+        del self._buf[:n]
+        self._scanned = 0
+        return data
+
+    def take_until(self, term: bytes) -> Optional[bytes]:
+        """Return everything up to and including `term`, or None if `term` not yet buffered."""
+        start = max(0, self._scanned - len(term) + 1)
+        idx = self._buf.find(term, start)
+        if idx < 0:
+            self._scanned = len(self._buf)
+            return None
+        return self._take(idx + len(term))
+
+    def take_fields(self, sep: bytes, term: bytes) -> Optional[tuple]:
+        """
+        Consume a `sep`-separated reply terminated by `term` while it is still arriving. Returns
+        (fields, last): `fields` holds every complete field buffered so far (with their separators,
+        without `term`), and `last` is True once the terminator has been reached. Returns None if
+        no complete field is buffered yet.
+        """
+        data = self.take_until(term)
+        if data is not None:
+            return data[:-len(term)], True
+        idx = self._buf.rfind(sep)
+        if idx < 0:
+            return None
+        return self._take(idx + len(sep)), False
+
+    def take_exactly(self, n: int) -> Optional[bytes]:
+        """Return exactly `n` bytes, or None if fewer than `n` bytes are buffered."""
+        if len(self._buf) < n:
+            return None
+        return self._take(n)
+
+    def block_header(self) -> Optional[tuple]:
+        """
+        Parse an IEEE-488.2 block header at the head of the buffer.
+
+        Returns (header_length, data_length) where data_length is None for an indefinite-length
+        (#0) block, or None if the header is not yet completely buffered.
+        """
+        start = self._buf.find(b'#')
+        end = start if start >= 0 else len(self._buf)
+        # only whitespace/separators (e.g. ',' or '\n') may precede the block
+        if self._buf[:end].strip(b' \t\r\n,;'):
+            raise BlockFormatError(f"Unexpected bytes before block header: {bytes(self._buf[:end])!r}")
+        if start < 0:
+            return None
+        if start > 0:
+            del self._buf[:start]
+            self._scanned = 0
+        if len(self._buf) < 2:
+            return None
+        ndigits = self._buf[1] - 0x30   # ASCII digit
+        if not 0 <= ndigits <= 9:
+            raise BlockFormatError(f"Invalid block header: {bytes(self._buf[:2])!r}")
+        if ndigits == 0:
+            return 2, None
+        if len(self._buf) < 2 + ndigits:
+            return None
+        length = bytes(self._buf[2:2 + ndigits])
+        if not length.isdigit():
+            raise BlockFormatError(f"Invalid block length: {length!r}")
+        return 2 + ndigits, int(length)
+
+    def take_binblock(self, term: Optional[bytes]=None) -> Optional[bytes]:
+        """
+        Return the payload of an IEEE-488.2 definite-length block (#<n><length><data>), or of an
+        indefinite-length block (#0<data><term>) if `term` is given. A trailing `term` after a
+        definite-length block is consumed as well, when present.
+        """
+        header = self.block_header()
+        if header is None:
+            return None
+        hlen, dlen = header
+        if dlen is None:
+            if term is None:
+                raise BlockFormatError("Indefinite-length block requires a termination sequence")
+            idx = self._buf.find(term, hlen)
+            if idx < 0:
+                return None
+            data = bytes(self._buf[hlen:idx])
+            del self._buf[:idx + len(term)]
+            self._scanned = 0
+            return data
+        if len(self._buf) < hlen + dlen:
+            return None
+        data = bytes(self._buf[hlen:hlen + dlen])
+        del self._buf[:hlen + dlen]
+        self._scanned = 0
+        if term:
+            self._skip = term
+            self._drop_skip()
+        return data
@@ -0,0 +1,119 @@
+from typing import Optional, Any, NamedTuple
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+
+from async_deque import AsyncDeque
+
+
+# priority classes; lower values are served first
+HIGH, NORMAL, LOW = 0, 1, 2
+PRIORITIES = {'high': HIGH, 'normal': NORMAL, 'low': LOW}
+PRIORITY_NAMES = {value: name for name, value in PRIORITIES.items()}
+
+
+def parse_priority(value: Any) -> int:
+    """Priority class of a 'high'/'normal'/'low' name or 0/1/2 value (None = normal)."""
+    if value is None:
+        return NORMAL
+    if isinstance(value, bytes):
+        value = value.decode()
+    if isinstance(value, str):
+        try:
+            return PRIORITIES[value.strip().lower()]
+        except KeyError:
+            value = value.strip()
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid priority {value!r}; valid priorities are {list(PRIORITIES)}")
+    if value not in PRIORITY_NAMES:
+        raise ValueError(f"Invalid priority {value!r}; valid priorities are {list(PRIORITIES)}")
+    return value
+
+
+@dataclass
+class RequestContext:
+    """Metadata of the client request a piece of work belongs to."""
+    correlation_id: Optional[str]=None    # echoed back on every response to the request
+    accept: Optional[str]=None            # wire format the client wants its responses in
+    reply_to: Optional[str]=None          # client's reply queue (None = broadcast responses on e_responses)
+    priority: int=NORMAL                  # priority class (HIGH, NORMAL or LOW)
+    deadline: Optional[float]=None        # time.monotonic() after which the request is dropped
+    received: float=field(default_factory=time.monotonic)   # when the controller received it
+    barrier: bool=False                   # runs alone: after all earlier commands of its station, before all later ones
+    after: tuple=()                       # correlation IDs of the commands that must finish first
+    dispatched: Optional[float]=None      # when the controller handed it to an interface (cleared once it starts)
+
+    @classmethod
+    def from_properties(cls, props: dict) -> 'RequestContext':
+        """
+        Context of an incoming message with properties `props` (see `aio_queues.envelope`). The
+        `timeout` property is in seconds from receipt, so it does not depend on the client's clock."""
+        request = cls(correlation_id=props.get('correlation_id'), accept=props.get('accept'),
+                      reply_to=props.get('reply_to'), priority=parse_priority(props.get('priority')))
+        timeout = props.get('timeout')
+        if timeout is not None:
+            request.deadline = request.received + float(timeout)
+        request.barrier = bool(props.get('barrier'))
+        after = props.get('after') or ()
+        if isinstance(after, (str, bytes)):
+            after = after.decode() if isinstance(after, bytes) else after
+            after = [cid for cid in after.split(',') if cid]
+        request.after = tuple(cid.decode() if isinstance(cid, bytes) else str(cid) for cid in after)
+        return request
+
+    def expired(self, now: Optional[float]=None) -> bool:
+        """True if the request has a deadline and it has passed."""
+        if self.deadline is None:
+            return False
+        return (time.monotonic() if now is None else now) > self.deadline
+
+
+def priority_of(request: Optional[RequestContext]) -> int:
+    """Priority class of `request` (normal if there is no request)."""
+    return NORMAL if request is None else request.priority
+
+
+# The request currently being handled. Set by the controller while it routes a command and by the
+# interface while it processes one; asyncio tasks inherit it from the code that created them.
+current_request: ContextVar[Optional[RequestContext]] = ContextVar('current_request', default=None)
+
+
+class StreamInfo(NamedTuple):
+    """Position of a response in a stream of chunks (e.g. a long trace sent while it is being read)."""
+    name: str                             # what is being streamed, e.g. '1234 / trace S11'
+    seq: int                              # chunk number, from 0
+    final: bool                           # True on the last chunk of the stream
+
+
+class Response(NamedTuple):
+    request: Optional[RequestContext]
+    body: Any
+    error: bool=False
+    retry_after: Optional[float]=None     # set on "busy" errors: seconds before the client should retry
+    stream: Optional[StreamInfo]=None     # set on the chunks of a streamed response
+    created: Optional[float]=None         # time.monotonic() when it was appended to the outbox
+
+
+class Outbox(AsyncDeque):
+    """
+    Outbox of responses. Each appended message is wrapped in a `Response` tagged with the request
+    that is current at the time it is appended, so the publisher can route and correlate it.
+    """
+    def append(self, msg: Any, error: bool=False) -> None:
+        if not isinstance(msg, Response):
+            msg = Response(current_request.get(), msg, error, created=time.monotonic())
+        super().append(msg)
+
+    def append_error(self, msg: Any) -> None:
+        """Append an error response to the current request."""
+        self.append(msg, error=True)
+
+    def append_chunk(self, msg: Any, name: str, seq: int, final: bool) -> None:
+        """Append chunk number `seq` of the stream `name` for the current request."""
+        self.append(Response(current_request.get(), msg, stream=StreamInfo(name, seq, final), created=time.monotonic()))
+
+    def append_busy(self, msg: Any, retry_after: float) -> None:
+        """Append a "busy" error response to the current request, asking to retry in `retry_after` s."""
+        self.append(Response(current_request.get(), msg, True, retry_after, created=time.monotonic()))
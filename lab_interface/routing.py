@@ -0,0 +1,88 @@
+"""
+Topic routing of commands to the controllers.
+
+Commands are published to the topic exchange `e_commands` with the routing key
+`<controller>.<station>.<instrument ID>`; parts the sender does not know are '_' (e.g. '_._.1234').
+Each controller binds its own command queue only to the keys it owns:
+    *.*.<iid>               for every instrument it has connected
+    *.*.<controller ID>     for commands to the controller itself
+so it never receives (or decodes) commands for other controllers' instruments, and controllers can
+be added without adding work to the others. Commands that match no binding go to the alternate
+exchange `e_unrouted`, whose queue `q_unrouted` all controllers consume from in turn, so exactly one
+of them replies with an error.
+
+IDs used in routing keys must not contain '.', '*' or '#'.
+"""
+from typing import Optional, Iterable
+
+import aio_pika
+
+
+COMMAND_EXCHANGE = 'e_commands'
+UNROUTED_EXCHANGE = 'e_unrouted'
+UNROUTED_QUEUE = 'q_unrouted'
+ANY = '_'
+
+
+def routing_key(iid: str, station: Optional[str]=None, controller: Optional[str]=None) -> str:
+    """Routing key of a command for `iid` (`station` and `controller` if known)."""
+    return f"{controller or ANY}.{station or ANY}.{iid}"
+
+
+def binding_key(iid: str) -> str:
+    """Binding that delivers every command for `iid`, whatever else the sender knew."""
+    return f"*.*.{iid}"
+
+
+def matches(pattern: str, key: str) -> bool:
+    """True if the routing `key` matches the binding `pattern` ('*' = one word, '#' = zero or more words)."""
+    return _match(tuple(pattern.split('.')), tuple(key.split('.')))
+
+
+def _match(words: tuple, parts: tuple) -> bool:
+    if not words:
+        return not parts
+    word = words[0]
+    if word == '#':
+        return any(_match(words[1:], parts[i:]) for i in range(len(parts) + 1))
+    return bool(parts) and (word == '*' or word == parts[0]) and _match(words[1:], parts[1:])
+
+
+async def declare_command_exchange(channel: aio_pika.abc.AbstractChannel,
+                                   name: str=COMMAND_EXCHANGE) -> aio_pika.abc.AbstractExchange:
+    """Declare the command exchange (and its alternate exchange for unroutable commands)."""
+    await channel.declare_exchange(UNROUTED_EXCHANGE, aio_pika.ExchangeType.FANOUT)
+    return await channel.declare_exchange(name, aio_pika.ExchangeType.TOPIC,
+                                          arguments={'alternate-exchange': UNROUTED_EXCHANGE})
+
+
+async def declare_unrouted_queue(channel: aio_pika.abc.AbstractChannel) -> aio_pika.abc.AbstractQueue:
+    """Declare the queue of unroutable commands, shared by all controllers."""
+    exchange = await channel.declare_exchange(UNROUTED_EXCHANGE, aio_pika.ExchangeType.FANOUT)
+    queue = await channel.declare_queue(UNROUTED_QUEUE)
+    await queue.bind(exchange, '')
+    return queue
+
+
+class CommandBindings:
+    """
+    The routing keys a controller's command queue is bound to. Keys can be added at any time; those
+    added before the queue is declared are bound when it is attached.
+    """
+    def __init__(self, keys: Iterable[str]=()) -> None:
+        self.keys = set(keys)
+        self._queue = None
+        self._exchange = None
+
+    async def attach(self, queue: aio_pika.abc.AbstractQueue, exchange: aio_pika.abc.AbstractExchange) -> None:
+        """Bind `queue` to `exchange` with every key so far, and with the keys added from now on."""
+        self._queue, self._exchange = queue, exchange
+        for key in sorted(self.keys):
+            await queue.bind(exchange, key)
+
+    async def add(self, key: str) -> None:
+        if key in self.keys:
+            return
+        self.keys.add(key)
+        if self._queue is not None:
+            await self._queue.bind(self._exchange, key)
@@ -0,0 +1,167 @@
+from typing import Optional, Iterator
+import itertools
+from collections import Counter, defaultdict
+
+from async_deque import LaneQueue
+from request_context import priority_of, HIGH, NORMAL
+
+
+MODES = ('serial', 'parallel')
+
+
+class StationQueue:
+    """
+    Commands queued for the instruments of one station, as (iid, (cmd, callback, args, kwargs,
+    request)) entries. Each instrument has its own queue (one FIFO lane per priority class), so its
+    commands always run in the order they arrived.
+
+    In 'parallel' mode the instruments of the station run concurrently, one command each at a time.
+    In 'serial' mode only one command runs in the whole station at a time, in arrival order.
+    Ordering across instruments is expressed on the requests:
+        barrier : the command waits until every earlier command of the station has finished, and
+                  every later command waits until it has finished
+        after   : the command waits until the commands with these correlation IDs are no longer
+                  queued or running (in any station sharing `outstanding`)
+    High-priority commands skip barriers so the station can always be stopped.
+
+    `capacity` is a soft limit on the number of queued commands (see `async_deque.Bounded`).
+    """
+    def __init__(self, mode: str='parallel', capacity: Optional[int]=None,
+                 outstanding: Optional[Counter]=None) -> None:
+        if mode not in MODES:
+            raise ValueError(f"Invalid station mode {mode!r}; valid modes are {list(MODES)}")
+        self.mode = mode
+        self.capacity = capacity
+        self.outstanding = Counter() if (outstanding is None) else outstanding  # correlation ID -> queued/running commands
+        self.queues = defaultdict(lambda: LaneQueue(key=lambda item: priority_of(item[2][4])))  # iid -> (seq, iid, entry)
+        self.busy = set()               # instruments running a command
+        self.running = {}               # iid -> (seq, request) of its running command
+        self._barriers = []             # seqs of the queued or running barriers, in order
+        self._seq = itertools.count()
+        self._len = 0
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __bool__(self) -> bool:
+        return self._len > 0
+
+    def __iter__(self) -> Iterator:
+        for queue in self.queues.values():
+            for _, iid, entry in queue:
+                yield iid, entry
+
+    def full(self, n: int=1) -> bool:
+        return (self.capacity is not None) and (self._len + n > self.capacity)
+
+    def depths(self) -> list:
+        """Number of queued commands in each priority class."""
+        depths = [0, 0, 0]
+        for queue in self.queues.values():
+            depths = [a + b for a, b in zip(depths, queue.depths())]
+        return depths
+
+    def queued(self, iid: str) -> int:
+        """Number of commands queued for instrument `iid`."""
+        queue = self.queues.get(iid)
+        return len(queue) if queue else 0
+
+    def append(self, item: tuple) -> None:
+        iid, entry = item
+        seq = next(self._seq)
+        request = entry[4]
+        if (request is not None) and request.barrier:
+            self._barriers.append(seq)
+        if (request is not None) and request.correlation_id:
+            self.outstanding[request.correlation_id] += 1
+        self.queues[iid].append((seq, iid, entry))
+        self._len += 1
+
+    def unordered(self, request) -> bool:
+        """
+        True if a command of `request` may run outside the queue (e.g. be answered from a cache)
+        without breaking its ordering: it is neither a barrier nor has `after` dependencies, and no
+        barrier is pending in the station."""
+        if self._barriers:
+            return False
+        return (request is None) or not (request.barrier or request.after)
+
+    def runnable(self) -> bool:
+        """True if some queued command might be able to start now."""
+        if not self._len:
+            return False
+        if self.mode == 'serial':
+            return not self.busy
+        return any(queue and (iid not in self.busy) for iid, queue in self.queues.items())
+
+    def head_priority(self) -> int:
+        """Priority class of the most urgent queued command."""
+        heads = [priority_of(queue.peek()[2][4]) for queue in self.queues.values() if queue]
+        return min(heads) if heads else NORMAL
+
+    def _blocked(self, seq: int, request, oldest: int) -> bool:
+        high = (request is not None) and (request.priority == HIGH)
+        if not high:
+            barrier = self._barriers[0] if self._barriers else None
+            if (barrier is not None) and (seq > barrier):
+                return True
+        if request is None:
+            return False
+        if (not high) and request.barrier and (self.busy or (seq != oldest)):
+            return True
+        return any(self.outstanding[cid] for cid in request.after)
+
+    def pop_ready(self, now: Optional[float]=None) -> tuple:
+        """
+        Take the commands that can start now, marking their instruments busy. Returns (started,
+        expired), lists of (iid, entry); expired commands (past their request deadline) are removed
+        without starting.
+        """
+        started, expired = [], []
+        if (self.mode == 'serial') and self.busy:
+            return started, expired
+        while True:
+            heads = [(priority_of(queue.peek()[2][4]), queue.peek()[0], iid)
+                     for iid, queue in self.queues.items() if queue and (iid not in self.busy)]
+            if not heads:
+                return started, expired
+            heads.sort()
+            oldest = min(queue.peek()[0] for queue in self.queues.values() if queue)
+            for _, seq, iid in heads:
+                request = self.queues[iid].peek()[2][4]
+                if (request is not None) and request.expired(now):
+                    _, _, entry = self.queues[iid].popleft()
+                    self._len -= 1
+                    self._finish(seq, request)
+                    expired.append((iid, entry))
+                    break
+                if self._blocked(seq, request, oldest):
+                    continue
+                _, _, entry = self.queues[iid].popleft()
+                self._len -= 1
+                self.busy.add(iid)
+                self.running[iid] = (seq, request)
+                started.append((iid, entry))
+                if self.mode == 'serial':
+                    return started, expired
+                break
+            else:
+                return started, expired
+
+    def done(self, iid: str) -> None:
+        """Called when instrument `iid` has finished its running command."""
+        self.busy.discard(iid)
+        seq, request = self.running.pop(iid, (None, None))
+        if seq is not None:
+            self._finish(seq, request)
+
+    def _finish(self, seq: int, request) -> None:
+        if request is None:
+            return
+        if request.barrier and (seq in self._barriers):
+            self._barriers.remove(seq)
+        cid = request.correlation_id
+        if cid:
+            self.outstanding[cid] -= 1
+            if self.outstanding[cid] <= 0:
+                del self.outstanding[cid]
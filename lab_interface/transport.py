@@ -0,0 +1,499 @@
+"""
+Transports carrying commands to the controllers and responses back to the clients.
+
+Every transport offers the same operations, so `aio_queues.bind_receive_queue`/`bind_send_queue`
+(controller side) and `user_terminal.LabClient`/`bind_reply_queue` (client side) work over any of
+them:
+    consume(callback, queue_name, ...)      deliver the commands of a controller to `callback`
+    response_exchanges(exchange_name, ...)  (broadcast, reply) endpoints to publish responses to
+    command_exchange(exchange_name)         endpoint clients publish commands to
+    reply_queue(callback, ...)              deliver a client's responses to `callback`
+Endpoints have the `publish(message, routing_key)` method of `aio_pika` exchanges, and delivered
+messages the attributes (`body`, `headers`, `content_type`, `correlation_id`, `reply_to`) and the
+`ack`/`process` methods of `aio_pika` incoming messages. Implementations:
+    AMQPTransport        RabbitMQ, through an `amqp_pool.ConnectionPool` (see `routing` for the topology)
+    LocalTransport       controllers and clients in the same process; messages are passed by
+                         reference, and with the 'object' codec they are not encoded at all
+    UnixSocketTransport  controller and clients on the same host, over a Unix socket
+`from_uri` picks one from a URI: 'amqp://...', 'local://<name>' or 'unix:///path/to/socket'.
+"""
+from typing import Optional, Callable, Awaitable, Any
+import asyncio
+import itertools
+import json
+import os
+import struct
+
+import aio_pika
+
+from amqp_pool import ConnectionPool, get_pool
+import codec
+import routing
+
+
+def make_message(body: Any, **properties) -> Any:
+    """
+    Outgoing message: an `aio_pika.Message` for encoded (bytes) bodies, or a `LocalMessage` for
+    objects passed by reference (see `codec.ObjectCodec`)."""
+    if isinstance(body, (bytes, bytearray)):
+        return aio_pika.Message(body=bytes(body), **properties)
+    return LocalMessage(body, **properties)
+
+
+class LocalMessage:
+    """A message that does not go through a broker, with the `aio_pika` message attributes consumers use."""
+    __slots__ = ('body', 'content_type', 'headers', 'correlation_id', 'reply_to', '_window', '_tag')
+
+    def __init__(self, body: Any, content_type: Optional[str]=None, headers: Optional[dict]=None,
+                 correlation_id: Optional[str]=None, reply_to: Optional[str]=None) -> None:
+        self.body = body
+        self.content_type = content_type
+        self.headers = headers or {}
+        self.correlation_id = correlation_id
+        self.reply_to = reply_to
+        self._window = None
+        self._tag = None
+
+    @classmethod
+    def delivery(cls, message: Any, window: '_Window', tag: int) -> 'LocalMessage':
+        """Copy of `message` delivered to a consumer, acknowledged through its prefetch `window`."""
+        m = cls(message.body, message.content_type, message.headers, message.correlation_id, message.reply_to)
+        m._window, m._tag = window, tag
+        return m
+
+    async def ack(self, multiple: bool=False) -> None:
+        if self._window is not None:
+            self._window.ack(self._tag, multiple)
+
+    def process(self) -> 'LocalMessage':
+        return self
+
+    async def __aenter__(self) -> 'LocalMessage':
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        await self.ack()
+
+
+class _Window:
+    """Prefetch window of a consumer: at most `size` unacknowledged deliveries at once (0 = unlimited)."""
+    def __init__(self, size: int=0) -> None:
+        self.size = size
+        self._tags = itertools.count(1)
+        self._unacked = {}          # delivery tag -> None, in delivery order
+        self._room = None           # asyncio.Event, set when a delivery is acknowledged
+
+    async def acquire(self) -> int:
+        """Wait for room in the window; returns the delivery tag of the next delivery."""
+        while self.size and len(self._unacked) >= self.size:
+            if self._room is None:
+                self._room = asyncio.Event()
+            self._room.clear()
+            await self._room.wait()
+        tag = next(self._tags)
+        self._unacked[tag] = None
+        return tag
+
+    def ack(self, tag: int, multiple: bool=False) -> None:
+        if multiple:
+            for t in [t for t in self._unacked if t <= tag]:
+                del self._unacked[t]
+        else:
+            self._unacked.pop(tag, None)
+        if self._room is not None:
+            self._room.set()
+
+
+class _LocalQueue:
+    """
+    Messages waiting for the consumers of a queue, handed to them in turn within their prefetch
+    windows. With a `maxsize`, `put` waits while the queue is full."""
+    def __init__(self, maxsize: int=0) -> None:
+        self.maxsize = maxsize
+        self._items = None          # asyncio.Queue, created once there is a running loop
+        self._consumers = []        # [(callback, window)]
+        self._next = 0
+        self._task = None
+
+    def _queue(self) -> asyncio.Queue:
+        if self._items is None:
+            self._items = asyncio.Queue(self.maxsize)
+        return self._items
+
+    async def put(self, message: Any) -> None:
+        await self._queue().put(message)
+
+    def consume(self, callback: Callable[[LocalMessage], Awaitable[None]], window: _Window) -> tuple:
+        consumer = (callback, window)
+        self._consumers.append(consumer)
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._deliver_forever())
+        return consumer
+
+    def cancel(self, consumer: tuple) -> None:
+        if consumer in self._consumers:
+            self._consumers.remove(consumer)
+        if not self._consumers and (self._task is not None):
+            self._task.cancel()
+            self._task = None
+
+    async def close(self) -> None:
+        """Drop all consumers and wait for the delivery task to end."""
+        self._consumers.clear()
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    async def _deliver_forever(self) -> None:
+        items = self._queue()
+        while True:
+            message = await items.get()
+            self._next = (self._next + 1) % len(self._consumers)
+            callback, window = self._consumers[self._next]
+            tag = await window.acquire()
+            await callback(LocalMessage.delivery(message, window, tag))
+
+
+class _Endpoint:
+    """Publishing side of a transport, with the `publish` method of an `aio_pika` exchange."""
+    def __init__(self, publish: Callable[[Any, str], Awaitable[None]]) -> None:
+        self._publish = publish
+
+    async def publish(self, message: Any, routing_key: str='', **kwargs) -> None:
+        await self._publish(message, routing_key)
+
+
+class _Consumer:
+    """Consumers started by a transport's `consume`; `cancel` stops them."""
+    def __init__(self, cancel: Callable[[], Awaitable[None]]) -> None:
+        self._cancel = cancel
+
+    async def cancel(self) -> None:
+        await self._cancel()
+
+
+class AMQPTransport:
+    """RabbitMQ, with the channels taken from `pool`."""
+    by_reference = False
+
+    def __init__(self, pool: ConnectionPool) -> None:
+        self.pool = pool
+
+    async def consume(self, callback: Callable[..., Awaitable[None]], queue_name: str, prefetch_count: int=256,
+                      bindings: Optional[routing.CommandBindings]=None,
+                      exchange_name: str=routing.COMMAND_EXCHANGE) -> _Consumer:
+        """
+        Consume the commands routed to `queue_name` (bound with the keys of `bindings`) and the
+        unroutable commands, with up to `prefetch_count` unacknowledged messages in flight."""
+        # dedicated channel: acks with multiple=True must not cover other consumers' deliveries
+        channel = await self.pool.channel(f"consume:{queue_name}", prefetch_count=prefetch_count)
+        exchange = await routing.declare_command_exchange(channel, exchange_name)
+        queue = await channel.declare_queue(queue_name, auto_delete=True)
+        await (bindings or routing.CommandBindings(['#'])).attach(queue, exchange)
+        unrouted = await routing.declare_unrouted_queue(channel)
+        # both queues share the channel (and so its delivery tags), so one callback can ack for both
+        consumers = [(queue, await queue.consume(callback)), (unrouted, await unrouted.consume(callback))]
+
+        async def cancel() -> None:
+            for queue, consumer_tag in consumers:
+                await queue.cancel(consumer_tag)
+        return _Consumer(cancel)
+
+    async def response_exchanges(self, exchange_name: str='e_responses', confirms: bool=False) -> tuple:
+        """(fanout exchange `exchange_name`, default exchange routing to reply queues by name)."""
+        channel = await self.pool.channel("publish:confirm" if confirms else "publish", publisher_confirms=confirms)
+        exchange = await channel.declare_exchange(exchange_name, aio_pika.ExchangeType.FANOUT)
+        return exchange, channel.default_exchange
+
+    async def command_exchange(self, exchange_name: str=routing.COMMAND_EXCHANGE) -> aio_pika.abc.AbstractExchange:
+        channel = await self.pool.channel("publish")
+        return await routing.declare_command_exchange(channel, exchange_name)
+
+    async def reply_queue(self, callback: Callable[..., Awaitable[None]], exchange_name: str="e_responses",
+                          monitor: bool=False, prefetch_count: int=64) -> Optional[str]:
+        """
+        Consume from an exclusive, auto-named queue (deleted when the client disconnects); returns
+        its name, for the `reply_to` of commands. In `monitor` mode the queue is bound to the
+        `exchange_name` fanout exchange instead, so it receives a copy of every response (and None
+        is returned: the client's own commands are answered there too)."""
+        channel = await self.pool.channel("consume:replies", prefetch_count=prefetch_count)
+        queue = await channel.declare_queue(exclusive=True)
+        if monitor:
+            exchange = await channel.declare_exchange(exchange_name, aio_pika.ExchangeType.FANOUT)
+            await queue.bind(exchange, '')
+        await queue.consume(callback)
+        return None if monitor else queue.name
+
+    async def close(self) -> None:
+        await self.pool.close()
+
+
+class LocalTransport:
+    """
+    Transport between controllers and clients in the same process. Commands are routed to the
+    controller whose bindings match their routing key (unmatched ones to the controllers in turn),
+    responses to the reply queue of their client (and to monitoring clients), all without a broker.
+    Messages are passed by reference; with the 'object' codec they are not encoded either."""
+    by_reference = True
+
+    def __init__(self) -> None:
+        self._commands = {}         # queue name -> (_LocalQueue, CommandBindings)
+        self._unrouted = _LocalQueue()
+        self._replies = {}          # reply queue name -> _LocalQueue
+        self._monitors = set()      # names of the reply queues receiving every response
+        self._names = itertools.count()
+
+    async def consume(self, callback: Callable[..., Awaitable[None]], queue_name: str, prefetch_count: int=256,
+                      bindings: Optional[routing.CommandBindings]=None, exchange_name: Optional[str]=None) -> _Consumer:
+        window = _Window(prefetch_count)
+        try:
+            queue = self._commands[queue_name][0]
+        except KeyError:
+            queue = _LocalQueue()
+        self._commands[queue_name] = (queue, bindings or routing.CommandBindings(['#']))
+        consumers = [(queue, queue.consume(callback, window)), (self._unrouted, self._unrouted.consume(callback, window))]
+
+        async def cancel() -> None:
+            for queue, consumer in consumers:
+                queue.cancel(consumer)
+        return _Consumer(cancel)
+
+    async def _publish_command(self, message: Any, routing_key: str) -> None:
+        routed = False
+        for queue, bindings in self._commands.values():
+            if any(routing.matches(key, routing_key) for key in bindings.keys):
+                await queue.put(message)
+                routed = True
+        if not routed:
+            await self._unrouted.put(message)
+
+    async def _publish_reply(self, message: Any, routing_key: str) -> None:
+        queue = self._replies.get(routing_key)
+        if queue is not None:
+            await queue.put(message)
+
+    async def _publish_broadcast(self, message: Any, routing_key: str='') -> None:
+        for name in self._monitors:
+            await self._replies[name].put(message)
+
+    async def response_exchanges(self, exchange_name: Optional[str]=None, confirms: bool=False) -> tuple:
+        return _Endpoint(self._publish_broadcast), _Endpoint(self._publish_reply)
+
+    async def command_exchange(self, exchange_name: Optional[str]=None) -> _Endpoint:
+        return _Endpoint(self._publish_command)
+
+    async def reply_queue(self, callback: Callable[..., Awaitable[None]], exchange_name: Optional[str]=None,
+                          monitor: bool=False, prefetch_count: int=64) -> Optional[str]:
+        name = f"local-reply-{next(self._names)}"
+        queue = self._replies[name] = _LocalQueue()
+        queue.consume(callback, _Window(prefetch_count))
+        if monitor:
+            self._monitors.add(name)
+            return None
+        return name
+
+    async def close(self) -> None:
+        for queue in [q for q, _ in self._commands.values()] + [self._unrouted] + list(self._replies.values()):
+            await queue.close()
+
+
+_FRAME = struct.Struct('>II')  # lengths of the JSON header and of the body
+
+
+def _frame(kind: str, message: Any=None, routing_key: str='', **extra) -> bytes:
+    """
+    Frame of a message on a Unix socket: <header length> <body length> <JSON header> <body>, the
+    header holding the frame `kind` and the message properties."""
+    header = {'kind': kind, **extra}
+    body = b''
+    if message is not None:
+        body = message.body
+        if not isinstance(body, (bytes, bytearray)):
+            raise codec.CodecError(f"{message.content_type} messages cannot be sent over a socket")
+        header.update(routing_key=routing_key, content_type=message.content_type, headers=message.headers,
+                      correlation_id=message.correlation_id, reply_to=message.reply_to)
+    data = json.dumps(header).encode()
+    return _FRAME.pack(len(data), len(body)) + data + bytes(body)
+
+
+async def _read_frame(reader: asyncio.StreamReader) -> tuple:
+    """(header, message or None) of the next frame; raises asyncio.IncompleteReadError at the end of the stream."""
+    hlen, blen = _FRAME.unpack(await reader.readexactly(_FRAME.size))
+    header = json.loads(await reader.readexactly(hlen))
+    body = await reader.readexactly(blen)
+    if 'content_type' not in header:
+        return header, None
+    return header, LocalMessage(body, header['content_type'], header['headers'], header['correlation_id'],
+                                header['reply_to'])
+
+
+class _Connection:
+    """Write side of a socket connection; frames are written whole, and drained one writer at a time."""
+    def __init__(self, writer: asyncio.StreamWriter) -> None:
+        self.writer = writer
+        self._lock = asyncio.Lock()
+
+    async def send(self, frame: bytes) -> None:
+        self.writer.write(frame)
+        async with self._lock:
+            await self.writer.drain()
+
+
+class UnixSocketTransport:
+    """
+    Transport between a controller and the clients on the same host, over the Unix socket `path`
+    (the controller listens, clients connect). Each client connection has its own reply name, sent
+    by the controller when it connects; monitoring connections also get every broadcast response.
+    Commands from all connections are queued for the controller (up to `backlog`, after which the
+    controller stops reading and the clients' writes wait)."""
+    by_reference = False
+
+    def __init__(self, path: str, backlog: int=4096) -> None:
+        self.path = path
+        self.backlog = backlog
+        # controller side
+        self._server = None
+        self._commands = None       # _LocalQueue of commands from all connections
+        self._clients = {}          # reply name -> _Connection
+        self._monitors = set()
+        self._handlers = set()      # tasks serving the connections
+        self._names = itertools.count()
+        # client side
+        self._conn = None           # (_Connection, reply name)
+        self._reader = None
+        self._reply_task = None
+
+    # controller side
+    async def consume(self, callback: Callable[..., Awaitable[None]], queue_name: Optional[str]=None,
+                      prefetch_count: int=256, bindings: Optional[routing.CommandBindings]=None,
+                      exchange_name: Optional[str]=None) -> _Consumer:
+        """Listen on the socket and deliver the commands of every client to `callback`."""
+        if self._commands is None:
+            self._commands = _LocalQueue(self.backlog)
+        consumer = self._commands.consume(callback, _Window(prefetch_count))
+        if os.path.exists(self.path):
+            os.unlink(self.path)    # left behind by a controller that did not shut down cleanly
+        self._server = await asyncio.start_unix_server(self._serve, self.path)
+
+        async def cancel() -> None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._commands.cancel(consumer)
+        return _Consumer(cancel)
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        name = f"unix-{next(self._names)}"
+        conn = self._clients[name] = _Connection(writer)
+        task = asyncio.current_task()
+        self._handlers.add(task)
+        try:
+            await conn.send(_frame('hello', reply_to=name))
+            while True:
+                header, message = await _read_frame(reader)
+                if header['kind'] == 'command':
+                    await self._commands.put(message)
+                elif header['kind'] == 'monitor':
+                    self._monitors.add(name)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._clients.pop(name, None)
+            self._monitors.discard(name)
+            self._handlers.discard(task)
+            writer.close()
+
+    async def _send(self, name: str, message: Any) -> None:
+        """Send a response to connection `name`; responses to clients that left are dropped."""
+        conn = self._clients.get(name)
+        if conn is None:
+            return
+        try:
+            await conn.send(_frame('response', message))
+        except ConnectionError:
+            self._clients.pop(name, None)
+
+    async def _publish_reply(self, message: Any, routing_key: str) -> None:
+        await self._send(routing_key, message)
+
+    async def _publish_broadcast(self, message: Any, routing_key: str='') -> None:
+        for name in list(self._monitors):
+            await self._send(name, message)
+
+    async def response_exchanges(self, exchange_name: Optional[str]=None, confirms: bool=False) -> tuple:
+        return _Endpoint(self._publish_broadcast), _Endpoint(self._publish_reply)
+
+    # client side
+    async def _connect(self) -> tuple:
+        if self._conn is None:
+            self._reader, writer = await asyncio.open_unix_connection(self.path)
+            header, _ = await _read_frame(self._reader)
+            self._conn = (_Connection(writer), header['reply_to'])
+        return self._conn
+
+    async def _publish_command(self, message: Any, routing_key: str) -> None:
+        conn, _ = await self._connect()
+        await conn.send(_frame('command', message, routing_key))
+
+    async def command_exchange(self, exchange_name: Optional[str]=None) -> _Endpoint:
+        await self._connect()
+        return _Endpoint(self._publish_command)
+
+    async def reply_queue(self, callback: Callable[..., Awaitable[None]], exchange_name: Optional[str]=None,
+                          monitor: bool=False, prefetch_count: int=64) -> Optional[str]:
+        """Deliver the responses arriving on the connection to `callback`; returns the connection's reply name."""
+        conn, name = await self._connect()
+        if monitor:
+            await conn.send(_frame('monitor'))
+
+        async def receive_forever() -> None:
+            window = _Window()
+            try:
+                while True:
+                    _, message = await _read_frame(self._reader)
+                    await callback(LocalMessage.delivery(message, window, await window.acquire()))
+            except (asyncio.IncompleteReadError, ConnectionError):
+                pass
+        self._reply_task = asyncio.ensure_future(receive_forever())
+        return None if monitor else name
+
+    async def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+        for conn in list(self._clients.values()):
+            conn.writer.close()
+        # the handlers end once their connection is closed
+        await asyncio.gather(*self._handlers, return_exceptions=True)
+        if self._commands is not None:
+            await self._commands.close()
+        if self._reply_task is not None:
+            self._reply_task.cancel()
+            await asyncio.gather(self._reply_task, return_exceptions=True)
+        if self._conn is not None:
+            self._conn[0].writer.close()
+            self._conn = None
+
+
+_local = {}
+
+def from_uri(uri: str, size: int=1) -> Any:
+    """
+    Transport for `uri`: 'unix:///path/to/socket', 'local://<name>' (the same in-process transport
+    for everything in the process using that name) or an AMQP URI (the shared pool of `size`
+    connections, see `amqp_pool.get_pool`)."""
+    if uri.startswith('unix://'):
+        return UnixSocketTransport(uri[len('unix://'):])
+    if uri.startswith('local://'):
+        try:
+            return _local[uri]
+        except KeyError:
+            transport = _local[uri] = LocalTransport()
+            return transport
+    return AMQPTransport(get_pool(uri, size=size))
+
+
+def as_transport(obj: Any) -> Any:
+    """`obj` as a transport: connection pools are wrapped in an `AMQPTransport`."""
+    return AMQPTransport(obj) if isinstance(obj, ConnectionPool) else obj
@@ -0,0 +1,33 @@
+import os
+import sys
+
+# the lab_interface modules import each other by their bare names (they are run as scripts); the
+# terminal and the simulated instruments of the benchmarks are imported the same way
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for directory in ('benchmarks', 'user_terminal', 'lab_interface'):
+    sys.path.insert(0, os.path.join(root, directory))
+
+import pytest
+
+
+@pytest.fixture
+def start_lab(tmp_path):
+    """
+    Coroutine function starting a controller with simulated instruments `specs` ({resource name:
+    SimSpec}) in `station` (a name, or {resource name: station}; None leaves them unconnected),
+    over an in-process transport; returns (controller, client)."""
+    from controller import Controller
+    from sim_instruments import SimResourceManager
+    from transport import LocalTransport
+    from user_terminal import connect_client
+
+    async def start(specs, station='s0', **kwargs):
+        transport = LocalTransport()
+        controller = Controller(rm=SimResourceManager(specs), transport=transport,
+                                store_path=str(tmp_path / 'store'), **kwargs)
+        controller.start()
+        for resource_name in (specs if station is not None else ()):
+            await controller.create_interface_async(resource_name, station if isinstance(station, str)
+                                                    else station[resource_name])
+        return controller, await connect_client(transport, echo=False)
+    return start
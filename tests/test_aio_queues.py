@@ -0,0 +1,141 @@
+import asyncio
+from collections import deque
+
+import aio_pika
+import pytest
+
+from aio_queues import BatchPublisher, MessageBatcher, RateMeter, envelope
+from async_deque import AsyncDeque
+from metrics import Metrics
+from request_context import RequestContext, Response
+from transport import make_message
+
+
+def run(coro):
+    return asyncio.run(asyncio.wait_for(coro, 5))
+
+
+class Message:
+    """Incoming message recording its acknowledgements."""
+    def __init__(self, body, acks: list, **properties) -> None:
+        self.message = make_message(body, content_type='application/json', **properties)
+        self.acks = acks
+
+    def __getattr__(self, name):
+        return getattr(self.message, name)
+
+    async def ack(self, multiple: bool=False) -> None:
+        self.acks.append((self.body, multiple))
+
+
+class Exchange:
+    """Exchange whose first `failures` publishes raise a closed-connection error."""
+    def __init__(self, failures: int=0) -> None:
+        self.failures = failures
+        self.published = []
+
+    async def publish(self, message, routing_key='', **kwargs) -> None:
+        if self.failures:
+            self.failures -= 1
+            raise aio_pika.exceptions.AMQPConnectionError('connection closed')
+        self.published.append((message.body, routing_key))
+
+
+def publish(exchange, *bodies, **kwargs):
+    metrics = Metrics()
+    publisher = BatchPublisher(exchange, metrics=metrics, by_reference=True, codec_name='object',
+                               retry_delay=0., **kwargs)
+
+    async def main():
+        outbox = deque(Response(RequestContext(correlation_id=str(i)), body) for i, body in enumerate(bodies))
+        n = await publisher.publish_batch(outbox)
+        await publisher.drain()
+        return n
+
+    n = run(main())
+    return n, {name: count for (name, _), count in metrics.counters.items()}
+
+
+@pytest.mark.parametrize('confirms', [False, True])
+def test_failed_publishes_are_retried(confirms):
+    exchange = Exchange(failures=2)
+    n, counters = publish(exchange, 'a', 'b', confirms=confirms)
+    assert n == 2
+    assert sorted(body for body, _ in exchange.published) == ['a', 'b']
+    assert counters['publish_retried'] == 2 and 'publish_failed' not in counters
+
+
+@pytest.mark.parametrize('confirms', [False, True])
+def test_publishes_that_keep_failing_are_dropped_and_counted(confirms, caplog):
+    exchange = Exchange(failures=3)
+    n, counters = publish(exchange, 'lost', 'ok', confirms=confirms, retries=1)
+    assert n == 2
+    assert len(exchange.published) == 1
+    assert counters['publish_failed'] == 1
+    assert 'dropped response' in caplog.text
+
+
+def test_envelope():
+    message = make_message(b'{}', content_type='application/json', correlation_id='c1', reply_to='r',
+                           headers={'accept': b'application/msgpack', 'priority': 'high', 'after': ['c0']})
+    body, props = envelope(message, arrived=1.)
+    assert body == b'{}'
+    assert props == {'content_type': 'application/json', 'accept': 'application/msgpack', 'correlation_id': 'c1',
+                     'reply_to': 'r', 'priority': 'high', 'timeout': None, 'barrier': None, 'after': ['c0'],
+                     'arrived': 1.}
+
+
+def test_full_batches_are_delivered_with_one_ack():
+    async def main():
+        queue, acks, meter = AsyncDeque(), [], RateMeter()
+        batcher = MessageBatcher(queue, batch_size=3, flush_interval=10., meter=meter)
+        for i in range(7):
+            await batcher(Message(i, acks))
+        delivered = [body for body, _ in queue]
+        await batcher.flush()
+        return delivered, [body for body, _ in queue], acks, meter.count
+
+    delivered, flushed, acks, count = run(main())
+    assert delivered == list(range(6))
+    assert flushed == list(range(7))
+    assert acks == [(2, True), (5, True), (6, True)]
+    assert count == 7
+
+
+def test_partial_batches_are_flushed_after_the_interval():
+    async def main():
+        queue, acks = AsyncDeque(), []
+        batcher = MessageBatcher(queue, batch_size=64, flush_interval=0.01)
+        await batcher(Message('a', acks))
+        await batcher(Message('b', acks))
+        before = len(queue)
+        await queue.wait()
+        await asyncio.sleep(0)
+        return before, [body for body, _ in queue], acks
+
+    assert run(main()) == (0, ['a', 'b'], [('b', True)])
+
+
+def test_batches_wait_unacknowledged_for_room_in_the_queue():
+    async def main():
+        queue, acks = AsyncDeque(capacity=2), []
+        queue.extend([('old', {}), ('old', {})])
+        batcher = MessageBatcher(queue, batch_size=1)
+        delivery = asyncio.ensure_future(batcher(Message('new', acks)))
+        await asyncio.sleep(0.01)
+        held = (delivery.done(), list(acks))
+        queue.popleft()
+        await delivery
+        return held, acks
+
+    assert run(main()) == ((False, []), [('new', True)])
+
+
+@pytest.mark.parametrize('mirror', [False, True])
+def test_responses_go_to_the_reply_queue_of_their_client(mirror):
+    publisher = BatchPublisher('broadcast', routing_key='all', reply_exchange='direct', mirror=mirror)
+    to_client = Response(RequestContext(correlation_id='c1', reply_to='client'), 'ok')
+    expected = [('direct', 'client')] + ([('broadcast', 'all')] if mirror else [])
+    assert publisher.routes(to_client) == expected
+    assert publisher.routes(Response(RequestContext(), 'no reply queue')) == [('broadcast', 'all')]
+    assert publisher.routes('not a response') == [('broadcast', 'all')]
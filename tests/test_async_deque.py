@@ -0,0 +1,98 @@
+import asyncio
+
+from async_deque import AsyncDeque, LaneQueue, Signal
+
+
+def run(coro):
+    return asyncio.run(asyncio.wait_for(coro, 5))
+
+
+def test_signal_set_before_wait_is_not_lost():
+    async def main():
+        signal = Signal()       # created without a running loop, like in Controller.__init__
+        signal.set()
+        await signal.wait()
+        waiter = asyncio.ensure_future(signal.wait())
+        await asyncio.sleep(0.01)
+        blocked = not waiter.done()
+        signal.set()
+        await waiter
+        return blocked
+
+    assert run(main())
+
+
+def test_consumer_wakes_up_when_items_arrive():
+    async def main():
+        d = AsyncDeque()
+        got = []
+
+        async def consume():
+            while len(got) < 3:
+                await d.wait()
+                while d:
+                    got.append(d.popleft())
+
+        consumer = asyncio.ensure_future(consume())
+        d.append(1)
+        await asyncio.sleep(0)
+        d.extend([2, 3])
+        await consumer
+        return got
+
+    assert run(main()) == [1, 2, 3]
+
+
+def test_deques_sharing_a_signal_wake_one_consumer():
+    async def main():
+        signal = Signal()
+        a, b = AsyncDeque(signal=signal), AsyncDeque(signal=signal)
+        woken = asyncio.ensure_future(signal.wait())
+        await asyncio.sleep(0)
+        b.appendleft('x')
+        await woken
+        return list(a), list(b)
+
+    assert run(main()) == ([], ['x'])
+
+
+def test_capacity_is_soft_and_producers_can_wait_for_space():
+    async def main():
+        d = AsyncDeque(capacity=2)
+        d.extend([1, 2])
+        full = (d.full(), d.full(0))
+        d.append(3)             # appends never fail
+        waiter = asyncio.ensure_future(d.wait_space())
+        await asyncio.sleep(0.01)
+        waiting = not waiter.done()
+        d.popleft()
+        await asyncio.sleep(0.01)
+        still_waiting = not waiter.done()
+        d.popleft()
+        await waiter
+        return full, waiting, still_waiting, list(d)
+
+    assert run(main()) == ((True, False), True, True, [3])
+
+
+def test_lane_queue_capacity_counts_every_lane():
+    async def main():
+        q = LaneQueue(key=lambda x: x[0], capacity=2)
+        q.append((2, 'low'))
+        q.append((0, 'high'))
+        full = q.full()
+        waiter = asyncio.ensure_future(q.wait_space())
+        await asyncio.sleep(0)
+        first = q.popleft()
+        await waiter
+        return full, first, q.depths()
+
+    assert run(main()) == (True, (0, 'high'), [0, 0, 1])
+
+
+def test_an_empty_queue_takes_any_batch():
+    async def main():
+        d = AsyncDeque(capacity=2)
+        await d.wait_space(5)
+
+    run(main())
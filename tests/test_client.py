@@ -0,0 +1,117 @@
+import asyncio
+
+import pytest
+
+from request_context import HIGH, LOW, NORMAL, Outbox, RequestContext, current_request
+from sim_instruments import SimSpec
+from user_terminal import LabClient, bind_reply_queue
+
+
+SUPPLIES = {'P1::INSTR': SimSpec('PowerSupply', 'p1', latency=0.01, jitter=0.02),
+            'P2::INSTR': SimSpec('PowerSupply', 'p2', latency=0.01, jitter=0.02)}
+
+
+def run(coro):
+    return asyncio.run(asyncio.wait_for(coro, 10))
+
+
+def test_request_context_from_properties():
+    request = RequestContext.from_properties({'correlation_id': 'c1', 'accept': 'application/json',
+                                              'reply_to': 'r', 'priority': 'HIGH', 'timeout': 2.,
+                                              'barrier': 1, 'after': b'a,b'})
+    assert (request.correlation_id, request.accept, request.reply_to) == ('c1', 'application/json', 'r')
+    assert request.priority == HIGH and request.barrier and request.after == ('a', 'b')
+    assert request.deadline == request.received + 2.
+    assert not request.expired(request.received + 1.) and request.expired(request.received + 3.)
+    assert RequestContext.from_properties({'after': [b'a', 'b']}).after == ('a', 'b')
+    assert RequestContext.from_properties({'priority': 2}).priority == LOW
+    default = RequestContext.from_properties({})
+    assert (default.priority, default.deadline, default.barrier, default.after) == (NORMAL, None, False, ())
+    with pytest.raises(ValueError):
+        RequestContext.from_properties({'priority': 'urgent'})
+
+
+def test_outbox_tags_responses_with_the_current_request():
+    outbox = Outbox()
+    request = RequestContext(correlation_id='c1')
+    outbox.append('untagged')
+    token = current_request.set(request)
+    outbox.append('ok')
+    outbox.append_error('failed')
+    outbox.append_busy('busy', 0.5)
+    current_request.reset(token)
+    assert [(r.request, r.body, r.error, r.retry_after) for r in outbox] == [
+        (None, 'untagged', False, None), (request, 'ok', False, None), (request, 'failed', True, None),
+        (request, 'busy', True, 0.5)]
+
+
+def test_concurrent_commands_get_their_own_replies(start_lab):
+    async def main():
+        controller, client = await start_lab(SUPPLIES)
+        futures = [await client.submit(f'p{1 + i % 2}', 'idn', correlation_id=f'c{i}') for i in range(40)]
+        in_flight = client.in_flight
+        replies = await asyncio.gather(*futures)
+        await controller.shutdown_async()
+        return in_flight, replies, client.in_flight
+
+    in_flight, replies, remaining = run(main())
+    assert in_flight == 40 and remaining == 0
+    for i, reply in enumerate(replies):
+        iid = f'p{1 + i % 2}'
+        assert reply.correlation_id == f'c{i}' and not reply.error and reply.latency > 0
+        assert reply.body == f"{iid} / idn: PowerSupply-{iid}"
+
+
+def test_call_and_errors(start_lab):
+    async def main():
+        controller, client = await start_lab(SUPPLIES)
+        ok = await client.call('p1', 'set_voltage', 2.5, timeout=5)
+        unknown_instrument = await client.call('p9', 'idn', timeout=5)
+        unknown_command = await client.call('controller', 'no_such_command', timeout=5)
+        with pytest.raises(asyncio.TimeoutError):
+            await client.call('p1', 'sleep', 1, timeout=0.05)
+        await controller.shutdown_async()
+        return ok, unknown_instrument, unknown_command
+
+    ok, unknown_instrument, unknown_command = run(main())
+    assert not ok.error
+    assert unknown_instrument.error and 'p9' in unknown_instrument.body
+    assert unknown_command.error
+
+
+
+async def recording_client(transport, seen: list, monitor: bool=False) -> LabClient:
+    """Client recording the correlation ID of every reply to a command it receives in `seen`."""
+    client = LabClient(await transport.command_exchange(), 'object', echo=False)
+    process = client.process_response
+
+    async def record(message) -> None:
+        if message.correlation_id is not None:     # not a notice such as "create_interface: ..."
+            seen.append(message.correlation_id)
+        await process(message)
+    client.process_response = record
+    await bind_reply_queue(transport, client, monitor=monitor)
+    return client
+
+
+@pytest.mark.parametrize('mirror', [False, True])
+def test_clients_only_receive_their_own_replies(start_lab, mirror):
+    async def main():
+        controller, _ = await start_lab(SUPPLIES, mirror_responses=mirror)
+        seen = {'first': [], 'second': [], 'monitor': []}
+        first, second, monitor = [await recording_client(controller.transport, seen[name], monitor=(name == 'monitor'))
+                                  for name in seen]
+        futures = [await first.submit('p1', 'idn', correlation_id='a'),
+                   await second.submit('p2', 'idn', correlation_id='b')]
+        await asyncio.wait_for(asyncio.gather(*futures), 5)
+        # a monitoring client has no reply queue: its own commands are answered on the broadcast exchange
+        own = await monitor.call('p1', 'idn', timeout=5)
+        await asyncio.sleep(0.05)
+        await controller.shutdown_async()
+        return seen, own
+
+    seen, own = run(main())
+    assert seen['first'] == ['a'] and seen['second'] == ['b']
+    assert sorted(seen['monitor'][:-1]) == (['a', 'b'] if mirror else [])
+    assert seen['monitor'][-1] == own.correlation_id
+    assert not own.error
@@ -0,0 +1,86 @@
+from array import array
+
+import pytest
+
+import codec
+from codec import BINARY, JSON, OBJECT, CodecError
+
+
+MESSAGE = {'cmd': 'ask', 'args': ['*IDN?', 1, -2, 3.5, None, True, False], 'kwargs': {},
+           'nested': {'n': [[], {}], 'big': 2 ** 70, 'neg': -(2 ** 70)}, 'text': 'µΩ'}
+
+
+@pytest.mark.parametrize('name', ['json', 'binary', 'object'])
+def test_round_trip(name):
+    c = codec.get_codec(name)
+    assert c.decode(c.encode(MESSAGE)) == MESSAGE
+
+
+def test_lookup_by_content_type_and_default():
+    assert codec.get_codec(BINARY.content_type) is BINARY
+    assert codec.get_codec() is JSON
+    assert codec.decode(b'[1, 2]') == [1, 2]
+    assert codec.decode(BINARY.encode([1, 2]), BINARY.content_type) == [1, 2]
+    with pytest.raises(CodecError):
+        codec.get_codec('xml')
+
+
+def test_only_object_codec_is_not_wire():
+    assert JSON.wire and BINARY.wire and not OBJECT.wire
+    obj = [1, 2]
+    assert OBJECT.encode(obj) is obj
+
+
+def test_binary_tuples_and_bytes():
+    assert BINARY.decode(BINARY.encode((1, 'a'))) == [1, 'a']
+    assert BINARY.decode(BINARY.encode({(1, 2): b'\x00\xff'})) == {(1, 2): b'\x00\xff'}
+
+
+@pytest.mark.parametrize('n', [0, 1, 63, 64, 127, 128, 2 ** 31, -1, -64, -65, -(2 ** 63)])
+def test_binary_varint_edges(n):
+    assert BINARY.decode(BINARY.encode(n)) == n
+
+
+@pytest.mark.parametrize('typecode', ['b', 'H', 'i', 'q', 'f', 'd'])
+def test_binary_array_round_trip(typecode):
+    values = array(typecode, range(5))
+    decoded = BINARY.decode(BINARY.encode({'offset': 3, 'data': values}))
+    assert decoded['offset'] == 3
+    assert list(decoded['data']) == list(values)
+
+
+def test_binary_array_data_is_aligned():
+    # the array bytes start on an 8-byte boundary whatever precedes them, so they decode in place
+    for prefix in range(9):
+        data = BINARY.encode(['x' * prefix, array('d', [1.5, -2.5])])
+        assert list(BINARY.decode(data)[1]) == [1.5, -2.5]
+        raw = array('d', [1.5, -2.5]).tobytes()
+        assert data.index(raw) % 8 == 0
+
+
+def test_binary_empty_and_2d_arrays():
+    assert len(BINARY.decode(BINARY.encode(array('d')))) == 0
+    view = memoryview(array('i', range(6))).cast('B').cast('i', (2, 3))
+    decoded = BINARY.decode(BINARY.encode(view))
+    assert decoded.shape == (2, 3)
+    assert decoded.tolist() == [[0, 1, 2], [3, 4, 5]]
+
+
+def test_json_encodes_arrays_as_lists():
+    assert JSON.decode(JSON.encode({'data': array('d', [1.0, 2.0])})) == {'data': [1.0, 2.0]}
+
+
+@pytest.mark.parametrize('data', [b'', b'x', b's\x05ab', b'l\x02i\x02', b'a', b'NN'])
+def test_binary_invalid_messages(data):
+    with pytest.raises(CodecError):
+        BINARY.decode(data)
+
+
+def test_invalid_json():
+    with pytest.raises(CodecError):
+        JSON.decode(b'{')
+
+
+def test_unencodable_object():
+    with pytest.raises(CodecError):
+        BINARY.encode(object())
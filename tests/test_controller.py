@@ -0,0 +1,144 @@
+import asyncio
+
+import pytest
+
+from sim_instruments import SimSpec
+
+
+def run(coro):
+    return asyncio.run(asyncio.wait_for(coro, 10))
+
+
+SUPPLIES = {'P1::INSTR': SimSpec('PowerSupply', 'p1'), 'P2::INSTR': SimSpec('PowerSupply', 'p2')}
+
+
+@pytest.mark.parametrize('ordering', ['none', 'after', 'barrier', 'pending_barrier'])
+def test_cached_queries_keep_their_ordering(start_lab, ordering):
+    async def main():
+        controller, client = await start_lab(SUPPLIES)
+        await client.call('p1', 'get_voltage', timeout=5)     # warms the cache
+        nap = await client.submit('p2', 'sleep', [0.3], correlation_id='nap',
+                                  barrier=(ordering == 'pending_barrier'))
+        await asyncio.sleep(0.05)
+        options = {'after': {'after': ('nap',)}, 'barrier': {'barrier': True}}.get(ordering, {})
+        reply = await asyncio.wait_for(await client.submit('p1', 'get_voltage', **options), 5)
+        slept = nap.done()
+        await nap
+        await controller.shutdown_async()
+        return reply, slept
+
+    reply, slept = run(main())
+    assert not reply.error and 'get_voltage' in reply.body
+    # only an unordered query may be answered from the cache while the sleep is still running
+    assert slept == (ordering != 'none')
+
+
+async def finish_order(client, commands):
+    """Submit (iid, cmd, args) `commands` at once; returns their indices in the order they were answered."""
+    order = []
+    futures = []
+    for i, (iid, cmd, args) in enumerate(commands):
+        future = await client.submit(iid, cmd, args)
+        future.add_done_callback(lambda f, i=i: order.append(i))
+        futures.append(future)
+    replies = await asyncio.wait_for(asyncio.gather(*futures), 5)
+    assert not any(reply.error for reply in replies)
+    return order
+
+
+@pytest.mark.parametrize('mode, expected', [('parallel', [2, 0, 1]), ('serial', [0, 1, 2])])
+def test_station_modes(start_lab, mode, expected):
+    async def main():
+        controller, client = await start_lab(SUPPLIES, station_mode=mode)
+        # commands to one instrument always run in order; a parallel station lets p2 overtake p1
+        order = await finish_order(client, [('p1', 'sleep', [0.2]), ('p1', 'idn', []), ('p2', 'idn', [])])
+        await controller.shutdown_async()
+        return order
+
+    assert run(main()) == expected
+
+
+def test_every_station_is_served(start_lab):
+    async def main():
+        specs = {f'P{i}::INSTR': SimSpec('PowerSupply', f'p{i}') for i in range(6)}
+        controller, client = await start_lab(specs, {f'P{i}::INSTR': f's{i % 3}' for i in range(6)})
+        order = await finish_order(client, [(f'p{i % 6}', 'idn', []) for i in range(60)])
+        ready = dict(controller._ready_stations)
+        await controller.shutdown_async()
+        return order, ready
+
+    order, ready = run(main())
+    assert sorted(order) == list(range(60))
+    for k in range(6):
+        mine = [i for i in order if i % 6 == k]
+        assert mine == sorted(mine)
+    assert ready == {}      # nothing left to dispatch
+
+
+def test_full_stations_reject_commands_with_a_retry_delay(start_lab):
+    async def main():
+        controller, client = await start_lab(SUPPLIES, station_capacity=2)
+        running = await client.submit('p1', 'sleep', [0.3])
+        await asyncio.sleep(0.05)
+        queued = [await client.submit('p1', 'idn') for _ in range(2)]
+        rejected = await asyncio.wait_for(await client.submit('p2', 'idn'), 5)
+        urgent = await client.submit('p2', 'idn', priority='high')
+        retried = await client.call('p2', 'idn', timeout=5)
+        replies = await asyncio.wait_for(asyncio.gather(running, urgent, *queued), 5)
+        counted = controller.rejected
+        await controller.shutdown_async()
+        return rejected, retried, replies, counted
+
+    rejected, retried, replies, counted = run(main())
+    assert rejected.error and rejected.retry_after > 0 and 'busy' in rejected.body
+    assert not retried.error and retried.body == 'p2 / idn: PowerSupply-p2'
+    # high priority is accepted even when the station is full (and preempts the sleep)
+    running, urgent, *queued = replies
+    assert running.error and 'preempted' in running.body
+    assert not urgent.error and not any(reply.error for reply in queued)
+    assert counted >= 1
+
+
+def test_discover_connects_each_instrument_once(start_lab):
+    specs = {f'P{i}::INSTR': SimSpec('PowerSupply', f'p{i}') for i in range(4)}
+    specs['V1::INSTR'] = SimSpec('VNA', 'v1')
+
+    async def main():
+        controller, client = await start_lab(specs, station=None)
+        # overlapping discovers split the instruments between them instead of opening them twice
+        first, second = await asyncio.gather(controller.discover_async('s0'), controller.discover_async('s1'))
+        again = await controller.discover_async('s0')
+        reply = await client.call('v1', 'idn', timeout=5)
+        sessions = {iid: d['interface']._conn is controller.resource_manager.opened[d['resource_name']]
+                    for iid, d in controller.instruments.items()}
+        await controller.shutdown_async()
+        return first, second, again, reply, sessions
+
+    first, second, again, reply, sessions = run(main())
+    assert sorted(first['connected']) + sorted(second['connected']) == sorted(specs)
+    assert not first['failed'] and not second['failed']
+    assert first['connected']['V1::INSTR'] == 'VNA (v1)'
+    assert again['connected'] == {} and again['failed'] == {}
+    assert not reply.error
+    assert sessions == {iid: True for iid in ('p0', 'p1', 'p2', 'p3', 'v1')}     # identify sessions are reused
+
+
+def test_create_interfaces_reports_failures(start_lab):
+    specs = {'P1::INSTR': SimSpec('PowerSupply', 'p1'), 'COPY::INSTR': SimSpec('PowerSupply', 'p1'),
+             'SCOPE::INSTR': SimSpec('Oscilloscope', 'o1')}
+
+    async def main():
+        controller, _ = await start_lab(specs, station=None)
+        await controller.create_interface_async('P1::INSTR', 's0')
+        summary = await controller.create_interfaces_async(['P1::INSTR', 'COPY::INSTR', 'SCOPE::INSTR',
+                                                            'MISSING::INSTR', 'SCOPE::INSTR'], 's0')
+        instruments = sorted(controller.instruments)
+        await controller.shutdown_async()
+        return summary, instruments
+
+    summary, instruments = run(main())
+    assert summary['connected'] == {} and instruments == ['p1']
+    failed = summary['failed']
+    assert sorted(failed) == ['COPY::INSTR', 'MISSING::INSTR', 'P1::INSTR', 'SCOPE::INSTR']
+    assert 'already connected' in failed['P1::INSTR'] and 'already connected' in failed['COPY::INSTR']
+    assert 'unsupported instrument' in failed['SCOPE::INSTR']
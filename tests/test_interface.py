@@ -0,0 +1,247 @@
+import asyncio
+import random
+import time
+
+import pytest
+from pyvisa.constants import StatusCode
+from pyvisa.errors import VisaIOError
+
+from interface import PowerSupply, VectorNetworkAnalyzer
+from request_context import Outbox, RequestContext, current_request
+from sim_instruments import SimInstrument, SimSpec, SimResourceManager
+
+
+def run(coro):
+    return asyncio.run(asyncio.wait_for(coro, 10))
+
+
+def vna(**kwargs):
+    rm = SimResourceManager({'V::INSTR': SimSpec('VNA', 'v1')})
+    interface = VectorNetworkAnalyzer('V::INSTR', rm, outbox=Outbox(), inst_id='v1', coalesce=True, **kwargs)
+    return interface, rm
+
+
+def queue(interface, *commands):
+    """Queue (cmd, msg) entries, each with its own request; returns the replies collected per request."""
+    replies = {}
+    for i, (cmd, msg) in enumerate(commands):
+        token = current_request.set(RequestContext(correlation_id=str(i)))
+        interface.add_to_inbox(cmd, msg, callback=lambda r, i=i: replies.setdefault(i, r))
+        current_request.reset(token)
+    return replies
+
+
+def errors(interface):
+    return [(m.request and m.request.correlation_id, m.body) for m in interface.outbox if m.error]
+
+
+def test_coalesced_writes_and_queries_are_one_transaction():
+    async def main():
+        v, rm = vna()
+        replies = queue(v, ('query_async', '*IDN?'), ('write_async', 'SENSE:FREQUENCY:START 1'),
+                        ('query_async', 'SENSE:FREQUENCY:POINTS?'))
+        await v.process_command()
+        return replies, rm.opened['V::INSTR'].writes, v
+
+    replies, writes, v = run(main())
+    assert replies == {0: b'VNA-v1\n', 1: None, 2: b'201\n'}
+    assert writes == 1 and not v.inbox and not errors(v)
+
+
+def test_coalesced_queries_use_the_cache_in_order():
+    async def main():
+        v, rm = vna()
+        queue(v, ('query_async', '*IDN?'), ('query_async', 'SENSE:FREQUENCY:START?'))
+        await v.process_command()
+        instrument = rm.opened['V::INSTR']
+        sent = instrument.writes
+        # fully cached: answered without touching the instrument
+        replies = queue(v, ('query_async', '*IDN?'), ('query_async', 'SENSE:FREQUENCY:START?'))
+        await v.process_command()
+        fully_cached = (replies, instrument.writes - sent)
+        # a write invalidates the cached reply of the queries after it, not before it
+        sent = instrument.queries
+        replies = queue(v, ('query_async', 'SENSE:FREQUENCY:START?'), ('write_async', 'SENSE:FREQUENCY:START 1.5'),
+                        ('query_async', 'SENSE:FREQUENCY:START?'))
+        await v.process_command()
+        return fully_cached, replies, instrument.queries - sent
+
+    (cached, writes), replies, queries = run(main())
+    assert cached == {0: b'VNA-v1\n', 1: b'1.00\n'} and writes == 0
+    assert replies == {0: b'1.00\n', 1: None, 2: b'1.00\n'} and queries == 1
+
+
+def test_failing_callback_is_reported_and_does_not_stop_the_interface():
+    async def main():
+        v, _ = vna()
+        loop_task = asyncio.ensure_future(v.process_commands_forever())
+        replies = {}
+        v.add_to_inbox('query_async', '*IDN?', callback=lambda r: float(r))     # raises ValueError
+        v.add_to_inbox('query_async', 'SENSE:FREQUENCY:POINTS?', callback=lambda r: replies.setdefault(1, r))
+        await asyncio.sleep(0.1)
+        # cached parts go through the same path
+        v.add_to_inbox('query_async', '*IDN?', callback=lambda r: {}[r])         # raises KeyError
+        v.add_to_inbox('query_async', '*IDN?', callback=lambda r: replies.setdefault(2, r))
+        await asyncio.sleep(0.1)
+        alive = not loop_task.done()
+        loop_task.cancel()
+        await asyncio.gather(loop_task, return_exceptions=True)
+        return replies, alive, v, current_request.get()
+
+    replies, alive, v, request = run(main())
+    assert alive and request is None
+    assert replies == {1: b'201\n', 2: b'VNA-v1\n'}
+    assert [body.split(':')[0] for _, body in errors(v)] == ['v1 / *IDN?', 'v1 / *IDN?']
+    assert not v.busy()
+
+
+def test_failed_transaction_answers_every_entry_with_an_error():
+    async def main():
+        v, _ = vna(timeout=0.2)
+        replies = queue(v, ('write_async', 'SENSE:FREQUENCY:START 1'), ('query_async', 'NO:REPLY'))
+        await v.process_command()
+        return replies, v
+
+    replies, v = run(main())
+    assert replies == {}
+    failed = errors(v)
+    assert [cid for cid, _ in failed] == ['0', '1']
+    assert all('transaction failed' in body for _, body in failed)
+
+
+class Resource:
+    """
+    Open VISA resource whose reads time out, losing what they got, unless `count` bytes arrive. A
+    read of an empty buffer waits for the `arriving` bytes."""
+    session = 1
+
+    def __init__(self, buffered=b'', arriving=b'', reports_buffer=True) -> None:
+        self.visalib = self
+        self.buffer, self.arriving = bytearray(buffered), bytearray(arriving)
+        self.reports_buffer = reports_buffer
+        self.counts = []
+
+    @property
+    def bytes_in_buffer(self) -> int:
+        if not self.reports_buffer:
+            raise VisaIOError(StatusCode.error_nonsupported_attribute)
+        return len(self.buffer)
+
+    def read(self, session, count):
+        self.counts.append(count)
+        if not self.buffer:
+            self.buffer, self.arriving = self.arriving, bytearray()
+        if len(self.buffer) < count:
+            self.buffer.clear()
+            raise VisaIOError(StatusCode.error_timeout)
+        data = bytes(self.buffer[:count])
+        del self.buffer[:count]
+        return data, StatusCode.success
+
+
+@pytest.mark.parametrize('resource, chunks, counts', [
+    (Resource(buffered=b'1.00\n'), [b'1.00\n', b''], [5, 1]),
+    (Resource(arriving=b'1.00\n'), [b'1.00\n'], [1, 4]),
+    (Resource(buffered=b'x' * 10), [b'x' * 8, b'xx'], [8, 2]),
+    (Resource(buffered=b'x' * 8, reports_buffer=False), [b'x' * 8], [8]),
+])
+def test_read_chunk_asks_only_for_buffered_bytes(resource, chunks, counts):
+    v, _ = vna(chunk_size=8)
+    v._conn = resource
+    assert [v.read_chunk() for _ in chunks] == chunks
+    assert resource.counts == counts
+
+
+class StatusInstrument(SimInstrument):
+    """
+    Simulated instrument with a status byte (event status bit set from the `ready`-th serial poll on)
+    and service request events (raised after `srq_after` s, never if None)."""
+    def __init__(self, ready: int=3, srq_after=None, events: bool=True) -> None:
+        super().__init__('P::INSTR', SimSpec('PowerSupply', 'p1'), random.Random(0))
+        self.ready, self.polls = ready, 0
+        self.srq_after, self.events = srq_after, events
+        self.written = []
+
+    def write(self, message: str) -> int:
+        self.written.append(message.strip())
+        return super().write(message)
+
+    def read_stb(self) -> int:
+        self.polls += 1
+        return 32 if self.polls >= self.ready else 0
+
+    def enable_event(self, *args, **kwargs) -> None:
+        if not self.events:
+            super().enable_event(*args, **kwargs)
+        self._opc = None
+
+    def discard_events(self, *args, **kwargs) -> None:
+        self._opc = None
+
+    def wait_on_event(self, event_type, timeout_ms: int) -> None:
+        if self._opc is None and '*OPC' in self.written:
+            self._opc = time.monotonic()
+        if (self.srq_after is None) or (time.monotonic() < self._opc + self.srq_after):
+            time.sleep(timeout_ms / 1000)
+            raise VisaIOError(StatusCode.error_timeout)
+
+
+def supply(conn=None, **kwargs):
+    rm = SimResourceManager({'P::INSTR': SimSpec('PowerSupply', 'p1')})
+    return PowerSupply('P::INSTR', rm, outbox=Outbox(), inst_id='p1', conn=conn, **kwargs)
+
+
+@pytest.mark.parametrize('mode, tried', [('opc', (None, None)), ('poll', (False, None)), ('srq', (False, False))])
+def test_wait_complete_falls_back_to_queries(mode, tried):
+    async def main():
+        p = supply()
+        waited = await p.wait_complete_async(mode)
+        return waited, p
+
+    waited, p = run(main())
+    assert waited >= 0
+    # the simulated instrument has neither a status byte nor events: (serial polls, SRQ) tried and unsupported
+    assert (p._stb, p._srq) == tried
+
+
+def test_poll_uses_the_status_byte():
+    async def main():
+        conn = StatusInstrument(ready=3)
+        await supply(conn).wait_complete_async('poll')
+        return conn
+
+    conn = run(main())
+    assert conn.polls == 3
+    assert conn.written == ['*CLS', '*ESE 1', '*OPC', '*ESR?']    # *ESR? only once the status byte says so
+
+
+def test_srq_wait():
+    async def main():
+        conn = StatusInstrument(srq_after=0.05)
+        waited = await supply(conn).wait_complete_async('srq')
+        return waited, conn
+
+    waited, conn = run(main())
+    assert 0.05 <= waited < 1
+    assert conn.written == ['*CLS', '*ESE 1', '*SRE 32', '*OPC', '*ESR?']
+
+
+def test_srq_wait_times_out_and_can_be_cancelled():
+    async def main():
+        p = supply(StatusInstrument(), timeout=0.1)
+        with pytest.raises(VisaIOError):
+            await p.wait_complete_async('srq')
+        task = asyncio.ensure_future(p.wait_complete_async('srq'))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        start = time.monotonic()
+        await p.write_async('*CLS')         # the worker thread is free again
+        return time.monotonic() - start
+
+    assert run(main()) < 0.5
+
+
+def test_invalid_completion_mode():
+    with pytest.raises(ValueError):
+        run(supply().wait_complete_async('guess'))
@@ -0,0 +1,93 @@
+from array import array
+
+import pytest
+
+from measurement_store import MeasurementStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    s = MeasurementStore(str(tmp_path / 'store'), segment_size=256)
+    yield s
+    s.close()
+
+
+def values(store, mid):
+    record, data = store.load(mid)
+    return record, list(data)
+
+
+def test_round_trip(store):
+    mid = store.append([-1.5, -2.25, 0.], 'v1', station='s0', param='S11', start=1., stop=2.,
+                       meta={'name': 'run1'})
+    record, data = values(store, mid)
+    assert data == [-1.5, -2.25, 0.]
+    assert (record.instrument, record.station, record.param) == ('v1', 's0', 'S11')
+    assert (record.start, record.stop, record.npoints) == (1., 2., 3)
+    assert record.dtype == '<f8' and record.shape == (3,)
+    assert record.meta == {'name': 'run1'}
+
+
+@pytest.mark.parametrize('typecode', ['b', 'i', 'f', 'd'])
+def test_typed_arrays_keep_their_dtype(store, typecode):
+    mid = store.append(array(typecode, [1, 2, 3]), 'v1')
+    assert values(store, mid)[1] == [1, 2, 3]
+
+
+def test_traces_are_aligned_and_never_straddle_segments(store):
+    mids = [store.append(array('b', range(n)), 'v1') for n in (3, 5, 100, 100, 100)]
+    records = [store.record(mid) for mid in mids]
+    assert all(r.offset % 8 == 0 for r in records)
+    assert all(r.offset + r.nbytes <= 256 for r in records)
+    assert len({r.segment for r in records}) == 2
+    for mid, n in zip(mids, (3, 5, 100, 100, 100)):
+        assert values(store, mid)[1] == list(range(n))
+
+
+def test_oversized_trace_gets_its_own_segment(store):
+    small = store.append([1.], 'v1')
+    big = store.append(array('d', range(100)), 'v1')   # 800 bytes > segment_size
+    after = store.append([2.], 'v1')
+    segments = [store.record(mid).segment for mid in (small, big, after)]
+    assert segments == [0, 1, 2]
+    assert values(store, big)[1] == list(range(100))
+
+
+def test_reopen_keeps_traces_and_appends_after_them(tmp_path):
+    root = str(tmp_path / 'store')
+    store = MeasurementStore(root, segment_size=256)
+    first = store.append([1., 2.], 'v1')
+    store.close()
+    store = MeasurementStore(root, segment_size=256)
+    second = store.append([3.], 'v1')
+    assert values(store, first)[1] == [1., 2.]
+    assert values(store, second)[1] == [3.]
+    assert store.record(second).offset >= store.record(first).offset + 16
+    store.close()
+
+
+def test_query(store):
+    a = store.append([1.], 'v1', station='s0', param='S11', start=1., stop=2., timestamp=10.)
+    b = store.append([1.], 'v1', station='s0', param='S21', start=3., stop=4., timestamp=20.)
+    c = store.append([1.], 'v2', station='s1', param='S11', start=1., stop=2., timestamp=30.)
+    ids = lambda **kw: [r.id for r in store.query(**kw)]
+    assert ids() == [a, b, c]
+    assert ids(instrument='v1') == [a, b]
+    assert ids(station='s1') == [c]
+    assert ids(param='S11', instrument='v2') == [c]
+    assert ids(since=20.) == [b, c]
+    assert ids(until=20.) == [a]
+    assert ids(fmin=2.5) == [b]         # sweeps overlapping [2.5, inf)
+    assert ids(fmin=1.5, fmax=3.5) == [a, b, c]
+    assert ids(fmax=0.5) == []
+    assert ids(limit=2) == [a, b]
+
+
+def test_unknown_measurement(store):
+    with pytest.raises(KeyError):
+        store.record(42)
+
+
+def test_unsupported_data(store):
+    with pytest.raises(TypeError):
+        store.append('not a trace', 'v1')
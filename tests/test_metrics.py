@@ -0,0 +1,69 @@
+import asyncio
+import json
+
+from metrics import Histogram, Metrics
+
+
+def test_histogram_quantiles():
+    hist = Histogram()
+    for value in (1e-3,) * 9 + (0.5,):
+        hist.observe(value)
+    assert hist.quantile(.5) == 1e-3
+    assert hist.quantile(1.) == 0.5
+    snapshot = hist.snapshot()
+    assert snapshot['count'] == 10 and snapshot['max'] == 0.5
+    assert abs(snapshot['mean'] - 0.0509) < 1e-9
+    assert Histogram().quantile(.5) == 0.
+
+
+def test_snapshot():
+    metrics = Metrics()
+    metrics.observe('command', 0.01, 'v1')
+    metrics.inc('visa_reads', label='v1')
+    metrics.inc('visa_reads', 2, label='v1')
+    metrics.gauge('inbox_depth', lambda: {'v1': 3})
+    snapshot = json.loads(json.dumps(metrics.snapshot()))
+    assert snapshot['histograms']['command']['v1']['count'] == 1
+    assert snapshot['counters'] == {'visa_reads': {'v1': 3}}
+    assert snapshot['gauges'] == {'inbox_depth': {'v1': 3}}
+
+
+def test_prometheus():
+    metrics = Metrics()
+    metrics.observe('command', 0.01, 'v1')
+    metrics.inc('published', 2)
+    metrics.gauge('inbox_depth', lambda: {'v1': 3})
+    lines = metrics.prometheus().splitlines()
+    assert '# TYPE lab_command_seconds histogram' in lines
+    assert 'lab_command_seconds_bucket{id="v1",le="+Inf"} 1' in lines
+    assert 'lab_command_seconds_count{id="v1"} 1' in lines
+    assert 'lab_published_total 2' in lines
+    assert 'lab_inbox_depth{id="v1"} 3' in lines
+
+
+def test_prometheus_label_values_are_escaped():
+    metrics = Metrics()
+    metrics.inc('visa_reads', label='a"b\\c\nd')
+    assert 'lab_visa_reads_total{id="a\\"b\\\\c\\nd"} 1' in metrics.prometheus().splitlines()
+
+
+def test_http_endpoint():
+    async def main():
+        metrics = Metrics()
+        metrics.inc('published')
+        server = await metrics.serve(0)
+        port = server.sockets[0].getsockname()[1]
+        bodies = []
+        for path in ('/metrics', '/metrics.json', '/nope'):
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.write(f"GET {path} HTTP/1.0\r\n\r\n".encode())
+            bodies.append(await reader.read())
+            writer.close()
+        server.close()
+        await server.wait_closed()
+        return bodies
+
+    text, data, missing = asyncio.run(asyncio.wait_for(main(), 5))
+    assert text.startswith(b'HTTP/1.0 200 OK') and b'lab_published_total 1' in text
+    assert json.loads(data.split(b'\r\n\r\n', 1)[1])['counters'] == {'published': {'': 1}}
+    assert missing.startswith(b'HTTP/1.0 404')
@@ -0,0 +1,70 @@
+import asyncio
+import math
+import warnings
+from array import array
+
+import pytest
+
+import postprocess
+from postprocess import PostProcessor, format_pipeline, parse_pipeline, run_pipeline
+
+
+def values(trace):
+    return [float(v) for v in trace]
+
+
+def test_parse_and_format():
+    pipeline = parse_pipeline(' Smooth:3, db ,')
+    assert pipeline == (('smooth', (3,)), ('db', ()))
+    assert format_pipeline(pipeline) == 'smooth:3,db'
+    assert parse_pipeline([('AVERAGE', [])]) == (('average', ()),)
+
+
+@pytest.mark.parametrize('spec', ['fft', 'smooth:x', 'smooth:1:2', 'db:1', 'average:2'])
+def test_invalid_pipelines(spec):
+    with pytest.raises(ValueError):
+        parse_pipeline(spec)
+
+
+def test_transforms():
+    def run(spec, *traces):
+        result, = run_pipeline(parse_pipeline(spec), list(traces))
+        return values(result)
+
+    assert run('db', [1., 10., -100.]) == pytest.approx([0., 20., 40.])
+    assert run('linear', [0., 20.]) == pytest.approx([1., 10.])
+    assert run('linear,db', [-3.]) == pytest.approx([-3.])
+    assert run('smooth:3', [0., 3., 6., 9.]) == pytest.approx([1.5, 3., 6., 7.5])
+    assert run('average', [1., 2.], [3., 6.]) == pytest.approx([2., 4.])
+    assert run('average,smooth:1', array('d', [1.]), array('d', [3.])) == pytest.approx([2.])
+    assert run('db', [0.]) == [-math.inf]
+    with pytest.raises(ValueError):
+        run('smooth:0', [1.])
+    with pytest.raises(ValueError):
+        run('average', [1.], [1., 2.])
+
+
+@pytest.mark.skipif(postprocess.np is not None, reason="numpy is installed")
+def test_time_domain_needs_numpy():
+    with pytest.raises(ValueError):
+        run_pipeline(parse_pipeline('time_domain'), [[1.]])
+
+
+def test_large_pipelines_run_on_the_process_pool():
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)     # numpy may not be installed
+        processor = PostProcessor(max_workers=1, inline_points=4)
+
+    async def main():
+        small = await processor.run(parse_pipeline('linear'), [array('d', [0., 20.])])
+        large = await processor.run(parse_pipeline('average'), [memoryview(array('d', [1., 2., 3.])),
+                                                                array('d', [3., 4., 5.])])
+        return small, large
+
+    try:
+        small, large = asyncio.run(asyncio.wait_for(main(), 30))
+    finally:
+        processor.shutdown(wait=True)
+    assert values(small[0]) == pytest.approx([1., 10.])
+    assert values(large[0]) == pytest.approx([2., 3., 4.])
+    assert (processor.runs, processor.offloaded) == (2, 1)
@@ -0,0 +1,100 @@
+import types
+
+import pytest
+
+import query_cache
+from query_cache import QueryCache
+
+
+TTLS = {'[*]IDN[?]': None, 'VOLT[?]': 1., 'SENSE:FREQUENCY:*[?]': 5.}
+INVALIDATIONS = {'[*]RST': ('*',), 'VOLT *': ('VOLT[?]',), 'SENSE:FREQUENCY:*': ('SENSE:FREQUENCY:*[?]',)}
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [100.]
+    monkeypatch.setattr(query_cache, 'time', types.SimpleNamespace(monotonic=lambda: now[0]))
+    return now
+
+
+@pytest.fixture
+def cache():
+    return QueryCache(TTLS, INVALIDATIONS, maxsize=3)
+
+
+def test_hit_after_put(cache):
+    assert cache.get('*IDN?') is None
+    cache.put('*IDN?', b'VNA-1234\n')
+    assert cache.get('*IDN?') == b'VNA-1234\n'
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 1
+
+
+def test_queries_are_normalized(cache):
+    cache.put('sense:frequency:start?', b'1.0\n')
+    assert cache.get('SENSE:FREQUENCY:START?') == b'1.0\n'
+    cache.put('*idn?', b'x')
+    assert cache.peek('  *IDN? ') == b'x'
+
+
+@pytest.mark.parametrize('query', ['XIDN?', '*IDNX', 'VOLTS', 'VOLT?X', 'SENSE:FREQUENCY:START',
+                                   'OUTPUT?', 'SENSE:FREQUENCY?'])
+def test_literal_scpi_characters_are_not_wildcards(cache, query):
+    assert not cache.cacheable(query)
+    cache.put(query, b'x')
+    assert cache.peek(query) is None
+
+
+def test_ttl_expiry(cache, clock):
+    cache.put('VOLT?', b'5.0\n')
+    clock[0] += 0.9
+    assert cache.get('VOLT?') == b'5.0\n'
+    clock[0] += 0.2
+    assert cache.get('VOLT?') is None
+    assert cache.stats()['size'] == 0
+
+
+def test_untimed_entries_never_expire(cache, clock):
+    cache.put('*IDN?', b'x')
+    clock[0] += 1e6
+    assert cache.get('*IDN?') == b'x'
+
+
+def test_writes_invalidate_matching_queries(cache):
+    cache.put('VOLT?', b'5.0\n')
+    cache.put('SENSE:FREQUENCY:START?', b'1.0\n')
+    cache.invalidate_for('VOLT 3.3')
+    assert cache.peek('VOLT?') is None
+    assert cache.peek('SENSE:FREQUENCY:START?') == b'1.0\n'
+
+
+def test_compound_writes_and_queries_in_them(cache):
+    cache.put('VOLT?', b'5.0\n')
+    cache.put('SENSE:FREQUENCY:STOP?', b'2.0\n')
+    cache.invalidate_for('SENSE:FREQUENCY:STOP?;:SENSE:FREQUENCY:START 1.5')
+    assert cache.peek('SENSE:FREQUENCY:STOP?') is None
+    assert cache.peek('VOLT?') == b'5.0\n'
+
+
+def test_reset_clears_everything_but_only_for_the_common_command(cache):
+    cache.put('*IDN?', b'x')
+    cache.put('VOLT?', b'5.0\n')
+    cache.invalidate_for('SYSTEM:RST')
+    assert cache.stats()['size'] == 2
+    cache.invalidate_for('*RST')
+    assert cache.stats()['size'] == 0
+
+
+def test_lru_eviction(cache):
+    for q in ('*IDN?', 'VOLT?', 'SENSE:FREQUENCY:START?'):
+        cache.put(q, b'x')
+    cache.get('*IDN?')  # most recently used now
+    cache.put('SENSE:FREQUENCY:STOP?', b'y')
+    assert cache.peek('VOLT?') is None
+    assert cache.peek('*IDN?') == b'x'
+    assert cache.stats()['evictions'] == 1
+
+
+def test_clear(cache):
+    cache.put('*IDN?', b'x')
+    cache.clear()
+    assert cache.peek('*IDN?') is None
@@ -0,0 +1,83 @@
+import pytest
+
+from read_buffer import ReadBuffer, BlockFormatError
+
+
+def fed(*chunks):
+    buf = ReadBuffer()
+    for chunk in chunks:
+        buf.feed(chunk)
+    return buf
+
+
+def test_take_until_keeps_the_next_reply():
+    buf = fed(b'1.0\n2.')
+    assert buf.take_until(b'\n') == b'1.0\n'
+    assert buf.take_until(b'\n') is None
+    buf.feed(b'0\n')
+    assert buf.take_until(b'\n') == b'2.0\n'
+    assert len(buf) == 0
+
+
+def test_take_until_terminator_split_across_chunks():
+    buf = fed(b'abc\r')
+    assert buf.take_until(b'\r\n') is None
+    buf.feed(b'\nrest')
+    assert buf.take_until(b'\r\n') == b'abc\r\n'
+    assert buf.clear() == b'rest'
+
+
+def test_take_exactly():
+    buf = fed(b'abcd')
+    assert buf.take_exactly(5) is None
+    assert buf.take_exactly(3) == b'abc'
+    assert buf.take_exactly(1) == b'd'
+
+
+def test_take_fields_while_arriving():
+    buf = fed(b'1,2,3')
+    assert buf.take_fields(b',', b'\n') == (b'1,2,', False)
+    assert buf.take_fields(b',', b'\n') is None
+    buf.feed(b'4,5\n')
+    assert buf.take_fields(b',', b'\n') == (b'34,5', True)
+
+
+def test_definite_length_block_and_trailing_terminator():
+    buf = fed(b'#15hel', b'lo\n*IDN\n')
+    assert buf.take_binblock(b'\n') == b'hello'
+    assert buf.take_until(b'\n') == b'*IDN\n'
+
+
+def test_block_terminator_arriving_in_a_later_chunk():
+    buf = fed(b'#13abc')
+    assert buf.take_binblock(b'\n') == b'abc'
+    buf.feed(b'\nnext\n')
+    assert buf.take_until(b'\n') == b'next\n'
+
+
+def test_incomplete_block():
+    buf = fed(b'#2')
+    assert buf.take_binblock() is None
+    buf.feed(b'10abc')
+    assert buf.take_binblock() is None
+    buf.feed(b'defghij')
+    assert buf.take_binblock() == b'abcdefghij'
+
+
+def test_indefinite_length_block():
+    buf = fed(b'#0ab')
+    assert buf.take_binblock(b'\n') is None
+    buf.feed(b'c\n')
+    assert buf.take_binblock(b'\n') == b'abc'
+    with pytest.raises(BlockFormatError):
+        fed(b'#0abc').take_binblock()
+
+
+def test_block_after_separators():
+    assert fed(b' ,\n#12xy').take_binblock() == b'xy'
+
+
+@pytest.mark.parametrize('data', [b'junk#12xy', b'#x12', b'#2a1', b'#\xb212xy'])
+def test_invalid_block_headers(data):
+    with pytest.raises(BlockFormatError):
+        fed(data).take_binblock()
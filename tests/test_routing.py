@@ -0,0 +1,77 @@
+import asyncio
+
+import pytest
+
+from controller import Controller
+from routing import CommandBindings, binding_key, matches, routing_key
+from sim_instruments import SimSpec, SimResourceManager
+from transport import LocalTransport
+from user_terminal import connect_client
+
+
+def test_keys():
+    assert routing_key('1234') == '_._.1234'
+    assert routing_key('1234', 'station_0', 'c1') == 'c1.station_0.1234'
+    assert binding_key('1234') == '*.*.1234'
+
+
+@pytest.mark.parametrize('pattern, key, expected', [
+    ('*.*.1234', '_._.1234', True),
+    ('*.*.1234', 'c1.station_0.1234', True),
+    ('*.*.1234', '_._.12345', False),
+    ('*.*.1234', '_.1234', False),
+    ('#.1234', '1234', True),
+    ('#.1234', 'a.b.c.1234', True),
+    ('c1.#', 'c1', True),
+    ('c1.#', 'c2.x', False),
+])
+def test_matches(pattern, key, expected):
+    assert matches(pattern, key) == expected
+
+
+class Queue:
+    def __init__(self) -> None:
+        self.bound = []
+
+    async def bind(self, exchange, key) -> None:
+        self.bound.append((exchange, key))
+
+
+def test_bindings_added_before_and_after_attaching():
+    async def main():
+        bindings = CommandBindings([binding_key('c1')])
+        await bindings.add(binding_key('1234'))
+        queue = Queue()
+        await bindings.attach(queue, 'e')
+        await bindings.add(binding_key('abcd'))
+        await bindings.add(binding_key('abcd'))
+        return queue.bound
+
+    assert asyncio.run(main()) == [('e', '*.*.1234'), ('e', '*.*.c1'), ('e', '*.*.abcd')]
+
+
+def test_commands_reach_only_the_controller_of_the_instrument(tmp_path):
+    async def main():
+        transport = LocalTransport()
+        controllers = []
+        for i in (1, 2):
+            rm = SimResourceManager({f'P{i}::INSTR': SimSpec('PowerSupply', f'p{i}')})
+            controller = Controller(rm=rm, transport=transport, cntrl_id=f'c{i}', store_path=str(tmp_path / f'store{i}'))
+            controller.start()
+            await controller.create_interface_async(f'P{i}::INSTR', 's0')
+            controllers.append(controller)
+        client = await connect_client(transport, echo=False)
+        replies = [await client.call('p1', 'idn', timeout=5), await client.call('p2', 'idn', timeout=5)]
+        received = [controller.intake_meter.count for controller in controllers]
+        unknown = await asyncio.wait_for(await client.submit('p3', 'idn'), 5)
+        await asyncio.sleep(0.05)
+        unrouted = sum(controller.intake_meter.count for controller in controllers) - sum(received)
+        for controller in controllers:
+            await controller.shutdown_async()
+        return replies, received, unknown, unrouted
+
+    replies, received, unknown, unrouted = asyncio.run(asyncio.wait_for(main(), 10))
+    assert [reply.body for reply in replies] == ['p1 / idn: PowerSupply-p1', 'p2 / idn: PowerSupply-p2']
+    assert received == [1, 1]
+    # commands nobody owns are taken (and answered) by exactly one controller
+    assert unknown.error and 'p3' in unknown.body and unrouted == 1
@@ -0,0 +1,109 @@
+import asyncio
+
+import pytest
+
+import user_terminal
+from sequence import SequenceError, compile_sequence, load_sequence
+from sim_instruments import SimSpec
+from user_terminal import run_plan, start_sequence
+
+
+INSTRUMENTS = {'s0': {'powersupply': 'p1', 'vna': 'v1'}, 'raw': {}}
+
+SOURCE = """# comment
+print starting
+powersupply set_voltage 1.8
+on: powersupply set_output 1
+vna set_frequency_range 1.0 2.0 201
+barrier
+vna s11 results.s1p after:on
+"""
+
+
+def run(coro):
+    return asyncio.run(asyncio.wait_for(coro, 10))
+
+
+def test_compile():
+    plan = compile_sequence(SOURCE, 's0', INSTRUMENTS)
+    assert plan.n_commands == 4
+    kinds = [(s.lineno, s.kind, s.iid, s.cmd, s.args) for s in plan.steps]
+    assert kinds == [(2, 'print', None, None, ()),
+                     (3, 'cmd', 'p1', 'set_voltage', (1.8,)),
+                     (4, 'cmd', 'p1', 'set_output', (1,)),
+                     (5, 'cmd', 'v1', 'set_frequency_range', (1.0, 2.0, 201)),
+                     (7, 'cmd', 'v1', 's11', ('results.s1p',))]
+    assert plan.steps[2].label == 'on'
+    assert [(s.after, s.barrier) for s in plan.steps[1:]] == [((), False), ((), False), ((), False), (('on',), True)]
+    assert plan.digest == compile_sequence(SOURCE, 's0', INSTRUMENTS).digest
+
+
+def test_raw_station_uses_instrument_ids():
+    plan = compile_sequence('p9 idn', 'raw', INSTRUMENTS)
+    assert plan.steps[0].iid == 'p9'
+
+
+def test_every_error_is_reported():
+    source = "nope idn\npowersupply\nvna s11 after:later\nlater: vna idn\nlater: vna idn\n"
+    with pytest.raises(SequenceError) as e:
+        compile_sequence(source, 's0', INSTRUMENTS)
+    assert [error.split(':')[0] for error in e.value.errors] == ['line 1', 'line 2', 'line 3', 'line 5']
+    with pytest.raises(SequenceError):
+        compile_sequence('', 'nowhere', INSTRUMENTS)
+
+
+def test_load_reuses_plans_of_unchanged_files(tmp_path):
+    path = tmp_path / 'seq.txt'
+    path.write_text(SOURCE)
+    plan = load_sequence(str(path), 's0', INSTRUMENTS)
+    assert load_sequence(str(path), 's0', INSTRUMENTS) is plan
+    path.write_text(SOURCE + "vna idn\n")
+    assert load_sequence(str(path), 's0', INSTRUMENTS).n_commands == 5
+
+
+LAB = {'P1::INSTR': SimSpec('PowerSupply', 'p1'), 'V1::INSTR': SimSpec('VNA', 'v1')}
+
+
+def test_run_plan(start_lab):
+    async def main():
+        controller, client = await start_lab(LAB)
+        summary = await run_plan(client, compile_sequence(SOURCE, 's0', INSTRUMENTS), window=2)
+        await controller.shutdown_async()
+        return summary
+
+    summary = run(main())
+    assert (summary['station'], summary['steps'], summary['errors']) == ('s0', 4, 0)
+    assert [r['line'] for r in summary['results']] == [3, 4, 5, 7]
+
+
+def test_steps_time_out(start_lab):
+    async def main():
+        controller, client = await start_lab(LAB)
+        plan = compile_sequence('powersupply sleep 1\nvna idn\n', 's0', INSTRUMENTS)
+        summary = await run_plan(client, plan, timeout=0.2)
+        await controller.shutdown_async()
+        return summary
+
+    summary = run(main())
+    assert summary['errors'] == 1
+    assert summary['results'][0]['response'] == 'no response after 0.2 s'
+    assert not summary['results'][1]['error']
+
+
+def test_sequences_run_in_the_background(start_lab, tmp_path, monkeypatch):
+    monkeypatch.setattr(user_terminal, 'instr_dict', INSTRUMENTS)
+    path = tmp_path / 'seq.txt'
+    path.write_text('powersupply sleep 0.2\n')
+
+    async def main():
+        controller, client = await start_lab(LAB)
+        first = start_sequence(str(path), 's0', client)
+        second = start_sequence(str(path), 's0', client)
+        running = (not first.done(), len(user_terminal.sequences))
+        summaries = await asyncio.gather(first, second)
+        await controller.shutdown_async()
+        return running, summaries
+
+    running, summaries = run(main())
+    assert running == (True, 2) and not user_terminal.sequences
+    assert [s['errors'] for s in summaries] == [0, 0]
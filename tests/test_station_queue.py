@@ -0,0 +1,127 @@
+from collections import Counter
+
+import pytest
+
+from request_context import RequestContext, HIGH, NORMAL, LOW
+from station_queue import StationQueue
+
+
+def entry(cmd, **request):
+    return (cmd, None, (), {}, RequestContext(**request) if request else None)
+
+
+def queue(*items, mode='parallel', **kwargs):
+    q = StationQueue(mode, **kwargs)
+    for iid, cmd, request in items:
+        q.append((iid, entry(cmd, **request)))
+    return q
+
+
+def started(q, now=None):
+    ready, expired = q.pop_ready(now)
+    assert not expired
+    return [entry[0] for _, entry in ready]
+
+
+def test_parallel_runs_one_command_per_instrument():
+    q = queue(('a', 'a1', {}), ('a', 'a2', {}), ('b', 'b1', {}))
+    assert sorted(started(q)) == ['a1', 'b1']
+    assert started(q) == []
+    assert not q.runnable()
+    q.done('a')
+    assert started(q) == ['a2']
+    assert len(q) == 0
+
+
+def test_serial_runs_one_command_per_station_in_arrival_order():
+    q = queue(('a', 'a1', {}), ('b', 'b1', {}), ('a', 'a2', {}), mode='serial')
+    assert started(q) == ['a1']
+    assert started(q) == []
+    q.done('a')
+    assert started(q) == ['b1']
+    q.done('b')
+    assert started(q) == ['a2']
+
+
+def test_high_priority_jumps_the_queue():
+    q = queue(('a', 'normal', {}), ('a', 'low', {'priority': LOW}), ('a', 'high', {'priority': HIGH}))
+    assert q.depths() == [1, 1, 1]
+    assert q.head_priority() == HIGH
+    assert started(q) == ['high']
+    q.done('a')
+    assert started(q) == ['normal']
+    q.done('a')
+    assert started(q) == ['low']
+
+
+def test_serial_station_starts_the_most_urgent_instrument_first():
+    q = queue(('a', 'a1', {}), ('b', 'b1', {'priority': HIGH}), mode='serial')
+    assert started(q) == ['b1']
+
+
+def test_expired_commands_are_dropped_without_starting():
+    q = queue(('a', 'late', {'deadline': 1., 'correlation_id': 'c1'}), ('a', 'ok', {}))
+    ready, expired = q.pop_ready(now=2.)
+    assert [e[0] for _, e in expired] == ['late']
+    assert [e[0] for _, e in ready] == ['ok']
+    assert 'c1' not in q.outstanding
+
+
+def test_barrier_waits_for_earlier_commands_and_blocks_later_ones():
+    q = queue(('a', 'a1', {}), ('b', 'barrier', {'barrier': True}), ('c', 'c1', {}))
+    assert started(q) == ['a1']
+    q.done('a')
+    assert started(q) == ['barrier']
+    assert started(q) == []
+    q.done('b')
+    assert started(q) == ['c1']
+
+
+def test_high_priority_skips_barriers():
+    q = queue(('a', 'a1', {}), ('b', 'barrier', {'barrier': True}), ('c', 'stop', {'priority': HIGH}))
+    assert sorted(started(q)) == ['a1', 'stop']
+
+
+def test_after_waits_for_the_named_commands_in_any_station():
+    outstanding = Counter()
+    first = queue(('a', 'a1', {'correlation_id': 'x'}), outstanding=outstanding)
+    second = queue(('b', 'b1', {'after': ('x',)}), outstanding=outstanding)
+    assert started(second) == []
+    assert started(first) == ['a1']
+    assert started(second) == []
+    first.done('a')
+    assert not outstanding
+    assert started(second) == ['b1']
+
+
+def test_after_unknown_correlation_id_does_not_block():
+    q = queue(('a', 'a1', {'after': ('never-sent',)}))
+    assert started(q) == ['a1']
+
+
+def test_capacity_is_soft():
+    q = queue(('a', 'a1', {}), ('a', 'a2', {}), capacity=2)
+    assert q.full()
+    assert not q.full(0)
+    q.append(('a', entry('a3')))
+    assert len(q) == 3 and q.queued('a') == 3 and q.queued('b') == 0
+
+
+def test_commands_without_request():
+    q = queue(('a', 'a1', {}))
+    assert q.head_priority() == NORMAL
+    assert started(q) == ['a1']
+
+
+def test_invalid_mode():
+    with pytest.raises(ValueError):
+        StationQueue('fifo')
+
+
+def test_unordered_requests():
+    q = queue(('a', 'a1', {}))
+    assert q.unordered(None) and q.unordered(RequestContext())
+    assert not q.unordered(RequestContext(barrier=True))
+    assert not q.unordered(RequestContext(after=('x',)))
+    q.append(('b', entry('barrier', barrier=True)))
+    assert not q.unordered(RequestContext())
@@ -0,0 +1,48 @@
+import asyncio
+from array import array
+
+from sim_instruments import SimSpec
+from streams import StreamAssembler
+
+
+def chunk(offset, *values):
+    return {'offset': offset, 'data': array('d', values)}
+
+
+def test_chunks_are_delivered_in_order():
+    delivered = []
+    stream = StreamAssembler(on_chunk=lambda offset, data: delivered.append((offset, list(data))))
+    assert not stream.feed('s', 2, True, chunk(3, 4.))
+    assert not stream.feed('s', 0, False, chunk(0, 1., 2.))
+    assert delivered == [(0, [1., 2.])]
+    assert stream.feed('s', 1, False, chunk(2, 3.))
+    assert delivered == [(0, [1., 2.]), (2, [3.]), (3, [4.])]
+    assert list(stream.data) == [1., 2., 3., 4.]
+    assert (stream.name, stream.points, stream.chunks, stream.complete) == ('s', 4, 3, True)
+
+
+def test_memoryview_chunks_and_no_assembly():
+    stream = StreamAssembler(assemble=False)
+    assert stream.feed('s', 0, True, {'offset': 0, 'data': memoryview(array('d', [1., 2.]))})
+    assert stream.data is None and stream.points == 2
+    whole = StreamAssembler()
+    whole.feed('s', 0, True, {'offset': 0, 'data': memoryview(array('d', [1., 2.]))})
+    assert list(whole.data) == [1., 2.]
+
+
+def test_traces_are_streamed_to_the_client(start_lab):
+    async def main():
+        controller, client = await start_lab({'V1::INSTR': SimSpec('VNA', 'v1', trace_points=201)})
+        offsets = []
+        reply = await asyncio.wait_for(await client.stream('v1', 'trace', 'S11', 50,
+                                                           on_chunk=lambda offset, data: offsets.append(offset)), 5)
+        await controller.shutdown_async()
+        return reply, offsets
+
+    reply, offsets = asyncio.run(asyncio.wait_for(main(), 10))
+    assert not reply.error
+    body = reply.body
+    assert (body['stream'], body['points'], body['chunks']) == ('v1 / trace S11', 201, 5)
+    assert offsets == [0, 50, 100, 150, 200]
+    assert list(body['data']) == [float(f"{-1 - (i % 100) / 100:.6f}") for i in range(201)]
+    assert 0 < body['first_chunk_latency'] <= reply.latency
@@ -0,0 +1,208 @@
+import asyncio
+import os
+
+import pytest
+
+import codec
+import routing
+import transport
+from transport import LocalTransport, UnixSocketTransport, make_message
+
+
+def run(coro):
+    return asyncio.run(asyncio.wait_for(coro, 5))
+
+
+class Inbox:
+    """Callback collecting delivered messages, acknowledging them unless `ack` is False."""
+    def __init__(self, ack: bool=True) -> None:
+        self.messages = []
+        self.ack = ack
+        self._event = asyncio.Event()
+
+    async def __call__(self, message) -> None:
+        self.messages.append(message)
+        self._event.set()
+        if self.ack:
+            await message.ack()
+
+    async def wait(self, n: int=1) -> list:
+        while len(self.messages) < n:
+            self._event.clear()
+            await self._event.wait()
+        return self.messages
+
+    @property
+    def bodies(self) -> list:
+        return [m.body for m in self.messages]
+
+
+def command(body, **properties):
+    return make_message(codec.JSON.encode(body), content_type=codec.JSON.content_type, **properties)
+
+
+def test_local_commands_are_routed_by_binding():
+    async def main():
+        t = LocalTransport()
+        a, b = Inbox(), Inbox()
+        await t.consume(a, 'q_a', bindings=routing.CommandBindings([routing.binding_key('v1')]))
+        await t.consume(b, 'q_b', bindings=routing.CommandBindings([routing.binding_key('v2')]))
+        commands = await t.command_exchange()
+        await commands.publish(command('to v1'), routing.routing_key('v1'))
+        await commands.publish(command('to v2'), routing.routing_key('v2', 'station_0'))
+        await commands.publish(command('nobody'), routing.routing_key('v3'))
+        await a.wait()
+        await b.wait()
+        await asyncio.sleep(0)
+        await t.close()
+        # unroutable commands go to the controllers in turn
+        return sorted(a.bodies), sorted(b.bodies)
+
+    a, b = run(main())
+    assert b'"to v1"' in a and b'"to v2"' in b
+    assert (b'"nobody"' in a) != (b'"nobody"' in b)
+
+
+def test_local_replies_and_monitors():
+    async def main():
+        t = LocalTransport()
+        client, other, monitor = Inbox(), Inbox(), Inbox()
+        name = await t.reply_queue(client)
+        await t.reply_queue(other)
+        assert await t.reply_queue(monitor, monitor=True) is None
+        broadcast, reply = await t.response_exchanges()
+        response = make_message({'not': 'encoded'}, content_type=codec.OBJECT.content_type, correlation_id='c1')
+        await reply.publish(response, name)
+        await broadcast.publish(response, '')
+        await reply.publish(response, 'gone')     # reply queue that does not exist: dropped
+        await client.wait()
+        await monitor.wait()
+        await t.close()
+        return client.messages, other.messages, monitor.messages
+
+    client, other, monitor = run(main())
+    assert [m.body for m in client] == [{'not': 'encoded'}]
+    assert client[0].correlation_id == 'c1'
+    assert other == [] and len(monitor) == 1
+
+
+def test_local_prefetch_window():
+    async def main():
+        t = LocalTransport()
+        inbox = Inbox(ack=False)
+        await t.consume(inbox, 'q', prefetch_count=2)
+        commands = await t.command_exchange()
+        for i in range(4):
+            await commands.publish(command(i), routing.routing_key('v1'))
+        await inbox.wait(2)
+        await asyncio.sleep(0.01)
+        held = len(inbox.messages)
+        await inbox.messages[1].ack(multiple=True)
+        await inbox.wait(4)
+        await t.close()
+        return held
+
+    assert run(main()) == 2
+
+
+def test_local_close_ends_the_delivery_tasks():
+    async def main():
+        t = LocalTransport()
+        await t.consume(Inbox(), 'q')
+        await t.reply_queue(Inbox())
+        queues = [t._commands['q'][0], t._unrouted] + list(t._replies.values())
+        tasks = [q._task for q in queues]
+        await t.close()
+        return [task.done() for task in tasks], queues
+
+    done, queues = run(main())
+    assert all(done)
+    assert all(q._task is None and not q._consumers for q in queues)
+
+
+def test_frame_round_trip():
+    async def main():
+        message = command({'x': 1}, correlation_id='c1', reply_to='r', headers={'priority': 'high'})
+        reader = asyncio.StreamReader()
+        reader.feed_data(transport._frame('command', message, 'k') + transport._frame('monitor'))
+        reader.feed_eof()
+        first = await transport._read_frame(reader)
+        second = await transport._read_frame(reader)
+        with pytest.raises(asyncio.IncompleteReadError):
+            await transport._read_frame(reader)
+        return first, second
+
+    (header, message), (header2, message2) = run(main())
+    assert header['kind'] == 'command' and header['routing_key'] == 'k'
+    assert codec.decode(message.body, message.content_type) == {'x': 1}
+    assert (message.correlation_id, message.reply_to, message.headers) == ('c1', 'r', {'priority': 'high'})
+    assert header2 == {'kind': 'monitor'} and message2 is None
+
+
+def test_frames_need_encoded_bodies():
+    with pytest.raises(codec.CodecError):
+        transport._frame('response', make_message({'x': 1}, content_type=codec.OBJECT.content_type))
+
+
+def test_unix_socket_round_trip(tmp_path):
+    path = str(tmp_path / 'lab.sock')
+
+    async def main():
+        server = UnixSocketTransport(path)
+        commands_in = Inbox()
+        consumer = await server.consume(commands_in, 'q')
+        client, monitor_client = UnixSocketTransport(path), UnixSocketTransport(path)
+        replies, monitored = Inbox(), Inbox()
+        name = await client.reply_queue(replies)
+        assert await monitor_client.reply_queue(monitored, monitor=True) is None
+        commands = await client.command_exchange()
+        await commands.publish(command('idn', reply_to=name, correlation_id='c1'), routing.routing_key('v1'))
+        received, = await commands_in.wait()
+        while not server._monitors:     # the monitor request travels on the other connection
+            await asyncio.sleep(0.001)
+        broadcast, reply = await server.response_exchanges()
+        response = command('VNA-1234', correlation_id=received.correlation_id)
+        await reply.publish(response, received.reply_to)
+        await broadcast.publish(response, '')
+        await replies.wait()
+        await monitored.wait()
+        await client.close()
+        await monitor_client.close()
+        delivery_task = server._commands._task
+        await consumer.cancel()
+        await server.close()
+        await asyncio.sleep(0)
+        return received, replies.messages, monitored.messages, delivery_task.done()
+
+    received, replies, monitored, delivered = run(main())
+    assert codec.decode(received.body) == 'idn'
+    assert [codec.decode(m.body) for m in replies] == ['VNA-1234']
+    assert replies[0].correlation_id == 'c1'
+    assert len(monitored) == 1
+    assert delivered
+    assert not os.path.exists(path)
+
+
+def test_unix_close_without_cancelling_the_consumer(tmp_path):
+    # the controller cancels its consume task before closing the transport, so close must stop
+    # the delivery task itself
+    path = str(tmp_path / 'lab.sock')
+
+    async def main():
+        server = UnixSocketTransport(path)
+        await server.consume(Inbox(), 'q')
+        task = server._commands._task
+        await server.close()
+        return task.done()   # checked before asyncio.run cancels the tasks left over
+
+    assert run(main())
+    assert not os.path.exists(path)
+
+
+def test_from_uri(tmp_path):
+    assert transport.from_uri('local://a') is transport.from_uri('local://a')
+    assert transport.from_uri('local://a') is not transport.from_uri('local://b')
+    unix = transport.from_uri(f"unix://{tmp_path}/lab.sock")
+    assert isinstance(unix, UnixSocketTransport) and unix.path == f"{tmp_path}/lab.sock"
+    local = LocalTransport()
+    assert transport.as_transport(local) is local
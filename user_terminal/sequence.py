@@ -0,0 +1,132 @@
+"""
+Compiling test sequence files (see example_test.txt) into validated plans.
+
+A sequence file has one step per line:
+    <alias> <cmd> [<arg1> <arg2> ...]   : send <cmd> to the instrument <alias> of the station
+    print <text>                        : print <text> when the step is reached
+    barrier                             : the next command waits for every earlier command to
+                                          finish, and every later command waits for it
+Blank lines and lines starting with '#' are ignored. Arguments are parsed as Python literals
+(numbers, strings, True/False/None, ...) and fall back to plain strings.
+
+Commands to different instruments may run concurrently; commands to the same instrument always run
+in order. A command can be named with a `<label>:` prefix, and made to wait for earlier named
+commands with a trailing `after:<label>[,<label>...]`, e.g.
+    on: powersupply set_output 1
+    vna s11 results.s1p after:on
+"""
+from typing import Optional, NamedTuple, Any
+import ast
+import hashlib
+
+
+class SequenceError(ValueError):
+    """Raised when a sequence file does not compile. `errors` lists every problem found."""
+    def __init__(self, errors: list) -> None:
+        super().__init__("Invalid sequence file!\n\t" + "\n\t".join(errors))
+        self.errors = errors
+
+
+class Step(NamedTuple):
+    lineno: int
+    kind: str               # 'cmd' or 'print'
+    iid: Optional[str]
+    cmd: Optional[str]
+    args: tuple
+    text: str               # source line (or text to print)
+    label: Optional[str]=None
+    after: tuple=()         # labels of the steps that must finish first
+    barrier: bool=False
+
+
+class Plan(NamedTuple):
+    digest: str             # sha256 of the source
+    station: str
+    steps: tuple
+
+    @property
+    def n_commands(self) -> int:
+        return sum(1 for step in self.steps if step.kind == 'cmd')
+
+
+def parse_arg(arg: str) -> Any:
+    """Parse a command argument as a Python literal, or keep it as a string."""
+    try:
+        return ast.literal_eval(arg)
+    except (ValueError, SyntaxError):
+        return arg
+
+
+def compile_sequence(text: str, station: str, instr_dict: dict) -> Plan:
+    """
+    Compile the source of a sequence file for `station`, resolving aliases through
+    `instr_dict[station]` (station 'raw' uses instrument IDs directly). Raises `SequenceError`
+    listing every invalid line.
+    """
+    if station not in instr_dict:
+        raise SequenceError([f"Invalid station name ({station}). Valid station names are {list(instr_dict)}."])
+    aliases = instr_dict[station]
+    steps = []
+    errors = []
+    labels = set()
+    barrier = False
+    for lineno, line in enumerate(text.splitlines(), 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        if line.lower() == 'barrier':
+            barrier = True
+            continue
+        cmd_list = line.split(maxsplit=1)
+        label = None
+        if cmd_list[0].endswith(':') and len(cmd_list) == 2:
+            label = cmd_list[0][:-1]
+            if not label or label in labels:
+                errors.append(f"line {lineno}: invalid or duplicate label ({label})")
+                continue
+            cmd_list = cmd_list[1].split(maxsplit=1)
+        if len(cmd_list) == 1:
+            errors.append(f"line {lineno}: too few arguments: {line}")
+            continue
+        alias, cmdargs = cmd_list
+        if alias.lower() == 'print':
+            steps.append(Step(lineno, 'print', None, None, (), cmdargs))
+            continue
+        if station == 'raw':
+            iid = alias
+        else:
+            try:
+                iid = aliases[alias]
+            except KeyError:
+                errors.append(f"line {lineno}: invalid alias ({alias}). Valid aliases are {list(aliases)}.")
+                continue
+        cmd, *args = cmdargs.split()
+        after = ()
+        if args and args[-1].startswith('after:'):
+            after = tuple(dep for dep in args.pop()[len('after:'):].split(',') if dep)
+            unknown = [dep for dep in after if dep not in labels]
+            if unknown:
+                errors.append(f"line {lineno}: unknown labels {unknown} (labels must be defined on earlier lines)")
+                continue
+        if label is not None:
+            labels.add(label)
+        steps.append(Step(lineno, 'cmd', iid, cmd, tuple(parse_arg(arg) for arg in args), line,
+                          label, after, barrier))
+        barrier = False
+    if errors:
+        raise SequenceError(errors)
+    return Plan(hashlib.sha256(text.encode()).hexdigest(), station, tuple(steps))
+
+
+_plans = {}  # (sha256 of source, station) -> Plan
+
+def load_sequence(fname: str, station: str, instr_dict: dict) -> Plan:
+    """Compile the sequence file `fname` for `station`, reusing the plan if the file is unchanged."""
+    with open(fname, 'rb') as f:
+        source = f.read()
+    key = (hashlib.sha256(source).hexdigest(), station)
+    try:
+        return _plans[key]
+    except KeyError:
+        plan = _plans[key] = compile_sequence(source.decode(), station, instr_dict)
+        return plan
@@ -0,0 +1,57 @@
+"""
+Client side of streamed responses.
+
+Long results (e.g. VNA traces) arrive as a series of chunk messages with 'stream', 'stream_seq' and
+'stream_final' headers, each with a body {'offset': <index of its first value>, 'data': <values>}.
+`StreamAssembler` puts the chunks back in order and hands them on as they become available.
+"""
+from typing import Optional, Callable, Any
+import time
+from array import array
+
+
+class StreamAssembler:
+    """
+    Reassembles one stream. Chunks are passed to `on_chunk(offset, data)` in order as soon as they
+    are contiguous, so they can be processed incrementally; if `assemble`, the values are also
+    collected into `data` (an `array('d')`) to rebuild the whole trace.
+    """
+    def __init__(self, on_chunk: Optional[Callable[[int, Any], None]]=None, assemble: bool=True) -> None:
+        self.name = None
+        self.on_chunk = on_chunk
+        self.data = array('d') if assemble else None
+        self.points = 0
+        self.chunks = 0
+        self.first_arrival = None  # time.perf_counter() when the first chunk arrived
+        self._next = 0          # next chunk number to deliver
+        self._early = {}        # chunks received ahead of `_next`
+        self._final = None      # number of the last chunk, once received
+
+    @property
+    def complete(self) -> bool:
+        return (self._final is not None) and (self._next > self._final)
+
+    def feed(self, name: str, seq: int, final: bool, body: dict) -> bool:
+        """Add chunk `seq` of the stream; returns True once every chunk has been delivered."""
+        self.name = name
+        if self.first_arrival is None:
+            self.first_arrival = time.perf_counter()
+        self._early[seq] = body
+        if final:
+            self._final = seq
+        while self._next in self._early:
+            self._deliver(self._early.pop(self._next))
+            self._next += 1
+        return self.complete
+
+    def _deliver(self, body: dict) -> None:
+        data = body['data']
+        if self.on_chunk is not None:
+            self.on_chunk(body['offset'], data)
+        if self.data is not None:
+            if isinstance(data, memoryview) and data.format == 'd':
+                self.data.frombytes(data.cast('B'))
+            else:
+                self.data.extend(data)
+        self.points += len(data)
+        self.chunks += 1